@@ -0,0 +1,125 @@
+"""
+Per-trial resource accounting, and a summary of the resources a whole run used.
+"""
+
+import heapq
+import sys
+from typing import Any, Dict, List, Optional, Tuple
+
+# Resource fields added to the result of every trial that runs.
+RESOURCE_FIELDS = (
+    "wall_seconds",
+    "user_seconds",
+    "system_seconds",
+    "max_rss_bytes",
+    "spawn_seconds",
+)
+
+# ru_maxrss is in kilobytes on Linux, but in bytes on macOS.
+MAXRSS_MULTIPLIER = 1 if sys.platform == "darwin" else 1024
+
+DEFAULT_SLOWEST_TRIALS = 5
+
+
+def resource_fields(
+    usage: Optional[Any], wall_seconds: float, spawn_seconds: float
+) -> Dict[str, Any]:
+    """
+    Build the resource fields of a trial's result.
+
+    Parameters
+    ----------
+    usage
+        The `resource.struct_rusage` of the trial's process, as returned by
+        `os.wait4`, or None where that is unavailable. This covers the process and
+        every descendant it waited for. On Linux, its peak memory includes the
+        memory of the process which forked it, as of the fork.
+    wall_seconds
+        How long the trial took, from just before it was started until it exited.
+    spawn_seconds
+        How long it took to start the trial's process.
+
+    Returns
+    -------
+    Dict[str, Any]
+        The values of `RESOURCE_FIELDS`. CPU times and peak memory are None if
+        `usage` is.
+    """
+    fields: Dict[str, Any] = {
+        "wall_seconds": wall_seconds,
+        "user_seconds": None,
+        "system_seconds": None,
+        "max_rss_bytes": None,
+        "spawn_seconds": spawn_seconds,
+    }
+    if usage is not None:
+        fields["user_seconds"] = usage.ru_utime
+        fields["system_seconds"] = usage.ru_stime
+        fields["max_rss_bytes"] = usage.ru_maxrss * MAXRSS_MULTIPLIER
+    return fields
+
+
+class ResourceSummary:
+    """
+    Accumulates the resources used by the trials of a run, keeping only totals and
+    the slowest few trials, so memory stays constant however long the run is.
+    """
+
+    def __init__(self, slowest: int = DEFAULT_SLOWEST_TRIALS):
+        self.slowest = slowest
+        self.trials = 0
+        self.cached_trials = 0
+        self.duplicate_trials = 0
+        self.wall_seconds = 0.0
+        self.cpu_seconds = 0.0
+        self.max_rss_bytes = 0
+        # A min-heap of (wall_seconds, order, step, command) for the slowest trials.
+        # Ties are broken by the order trials were recorded in, since steps may not
+        # be comparable (e.g. those of pipeline stages).
+        self._slowest: List[Tuple[float, int, Any, str]] = []
+
+    def record(self, output: Dict[str, Any]) -> None:
+        """
+        Add a completed trial, given its result (or at least its step, command and
+        resource fields).
+        """
+        self.trials += 1
+        if output.get("duplicate_of") is not None:
+            self.duplicate_trials += 1
+            return
+        if output.get("cached"):
+            self.cached_trials += 1
+            return
+
+        wall_seconds = output.get("wall_seconds")
+        if wall_seconds is None:
+            return
+        self.wall_seconds += wall_seconds
+        self.cpu_seconds += (output.get("user_seconds") or 0.0) + (
+            output.get("system_seconds") or 0.0
+        )
+        self.max_rss_bytes = max(self.max_rss_bytes, output.get("max_rss_bytes") or 0)
+
+        entry = (wall_seconds, self.trials, output["step"], output["command"])
+        if len(self._slowest) < self.slowest:
+            heapq.heappush(self._slowest, entry)
+        elif entry > self._slowest[0]:
+            heapq.heapreplace(self._slowest, entry)
+
+    def format(self) -> str:
+        """
+        Describe the run's resource use, for printing at the end of a run.
+        """
+        lines = [
+            f"=== Trials: {self.trials} ({self.cached_trials} from cache, "
+            f"{self.duplicate_trials} duplicates)",
+            f"=== Total wall time: {self.wall_seconds:.2f}s",
+            f"=== Total CPU time: {self.cpu_seconds / 3600:.4f} CPU-hours "
+            f"({self.cpu_seconds:.2f}s)",
+            f"=== Peak memory of any trial: {self.max_rss_bytes / (1 << 20):.1f} MiB",
+        ]
+        if self._slowest:
+            lines.append("=== Slowest trials:")
+            for wall_seconds, _, step, command in sorted(self._slowest, reverse=True):
+                lines.append(f"  {wall_seconds:8.2f}s  [{step}] {command}")
+        return "\n".join(lines)
@@ -0,0 +1,203 @@
+"""
+A persistent, on-disk cache of command results, keyed by the concrete command string.
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+from typing import Any, Dict, Iterable, Optional
+
+from argsearch.accounting import RESOURCE_FIELDS
+
+try:
+    import fcntl
+except ImportError:  # Not available on Windows; eviction then runs without a lock.
+    fcntl = None  # type: ignore
+
+ENTRY_SUFFIX = ".json"
+LOCK_NAME = ".lock"
+
+# Eviction brings the cache down to this fraction of its limit, so that it isn't
+# needed again for a while.
+EVICT_TO_FRACTION = 0.9
+# The most entries stored between scans of the cache directory. Between scans, its
+# size is estimated from what this process stored, which misses what other processes
+# (such as other workers) stored.
+SCAN_INTERVAL = 100
+
+# The fields of a command result that are stored in and restored from the cache.
+# Entries written by older versions may lack the resource fields, and only results of
+# Python targets have a return value.
+CACHED_FIELDS = ("stdout", "stderr", "returncode", "return_value") + RESOURCE_FIELDS
+
+
+def fingerprint(paths: Iterable[str] = (), env_names: Iterable[str] = ()) -> str:
+    """
+    Summarize the files and environment variables a command depends on.
+
+    Parameters
+    ----------
+    paths
+        Files whose contents should invalidate cached results when they change.
+    env_names
+        Environment variables whose values should invalidate cached results when they
+        change.
+
+    Returns
+    -------
+    str
+        A hex digest which changes whenever any of the inputs change.
+    """
+    digest = hashlib.sha256()
+    for path in sorted(paths):
+        digest.update(f"file:{path}\0".encode())
+        with open(path, "rb") as file:
+            for chunk in iter(lambda: file.read(1 << 20), b""):
+                digest.update(chunk)
+    for name in sorted(env_names):
+        digest.update(f"env:{name}={os.environ.get(name)}\0".encode())
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """
+    Stores command results as one JSON file per concrete command in a directory.
+
+    Entries are written atomically (to a temporary file, then renamed into place), so
+    several argsearch processes may safely share the same cache directory. When
+    `max_bytes` is set, the least-recently-used entries are evicted to keep the cache
+    under that size. Rather than measuring the cache after every new entry, its size
+    is estimated, and only measured again when the estimate passes `max_bytes` or
+    after `SCAN_INTERVAL` new entries.
+    """
+
+    def __init__(
+        self, directory: str, max_bytes: Optional[int] = None, fingerprint: str = ""
+    ):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.fingerprint = fingerprint
+        os.makedirs(directory, exist_ok=True)
+        # The estimated size of the cache, or None if it hasn't been measured yet.
+        self._estimated_bytes: Optional[int] = None
+        self._puts_since_scan = 0
+
+    def _path(self, command: str) -> str:
+        key = hashlib.sha256(f"{self.fingerprint}\0{command}".encode()).hexdigest()
+        return os.path.join(self.directory, key + ENTRY_SUFFIX)
+
+    def get(self, command: str) -> Optional[Dict[str, Any]]:
+        """
+        Look up the cached result of a command.
+
+        Parameters
+        ----------
+        command
+            The concrete command string, with all templates substituted.
+
+        Returns
+        -------
+        Optional[Dict[str, Any]]
+            The cached stdout, stderr, returncode and resource usage, or None on a
+            cache miss.
+        """
+        path = self._path(command)
+        try:
+            with open(path, encoding="utf-8") as file:
+                entry = json.load(file)
+            os.utime(path)  # Mark as recently used.
+        except (OSError, ValueError):
+            return None
+
+        if entry.get("command") != command:
+            return None
+        return {field: entry[field] for field in CACHED_FIELDS if field in entry}
+
+    def put(self, command: str, result: Dict[str, Any]) -> None:
+        """
+        Store the result of a command, evicting old entries if the cache is too big.
+
+        Results from commands killed by a signal (negative return codes) are not
+        stored, since they are not a property of the command.
+
+        Parameters
+        ----------
+        command
+            The concrete command string, with all templates substituted.
+        result
+            A command result, containing at least stdout, stderr and returncode, and
+            optionally resource usage.
+        """
+        if result["returncode"] < 0:
+            return
+
+        entry = {field: result[field] for field in CACHED_FIELDS if field in result}
+        entry["command"] = command
+
+        file_descriptor, temp_path = tempfile.mkstemp(
+            dir=self.directory, prefix=".tmp-"
+        )
+        try:
+            with os.fdopen(file_descriptor, "w", encoding="utf-8") as file:
+                json.dump(entry, file)
+            entry_bytes = os.path.getsize(temp_path)
+            os.replace(temp_path, self._path(command))
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+
+        if self.max_bytes is None:
+            return
+        self._puts_since_scan += 1
+        if self._estimated_bytes is not None:
+            self._estimated_bytes += entry_bytes
+        if (
+            self._estimated_bytes is None
+            or self._estimated_bytes > self.max_bytes
+            or self._puts_since_scan >= SCAN_INTERVAL
+        ):
+            self.evict()
+
+    def evict(self) -> None:
+        """
+        If the cache doesn't fit in `max_bytes`, delete least-recently-used entries
+        until it fits in `EVICT_TO_FRACTION` of it.
+
+        If another process is already evicting from this cache, return immediately.
+        """
+        if self.max_bytes is None:
+            return
+        self._puts_since_scan = 0
+
+        with open(os.path.join(self.directory, LOCK_NAME), "a") as lock_file:
+            if fcntl is not None:
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    return
+
+            entries = []
+            total_bytes = 0
+            for dir_entry in os.scandir(self.directory):
+                if not dir_entry.name.endswith(ENTRY_SUFFIX):
+                    continue
+                try:
+                    stat = dir_entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, dir_entry.path))
+                total_bytes += stat.st_size
+
+            if total_bytes > self.max_bytes:
+                target_bytes = self.max_bytes * EVICT_TO_FRACTION
+                entries.sort()
+                for _, size, path in entries:
+                    if total_bytes <= target_bytes:
+                        break
+                    try:
+                        os.unlink(path)
+                    except FileNotFoundError:
+                        pass
+                    total_bytes -= size
+            self._estimated_bytes = total_bytes
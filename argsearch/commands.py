@@ -2,15 +2,155 @@
 Functions to run user commands.
 """
 
+import collections
+import contextlib
+import functools
 import json
 import multiprocessing
+import multiprocessing.pool
+import os
+import queue
+import signal
 import subprocess
 import sys
-from typing import Any, Dict, List, Optional, Tuple
+import threading
+import time
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    TypeVar,
+    Union,
+)
 
 from tqdm import tqdm
 
-from argsearch import strategies
+from argsearch import accounting, pipelines, pruning, python_targets, streams, tracing
+from argsearch.cache import ResultCache
+from argsearch.dedup import Deduplicator
+from argsearch.slots import SLOT_TEMPLATE, Slot
+from argsearch.templates import CommandTemplate
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+# Commands currently running in this process. Every command is started in its own
+# process group, so these can be killed along with anything they've started.
+_running_processes: Set[subprocess.Popen] = set()
+_running_processes_lock = threading.Lock()
+
+
+def kill_process_group(process: subprocess.Popen) -> None:
+    """
+    Kill a process started with `start_new_session=True`, along with any processes it
+    has started in turn.
+    """
+    if hasattr(os, "killpg"):
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+    else:
+        process.kill()
+
+
+def kill_running_processes() -> None:
+    """
+    Kill every command (and its descendants) currently running in this process.
+    """
+    with _running_processes_lock:
+        processes = list(_running_processes)
+    for process in processes:
+        kill_process_group(process)
+
+
+@contextlib.contextmanager
+def _track_process(
+    process: subprocess.Popen, timeout: Optional[float] = None
+) -> Iterator[threading.Event]:
+    """
+    Register a running command so it can be killed on cancellation, and kill it if it
+    runs for longer than `timeout` seconds or an exception interrupts the wait.
+
+    Yields
+    ------
+    threading.Event
+        Set if the command was killed for exceeding its timeout.
+    """
+    timed_out = threading.Event()
+
+    def expire():
+        timed_out.set()
+        kill_process_group(process)
+
+    timer = None
+    if timeout is not None:
+        timer = threading.Timer(timeout, expire)
+        timer.daemon = True
+        timer.start()
+
+    with _running_processes_lock:
+        _running_processes.add(process)
+    try:
+        yield timed_out
+    except BaseException:
+        # E.g. a KeyboardInterrupt while waiting: don't leave the command running.
+        kill_process_group(process)
+        raise
+    finally:
+        if timer:
+            timer.cancel()
+        with _running_processes_lock:
+            _running_processes.discard(process)
+
+
+class GracefulInterrupt:
+    """
+    A context manager which makes Ctrl-C stop a run gracefully.
+
+    The first interrupt only sets `draining`, which callers check to stop dispatching
+    new trials while letting running ones finish. A second interrupt raises
+    KeyboardInterrupt as usual, after which callers should kill running commands.
+    """
+
+    def __init__(self):
+        self.draining = False
+        self._previous_handler = None
+
+    def _handle(self, signum, frame):
+        if self.draining:
+            raise KeyboardInterrupt
+        self.draining = True
+        sys.stderr.write(
+            "\nFinishing running trials; interrupt again to stop them immediately.\n"
+        )
+        sys.stderr.flush()
+
+    def __enter__(self) -> "GracefulInterrupt":
+        # Signal handlers can only be installed from the main thread.
+        if threading.current_thread() is threading.main_thread():
+            self._previous_handler = signal.signal(signal.SIGINT, self._handle)
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        if self._previous_handler is not None:
+            signal.signal(signal.SIGINT, self._previous_handler)
+
+    def until_draining(self, iterable: Iterable[T]) -> Iterator[T]:
+        """
+        Yield from `iterable` until the first interrupt arrives.
+        """
+        for item in iterable:
+            if self.draining:
+                return
+            yield item
 
 
 def format_header(step: int, command: str, substitutions: Dict[str, str]):
@@ -42,41 +182,242 @@ def apply_substitutions(command: str, substitutions: Dict[str, str]) -> str:
     return command
 
 
+def _render_command(
+    command_template: Union[str, CommandTemplate],
+    substitutions: Dict[str, str],
+    slot: Optional[Slot],
+) -> Tuple[str, Union[str, List[str]]]:
+    """
+    Fill in a command template, returning the command string and what to run; see
+    `CommandTemplate.render`.
+    """
+    substitutions = _slot_substitutions(substitutions, slot)
+    if isinstance(command_template, CommandTemplate):
+        return command_template.render(substitutions)
+    command = apply_substitutions(command_template, substitutions)
+    return command, command
+
+
+def _start_process(
+    command: Union[str, List[str]], slot: Optional[Slot] = None, **kwargs: Any
+) -> subprocess.Popen:
+    """
+    Start a command in its own process group, so that it can be killed along with
+    anything it starts, optionally confined to the cores of a slot.
+
+    A string is run by the shell, and a list of arguments is run directly.
+    """
+    shell = isinstance(command, str)
+    if slot is None:
+        return subprocess.Popen(command, shell=shell, start_new_session=True, **kwargs)
+
+    env = {**os.environ, **slot.environment()}
+    if not hasattr(os, "sched_setaffinity"):
+        return subprocess.Popen(
+            command, shell=shell, start_new_session=True, env=env, **kwargs
+        )
+
+    # The child inherits the affinity of the thread that starts it. On Linux this only
+    # applies to the calling thread, so concurrent threads don't interfere.
+    previous = os.sched_getaffinity(0)
+    os.sched_setaffinity(0, slot.cores)
+    try:
+        return subprocess.Popen(
+            command, shell=shell, start_new_session=True, env=env, **kwargs
+        )
+    finally:
+        os.sched_setaffinity(0, previous)
+
+
+def _start_failure(runnable: Union[str, List[str]], error: OSError) -> Tuple[int, str]:
+    """
+    Describe a command run without the shell which couldn't be started, as the shell
+    would: with return code 127 if its program wasn't found, or else 126, and a message
+    for its stderr.
+    """
+    program = runnable[0] if isinstance(runnable, list) else runnable
+    returncode = 127 if isinstance(error, FileNotFoundError) else 126
+    return returncode, f"{program}: {error.strerror}\n"
+
+
+def _exit_code(status: int) -> int:
+    """
+    Convert a wait status into a return code, as `subprocess` reports it.
+    """
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status)
+    return os.WEXITSTATUS(status)
+
+
+def _wait_with_usage(process: subprocess.Popen) -> Tuple[int, Optional[Any]]:
+    """
+    Wait for a command to exit.
+
+    Returns
+    -------
+    Tuple[int, Optional[resource.struct_rusage]]
+        The command's return code, and the resources used by it and every descendant
+        it waited for, or None where `os.wait4` is unavailable.
+    """
+    if not hasattr(os, "wait4"):
+        return process.wait(), None
+    try:
+        _, status, usage = os.wait4(process.pid, 0)
+    except ChildProcessError:
+        # Already reaped, e.g. by `subprocess`.
+        return process.wait(), None
+    process.returncode = _exit_code(status)
+    return process.returncode, usage
+
+
+def _slot_substitutions(
+    substitutions: Dict[str, str], slot: Optional[Slot]
+) -> Dict[str, str]:
+    if slot is None:
+        return substitutions
+    return {**substitutions, SLOT_TEMPLATE: str(slot.number)}
+
+
+def _forward_lines(stream, lines: List[str]) -> None:
+    """
+    Copy lines from `stream` to stderr as they arrive, also collecting them.
+    """
+    for line in stream:
+        lines.append(line)
+        sys.stderr.write(line)
+        sys.stderr.flush()
+
+
 def stream_command(
-    command_template: str, substitutions: Dict[str, str], step: int, monitor: tqdm
-) -> None:
+    command_template: Union[str, CommandTemplate],
+    substitutions: Dict[str, str],
+    step: int,
+    monitor: tqdm,
+    cache: Optional[ResultCache] = None,
+    timeout: Optional[float] = None,
+    slot: Optional[Slot] = None,
+) -> Dict[str, Any]:
     """
     Run a command string, streaming output to stdout.
 
     Parameters
     ----------
     command_template
-        A string to be executed as a subprocess, with "{arg}" bracketed templates.
+        A string to be executed as a subprocess, with "{arg}" bracketed templates, or
+        a `CommandTemplate`.
     substitutions
         A set of substitutions to apply to the command template.
     step
         Which step of the search we're on.
     monitor
         A handle to the parent progress bar.
+    cache
+        If provided, replay the command's output from this cache when possible, and
+        store it there otherwise.
+    timeout
+        If provided, kill the command if it runs for longer than this many seconds.
+    slot
+        If provided, run the command on this slot's CPU cores; see `capture_command`.
+
+    Returns
+    -------
+    Dict[str, Any]
+        The command's step, command string, start time ("started_at", in seconds
+        since the epoch) and resource usage (see `accounting.RESOURCE_FIELDS`), marked
+        with `"cached": True` if its output was replayed from `cache`.
     """
-    command = apply_substitutions(command_template, substitutions)
+    command, runnable = _render_command(command_template, substitutions, slot)
     monitor.write(format_header(step, command, substitutions))
-    process = subprocess.Popen(
-        command, shell=True, stdout=subprocess.PIPE, encoding="utf-8",
-    )
+
+    if cache:
+        cached = cache.get(command)
+        if cached:
+            monitor.write(cached["stdout"], end="")
+            if cached["stderr"]:
+                sys.stderr.write(cached["stderr"])
+                sys.stderr.flush()
+            return {"step": step, "command": command, "cached": True}
+
+    started_at = time.time()
+    start_time = time.perf_counter()
+    try:
+        process = _start_process(
+            runnable,
+            slot,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE if cache else None,
+            encoding="utf-8",
+        )
+    except OSError as error:
+        # Reported as a failed trial, as the shell would, rather than ending the search.
+        returncode, message = _start_failure(runnable, error)
+        sys.stderr.write(message)
+        sys.stderr.flush()
+        resources = accounting.resource_fields(
+            None, time.perf_counter() - start_time, 0.0
+        )
+        if cache:
+            cache.put(
+                command,
+                {
+                    "stdout": "",
+                    "stderr": message,
+                    "returncode": returncode,
+                    **resources,
+                },
+            )
+        return {"step": step, "command": command, "started_at": started_at, **resources}
+    spawn_seconds = time.perf_counter() - start_time
+
+    # When caching, stderr must be captured too, so forward it from a thread.
+    stdout_lines: List[str] = []
+    stderr_lines: List[str] = []
+    if cache:
+        stderr_thread = threading.Thread(
+            target=_forward_lines, args=(process.stderr, stderr_lines), daemon=True
+        )
+        stderr_thread.start()
 
     assert process.stdout
-    for line in process.stdout:
-        monitor.write(line, end="")
+    with _track_process(process, timeout) as timed_out:
+        for line in process.stdout:
+            stdout_lines.append(line)
+            monitor.write(line, end="")
+        _, usage = _wait_with_usage(process)
+    resources = accounting.resource_fields(
+        usage, time.perf_counter() - start_time, spawn_seconds
+    )
 
-    process.wait()
+    if timed_out.is_set():
+        sys.stderr.write(f"--- [{step}] timed out after {timeout} seconds\n")
+        sys.stderr.flush()
+
+    if cache:
+        stderr_thread.join()
+        cache.put(
+            command,
+            {
+                "stdout": "".join(stdout_lines),
+                "stderr": "".join(stderr_lines),
+                "returncode": process.returncode,
+                **resources,
+            },
+        )
+    return {"step": step, "command": command, "started_at": started_at, **resources}
 
 
 def capture_command(
-    command_template: str,
+    command_template: Union[str, CommandTemplate],
     substitutions: Dict[str, str],
     step: int,
     monitor: Optional[tqdm],
+    cache: Optional[ResultCache] = None,
+    output_dir: Optional[str] = None,
+    compression: Optional[str] = None,
+    tail_bytes: int = streams.DEFAULT_TAIL_BYTES,
+    metric_watcher: Optional[pruning.MetricWatcher] = None,
+    timeout: Optional[float] = None,
+    slot: Optional[Slot] = None,
 ) -> Dict[str, Any]:
     """
     Run a command string, capturing and formatting any output.
@@ -84,62 +425,442 @@ def capture_command(
     Parameters
     ----------
     command_template
-        A string to be executed as a subprocess, with "{arg}" bracketed templates.
+        A string to be executed as a subprocess, with "{arg}" bracketed templates, or
+        a `CommandTemplate`.
     substitutions
         A set of substitutions to apply to the command template.
     step
         Which step of the search we're on.
     monitor
         An optional handle to the parent progress bar.
+    cache
+        If provided, return the command's result from this cache when possible
+        (marked with `"cached": True`), and store it there otherwise.
+    output_dir
+        If provided, write the command's stdout and stderr to files in this directory
+        (named after `step`) instead of holding them in memory. The result then only
+        contains the last `tail_bytes` bytes of each stream, plus "stdout_path" and
+        "stderr_path" pointing to the full output.
+    compression
+        If provided along with `output_dir`, compress the output files with this
+        format (one of `streams.COMPRESSIONS`).
+    tail_bytes
+        How much of the end of each stream to keep when using `output_dir`.
+    metric_watcher
+        If provided, parse intermediate metrics from the command's stdout while it
+        runs, and kill it early if the watcher says to. The result then contains the
+        reported "metrics", and whether the command was "pruned".
+    timeout
+        If provided, kill the command if it runs for longer than this many seconds,
+        and mark the result with `"timed_out": True`.
+    slot
+        If provided, pin the command to this slot's CPU cores, substitute the slot's
+        index for the "{slot}" template, and set thread-count environment variables to
+        the slot's size. The result then records the "slot" index.
+
+    If `command_template` is a Python target (see `python_targets`), its function is
+    called in this process instead of starting a command, and the result records its
+    "return_value". Python targets can't be used with `timeout` or `metric_watcher`.
 
     Returns
     -------
     Dict[str, str]
-        The results of evaluating the command with substitution.
+        The results of evaluating the command with substitution, including its start
+        time ("started_at", in seconds since the epoch) and resource usage (see
+        `accounting.RESOURCE_FIELDS`).
     """
-    command = apply_substitutions(command_template, substitutions)
+    command, runnable = _render_command(command_template, substitutions, slot)
+    python_target = isinstance(command_template, CommandTemplate) and (
+        command_template.python
+    )
+    if python_target and (timeout is not None or metric_watcher):
+        raise ValueError("Python targets can't be stopped by timeouts or pruning.")
     if monitor:
         monitor.set_description(command)
-    command_result = subprocess.run(
-        command,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-        shell=True,
-        encoding="utf-8",
-    )
 
-    return {
+    if cache:
+        cached = cache.get(command)
+        if cached:
+            result = {
+                "step": step,
+                "command": command,
+                "substitutions": substitutions,
+                **cached,
+                "cached": True,
+            }
+            if slot is not None:
+                result["slot"] = slot.number
+            return result
+
+    process: Optional[subprocess.Popen] = None
+
+    def watch_line(line: str) -> None:
+        assert metric_watcher and process
+        if metric_watcher.observe(line):
+            kill_process_group(process)
+
+    collectors = {}
+    for stream_name in ("stdout", "stderr"):
+        path = None
+        if output_dir:
+            extension = streams.COMPRESSIONS.get(compression, "")  # type: ignore
+            filename = f"{step}.{stream_name}{extension}"
+            path = os.path.abspath(os.path.join(output_dir, filename))
+        on_line = watch_line if metric_watcher and stream_name == "stdout" else None
+        collectors[stream_name] = streams.OutputCollector(
+            path, compression, tail_bytes, on_line
+        )
+
+    if python_target:
+        # Imported once per process, before the first trial's clock starts.
+        python_targets.load_function(runnable[0])
+    started_at = time.time()
+    start_time = time.perf_counter()
+    if python_target:
+        spawn_seconds = 0.0
+        returncode, return_value, usage = python_targets.call(
+            runnable, collectors, slot  # type: ignore
+        )
+    else:
+        stdout_target = collectors["stdout"].popen_target()
+        stderr_target = collectors["stderr"].popen_target()
+        try:
+            process = _start_process(
+                runnable, slot, stdout=stdout_target, stderr=stderr_target
+            )
+        except OSError as error:
+            # Reported as a failed trial, as the shell would, rather than ending the
+            # search.
+            process = None
+            returncode, message = _start_failure(runnable, error)
+            usage = None
+            stdout = collectors["stdout"].fail("")
+            stderr = collectors["stderr"].fail(message)
+        spawn_seconds = time.perf_counter() - start_time
+        if process is not None:
+            with _track_process(process, timeout) as timed_out:
+                collectors["stdout"].start(process.stdout)
+                collectors["stderr"].start(process.stderr)
+                returncode, usage = _wait_with_usage(process)
+    wall_seconds = time.perf_counter() - start_time
+    if python_target or process is not None:
+        stdout = collectors["stdout"].finish()
+        stderr = collectors["stderr"].finish()
+
+    result = {
         "step": step,
         "command": command,
         "substitutions": substitutions,
-        "stdout": command_result.stdout,
-        "stderr": command_result.stderr,
-        "returncode": command_result.returncode,
+        "stdout": stdout,
+        "stderr": stderr,
+        "returncode": returncode,
+        "started_at": started_at,
+        **accounting.resource_fields(usage, wall_seconds, spawn_seconds),
     }
+    if python_target:
+        result["return_value"] = return_value
+    if output_dir:
+        result["stdout_path"] = collectors["stdout"].path
+        result["stderr_path"] = collectors["stderr"].path
+    if timeout is not None:
+        result["timed_out"] = process is not None and timed_out.is_set()
+    if metric_watcher:
+        result["metrics"] = metric_watcher.metrics
+        result["pruned"] = metric_watcher.stopped_at is not None
+    if slot is not None:
+        result["slot"] = slot.number
+    if cache:
+        cache.put(command, result)
+    return result
 
 
-def _capture_command_packed(
-    args: Tuple[str, Dict[str, str], int, tqdm]
-) -> Dict[str, Any]:
-    return capture_command(*args)
+def _capture_command_packed(args: Tuple[Any, ...], **kwargs: Any) -> Dict[str, Any]:
+    """
+    Call `capture_command` from a worker pool.
+
+    `args` holds the positional arguments (command template, substitutions, step and
+    monitor), optionally followed by a dict of keyword arguments for this call only,
+    which take precedence over `kwargs`.
+    """
+    if len(args) > 4:
+        kwargs = {**kwargs, **args[4]}
+        args = args[:4]
+    return capture_command(*args, **kwargs)
+
+
+def with_task_kwargs(args: Tuple[Any, ...], **kwargs: Any) -> Tuple[Any, ...]:
+    """
+    Add keyword arguments for a single call to packed `_capture_command_packed` args.
+    """
+    task_kwargs = args[4] if len(args) > 4 else {}
+    return (*args[:4], {**task_kwargs, **kwargs})
+
+
+class SlotAllocator:
+    """
+    Hands out resource slots to trials as they are dispatched, and takes them back as
+    they finish, so that no two running trials share a slot.
+
+    Trials must be dispatched with at most `len(slots)` running at once, e.g. through
+    `imap_bounded`, and `release` must be called with each result before the next
+    trial is dispatched.
+    """
+
+    def __init__(self, slots: List[Slot]):
+        self.slots = slots
+        self._free = collections.deque(slots)
+
+    def assign(
+        self, packed_args: Iterable[Optional[Tuple[Any, ...]]]
+    ) -> Iterator[Optional[Tuple[Any, ...]]]:
+        """
+        Add a free slot to each set of packed `_capture_command_packed` args.
+        """
+        for args in packed_args:
+            if args is None:
+                # Nothing is ready to run; see `imap_bounded`.
+                yield args
+            else:
+                yield with_task_kwargs(args, slot=self._free.popleft())
+
+    def release(self, output: Dict[str, Any]) -> None:
+        """
+        Return the slot used by a finished trial.
+        """
+        self._free.append(self.slots[output["slot"]])
+
+
+def _terminate_worker(signum, frame) -> None:
+    kill_running_processes()
+    os._exit(1)
+
+
+def _init_worker(lock) -> None:
+    """
+    Set up a worker process.
+
+    Interrupts are left to the parent process, which decides whether to let commands
+    finish. When the pool is terminated, the worker kills its running command first, so
+    that nothing is orphaned.
+    """
+    tqdm.set_lock(lock)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, _terminate_worker)
+
+
+# Ways of running commands concurrently. See `make_pool`.
+ENGINES = ("process", "thread")
+
+
+def make_pool(
+    num_workers: int, engine: str = "process", serve: Optional[str] = None
+) -> multiprocessing.pool.Pool:
+    """
+    Create a pool of workers to run commands concurrently.
+
+    Parameters
+    ----------
+    num_workers
+        How many commands may run at once.
+    engine
+        "process" (default) runs each command from its own worker process. "thread"
+        runs every command from a thread of this process instead; since workers only
+        wait on their children, this is much cheaper at high concurrency.
+    serve
+        If provided, ignore `engine` and serve commands to `argsearch worker`
+        processes which connect to this address instead; see `distributed`.
+
+    Returns
+    -------
+    multiprocessing.pool.Pool
+        A pool of workers. Every kind of pool shares the same interface.
+    """
+    if serve:
+        # Deferred, since `distributed` builds on this module.
+        from argsearch import distributed
+
+        address = distributed.parse_address(serve)
+        pool = distributed.RemotePool(address, distributed.get_authkey())
+        sys.stderr.write(f"Serving trials to workers at {serve}.\n")
+        return pool  # type: ignore
+    if engine == "thread":
+        return multiprocessing.pool.ThreadPool(num_workers)
+    if engine == "process":
+        return multiprocessing.Pool(
+            num_workers, initializer=_init_worker, initargs=(tqdm.get_lock(),)
+        )
+    raise ValueError(f"Unrecognized engine: {engine}.")
+
+
+def terminate_pool(pool: multiprocessing.pool.Pool) -> None:
+    """
+    Immediately stop a pool from `make_pool`, killing every command it is running.
+    """
+    # Commands run from threads of this process; worker processes kill their own
+    # commands when terminated.
+    kill_running_processes()
+    pool.terminate()
+
+
+def close_pool(pool: multiprocessing.pool.Pool) -> None:
+    """
+    Stop a pool from `make_pool` once every task given to it has finished.
+    """
+    pool.close()
+    # Letting workers exit on their own, rather than leaving the pool's finalizer to
+    # terminate them, avoids a rare hang when a worker is killed while holding the
+    # lock on the task queue.
+    if hasattr(pool, "join"):
+        pool.join()
+
+
+def imap_bounded(
+    pool: multiprocessing.pool.Pool,
+    func: Callable[[T], R],
+    iterable: Iterable[Optional[T]],
+    max_pending: int,
+) -> Iterator[R]:
+    """
+    Like `Pool.imap_unordered`, but never pulls more than `max_pending` items from
+    `iterable` ahead of the results that have been consumed.
+
+    `Pool.imap_unordered` drains its whole input into the task queue up front, which
+    defeats lazily-generated substitutions. Here the next item is only requested once
+    a result has been yielded, so memory stays flat and the first task starts at once.
+
+    `iterable` may yield None when no item can be submitted until a pending task
+    finishes, e.g. because the next items depend on its result.
+
+    Parameters
+    ----------
+    pool
+        The worker pool to run tasks on.
+    func
+        A picklable function to apply to each item.
+    iterable
+        The items to process, which may be generated lazily.
+    max_pending
+        The maximum number of tasks submitted but not yet yielded.
+
+    Yields
+    ------
+    R
+        Results of `func`, in completion order.
+    """
+    results: "queue.Queue[Tuple[bool, Any]]" = queue.Queue()
+    items = iter(iterable)
+    pending = 0
+    exhausted = False
+
+    def submit_next() -> Optional[bool]:
+        """
+        Submit the next item, returning False if there are none left, or None if the
+        next one isn't ready yet.
+        """
+        try:
+            item = next(items)
+        except StopIteration:
+            return False
+        if item is None:
+            return None
+        pool.apply_async(
+            func,
+            (item,),
+            callback=lambda result: results.put((True, result)),
+            error_callback=lambda error: results.put((False, error)),
+        )
+        return True
+
+    while True:
+        while not exhausted and pending < max_pending:
+            submitted = submit_next()
+            if submitted is None:
+                if pending == 0:
+                    raise RuntimeError("No task is ready to run, and none is pending.")
+                break
+            if submitted:
+                pending += 1
+            else:
+                exhausted = True
+
+        if pending == 0:
+            return
+
+        succeeded, result = results.get()
+        pending -= 1
+        if not succeeded:
+            raise result
+        yield result
+
+
+def write_output(output: Dict[str, Any], monitor: tqdm, jsonl: bool = False) -> None:
+    """
+    Report a completed command's result as soon as it arrives.
+
+    Parameters
+    ----------
+    output
+        A result, as returned by `capture_command`, or a record of a trial which was
+        "skipped" because an upstream stage failed.
+    monitor
+        A handle to the parent progress bar.
+    jsonl
+        If True, write the result as a single line of JSON and flush it immediately.
+        Otherwise, write a header followed by the command's stdout, and forward its
+        stderr to stderr.
+    """
+    if jsonl:
+        monitor.write(json.dumps(output))
+        sys.stdout.flush()
+        return
+
+    header = format_header(output["step"], output["command"], output["substitutions"])
+    if output.get("skipped"):
+        monitor.write(
+            f"{header}\n--- skipped: an upstream stage failed", file=sys.stderr
+        )
+        return
+    output_with_header = f'{header}\n{output["stdout"]}'
+    monitor.write(output_with_header, end="")
+    if output["stderr"]:
+        sys.stderr.write(output["stderr"])
+        sys.stderr.flush()
 
 
 def run_commands(
     command_template: str,
-    substitution_list: List[Dict[str, str]],
+    substitutions: Iterable[Dict[str, str]],
     output_json: bool = False,
     num_workers: int = 0,
     disable_bar: bool = False,
+    total: Optional[int] = None,
+    cache: Optional[ResultCache] = None,
+    engine: str = "process",
+    output_jsonl: bool = False,
+    capture_options: Optional[Dict[str, Any]] = None,
+    timeout: Optional[float] = None,
+    slots: Optional[List[Slot]] = None,
+    serve: Optional[str] = None,
+    summary: bool = False,
+    tracer: Optional[tracing.Tracer] = None,
+    shell: bool = True,
+    stages: Optional[List[str]] = None,
+    dedup: bool = True,
+    first_step: int = 0,
 ) -> None:
     """
-    Run a list of command strings, streaming or formatting the output.
+    Run a command once per substitution set, streaming or formatting the output.
+
+    The first Ctrl-C stops starting new commands, but lets running ones finish. A
+    second Ctrl-C kills running commands, along with any processes they started.
 
     Parameters
     ----------
     command_template
         A string to be executed as a subprocess, with "{arg}" bracketed templates.
-    substitution_list
-        A list of substitution sets to apply to the command template.
+    substitutions
+        Substitution sets to apply to the command template. These are consumed
+        lazily, so this may be a generator over an arbitrarily large search.
     output_json
         If True, collect output and print at the end, formatted as json.
         Otherwise (default), stream output to stdout as it arrives.
@@ -147,61 +868,318 @@ def run_commands(
         If provided, use this many worker processes to run commands.
     disable_bar
         If True, disable the progress bar.
+    total
+        The number of substitution sets, if known, for the progress bar.
+    cache
+        If provided, reuse command results from this cache and store new ones in it.
+    engine
+        How to run commands concurrently when `num_workers` is set; see `make_pool`.
+    output_jsonl
+        If True, print each result as one line of JSON as soon as it completes. Unlike
+        `output_json`, results are never accumulated in memory.
+    capture_options
+        Extra keyword arguments for `capture_command`, such as `output_dir`. If any
+        are given, output is always captured rather than streamed.
+    timeout
+        If provided, kill any command that runs for longer than this many seconds.
+    slots
+        If provided, run each command on the cores of a slot that no other running
+        command is using. There must be at least `num_workers` slots.
+    serve
+        If provided, run commands on `argsearch worker` processes which connect to
+        this address, with at most `num_workers` running at once; see `make_pool`.
+    summary
+        If True, print a summary of the resources used by the run to stderr at the
+        end, including the slowest commands.
+    tracer
+        If provided, record each command's lifecycle in this trace.
+    shell
+        If False, run commands directly rather than with the shell; see
+        `CommandTemplate`.
+    stages
+        If provided, upstream commands for each substitution set to run first, in
+        order, each of which runs only once for each distinct set of values of the
+        templates it uses; see `pipelines`. Output is then always captured, and
+        upstream results are reported too, marked with their "stage".
+    dedup
+        If True (default), run each distinct command only once, and report its result
+        for every substitution set that produces it, marked with the step it is a
+        "duplicate_of"; see `dedup`. Disable this for commands whose output varies
+        from run to run.
+    first_step
+        The step of the first substitution set, e.g. to continue numbering from an
+        earlier run which this one extends.
     """
-    if num_workers > 0:
-        process_pool = multiprocessing.Pool(
-            num_workers, initializer=tqdm.set_lock, initargs=(tqdm.get_lock(),)
-        )
+    capture_options = capture_options or {}
+    # Parsed once, rather than for every command.
+    template = CommandTemplate(command_template, shell)
+    stage_templates = [CommandTemplate(stage, shell) for stage in stages or []]
+    resource_summary = accounting.ResourceSummary() if summary else None
+    deduplicator = Deduplicator() if dedup else None
+    with GracefulInterrupt() as interrupt:
+        if num_workers > 0 or stage_templates:
+            _run_commands_pooled(
+                template,
+                substitutions,
+                interrupt,
+                output_json,
+                max(num_workers, 1),
+                disable_bar,
+                total,
+                cache,
+                engine,
+                output_jsonl,
+                capture_options,
+                timeout,
+                slots,
+                serve,
+                resource_summary,
+                tracer,
+                stage_templates,
+                deduplicator,
+                first_step,
+            )
+        else:
+            _run_commands_sequential(
+                template,
+                substitutions,
+                interrupt,
+                output_json,
+                disable_bar,
+                total,
+                cache,
+                output_jsonl,
+                capture_options,
+                timeout,
+                slots,
+                resource_summary,
+                tracer,
+                deduplicator,
+                first_step,
+            )
 
-        with tqdm(total=len(substitution_list), disable=disable_bar) as monitor:
-            args_packed = [
-                (command_template, subs, i, None)
-                for i, subs in enumerate(substitution_list)
-            ]
+    if resource_summary:
+        sys.stderr.write(resource_summary.format() + "\n")
+        sys.stderr.flush()
 
-            if output_json:
-                outputs = []
 
-            try:
-                for output in process_pool.imap_unordered(
-                    _capture_command_packed, args_packed
-                ):
-                    monitor.update()
+def _run_commands_sequential(
+    command_template: CommandTemplate,
+    substitutions: Iterable[Dict[str, str]],
+    interrupt: GracefulInterrupt,
+    output_json: bool,
+    disable_bar: bool,
+    total: Optional[int],
+    cache: Optional[ResultCache],
+    output_jsonl: bool,
+    capture_options: Dict[str, Any],
+    timeout: Optional[float],
+    slots: Optional[List[Slot]],
+    resource_summary: Optional[accounting.ResourceSummary],
+    tracer: Optional[tracing.Tracer],
+    deduplicator: Optional[Deduplicator],
+    first_step: int,
+) -> None:
+    """
+    Implements `run_commands` when `num_workers` is not set.
+    """
+    # Commands run one at a time, so they can always use the first slot.
+    slot = slots[0] if slots else None
+    with tqdm(substitutions, total=total, disable=disable_bar) as monitor:
+        trials = enumerate(interrupt.until_draining(monitor), first_step)
+        if output_json or output_jsonl or capture_options:
+            outputs = []
 
+            try:
+                for step, substitution in trials:
+                    if deduplicator and not deduplicator.admit(
+                        (command_template, substitution, step, None)
+                    ):
+                        # The same command already ran; reuse its result.
+                        output = deduplicator.drain()[0]
+                    else:
+                        if tracer:
+                            tracer.submitted(step)
+                        output = capture_command(
+                            command_template,
+                            substitution,
+                            step,
+                            monitor,
+                            cache,
+                            timeout=timeout,
+                            slot=slot,
+                            **capture_options,
+                        )
+                        if deduplicator:
+                            deduplicator.finished(output)
+                        if tracer:
+                            tracer.completed(output)
+                    if resource_summary:
+                        resource_summary.record(output)
                     if output_json:
                         outputs.append(output)
                     else:
-                        header = format_header(
-                            output["step"], output["command"], output["substitutions"]
-                        )
-                        output_with_header = f'{header}\n{output["stdout"]}'
-                        monitor.write(output_with_header, end="")
-                        if output["stderr"]:
-                            sys.stderr.write(output["stderr"])
-                            sys.stderr.flush()
+                        write_output(output, monitor, output_jsonl)
             except KeyboardInterrupt:
-                pass
+                kill_running_processes()
 
             if output_json:
                 formatted = json.dumps(outputs)
                 monitor.write(formatted)
+        else:
+            try:
+                for step, substitution in trials:
+                    if deduplicator and not deduplicator.admit(
+                        (command_template, substitution, step, None)
+                    ):
+                        usage = deduplicator.drain()[0]
+                        command, _ = command_template.render(substitution)
+                        monitor.write(format_header(step, command, substitution))
+                        monitor.write(
+                            f"--- same command as [{usage['duplicate_of']}]; "
+                            "not run again",
+                            file=sys.stderr,
+                        )
+                        if resource_summary:
+                            resource_summary.record(usage)
+                        continue
 
-        return
+                    if tracer:
+                        tracer.submitted(step)
+                    usage = stream_command(
+                        command_template,
+                        substitution,
+                        step,
+                        monitor,
+                        cache,
+                        timeout,
+                        slot,
+                    )
+                    if deduplicator:
+                        deduplicator.finished(usage)
+                    if resource_summary:
+                        resource_summary.record(usage)
+                    if tracer:
+                        tracer.completed(usage)
+            except KeyboardInterrupt:
+                kill_running_processes()
+
+
+def _run_commands_pooled(
+    command_template: CommandTemplate,
+    substitutions: Iterable[Dict[str, str]],
+    interrupt: GracefulInterrupt,
+    output_json: bool,
+    num_workers: int,
+    disable_bar: bool,
+    total: Optional[int],
+    cache: Optional[ResultCache],
+    engine: str,
+    output_jsonl: bool,
+    capture_options: Dict[str, Any],
+    timeout: Optional[float],
+    slots: Optional[List[Slot]],
+    serve: Optional[str],
+    resource_summary: Optional[accounting.ResourceSummary],
+    tracer: Optional[tracing.Tracer],
+    stages: List[CommandTemplate],
+    deduplicator: Optional[Deduplicator],
+    first_step: int,
+) -> None:
+    """
+    Implements `run_commands` when `num_workers` or `stages` are set.
+    """
+    process_pool = make_pool(num_workers, engine, serve)
+
+    with tqdm(total=total, disable=disable_bar) as monitor:
+        pipeline = None
+        args_packed: Iterable[Optional[Tuple[Any, ...]]]
+        if stages:
+            pipeline = pipelines.Pipeline(
+                stages, command_template, substitutions, first_step
+            )
+            args_packed = pipeline.tasks()
+        else:
+            args_packed = (
+                (command_template, subs, i, None)
+                for i, subs in enumerate(substitutions, first_step)
+            )
+        # Applied to the packed commands rather than the substitutions, since a
+        # pipeline holds back trials waiting on their stages, which mustn't start
+        # after an interrupt either.
+        args_packed = interrupt.until_draining(args_packed)
+        if deduplicator:
+            args_packed = deduplicator.filter(args_packed)
+        allocator = None
+        if slots:
+            allocator = SlotAllocator(slots[:num_workers])
+            args_packed = allocator.assign(args_packed)
+        if tracer:
+            args_packed = tracer.track(args_packed)
 
-    with tqdm(substitution_list, disable=disable_bar) as monitor:
         if output_json:
             outputs = []
 
-            try:
-                for step, substitutions in enumerate(monitor):
-                    outputs.append(
-                        capture_command(command_template, substitutions, step, monitor)
-                    )
-            except KeyboardInterrupt:
-                pass
+        def report(output: Dict[str, Any]) -> None:
+            if resource_summary:
+                resource_summary.record(output)
+            if output_json:
+                outputs.append(output)
+            else:
+                write_output(output, monitor, output_jsonl)
+
+        def report_duplicates() -> None:
+            assert deduplicator
+            for output in deduplicator.drain():
+                monitor.update()
+                report(output)
 
+        def report_skipped() -> None:
+            assert pipeline
+            for step, substitution in pipeline.skipped:
+                command, _ = command_template.render(substitution)
+                monitor.update()
+                report(
+                    {
+                        "step": step,
+                        "command": command,
+                        "substitutions": substitution,
+                        "skipped": True,
+                    }
+                )
+            pipeline.skipped.clear()
+
+        try:
+            capture = functools.partial(
+                _capture_command_packed, cache=cache, timeout=timeout, **capture_options
+            )
+            # Only as many trials as there are workers are dispatched at once, so
+            # that after an interrupt, no queued trial starts.
+            for output in imap_bounded(process_pool, capture, args_packed, num_workers):
+                if pipeline:
+                    report_skipped()
+                if deduplicator:
+                    report_duplicates()
+                if not (pipeline and pipeline.finished(output)):
+                    monitor.update()
+                    if deduplicator:
+                        deduplicator.finished(output)
+                if allocator:
+                    allocator.release(output)
+                if tracer:
+                    tracer.completed(output)
+                report(output)
+                if deduplicator:
+                    report_duplicates()
+            if pipeline:
+                report_skipped()
+            if deduplicator:
+                report_duplicates()
+        except KeyboardInterrupt:
+            terminate_pool(process_pool)
+        else:
+            close_pool(process_pool)
+
+        if output_json:
             formatted = json.dumps(outputs)
             monitor.write(formatted)
-        else:
-            for step, substitutions in enumerate(monitor):
-                stream_command(command_template, substitutions, step, monitor)
@@ -0,0 +1,144 @@
+"""
+Deduplicates trials within a run: a trial whose command is identical to one that's
+running or has finished reuses that command's result instead of running again.
+
+Searches produce duplicates more often than one might expect: integer ranges map many
+quasirandom points to the same value, and optimizers propose points they have already
+evaluated. Programs which are intentionally stochastic should opt out.
+"""
+
+import collections
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+# How many finished results to keep for reuse. Older results are forgotten, so a
+# duplicate of a trial from long ago runs again, but memory stays bounded.
+DEFAULT_MAX_RESULTS = 10_000
+
+
+def _command_key(args: Tuple[Any, ...]) -> str:
+    """
+    Identify the command which a set of packed `commands.capture_command` arguments
+    runs, ignoring the slot it might be assigned.
+    """
+    command_template, substitutions = args[0], args[1]
+    if isinstance(command_template, str):
+        # Deferred, since `commands` builds on this module.
+        from argsearch import commands
+
+        return commands.apply_substitutions(command_template, substitutions)
+    return command_template.render(substitutions)[0]
+
+
+def _reusable(output: Dict[str, Any]) -> bool:
+    """
+    Whether a result reflects the command itself, rather than how its run was cut
+    short, so that later duplicates may reuse it.
+    """
+    if output.get("timed_out") or output.get("pruned"):
+        return False
+    returncode = output.get("returncode")
+    return returncode is None or returncode >= 0
+
+
+class Deduplicator:
+    """
+    Tracks the commands dispatched in a run, holding back duplicates.
+
+    Pass packed `commands.capture_command` arguments through `filter()` (or check them
+    one at a time with `admit()`) before dispatching them, and call `finished()` with
+    each result. Results for the duplicates which were held back, marked with the
+    "duplicate_of" step whose result they reuse, can then be collected with `drain()`.
+
+    Parameters
+    ----------
+    max_results
+        How many finished results to keep for reuse by later duplicates.
+    """
+
+    def __init__(self, max_results: int = DEFAULT_MAX_RESULTS):
+        self.max_results = max_results
+        # Maps each running command to the duplicates waiting for its result.
+        self._running: Dict[str, List[Tuple[Any, ...]]] = {}
+        # Maps the steps of running commands to their keys.
+        self._keys: Dict[Any, str] = {}
+        # Recently finished results, by command, oldest first.
+        self._results: "collections.OrderedDict[str, Dict[str, Any]]" = (
+            collections.OrderedDict()
+        )
+        self._duplicates: List[Dict[str, Any]] = []
+
+    def admit(self, args: Tuple[Any, ...]) -> bool:
+        """
+        Check whether a trial should run, or else hold it back as a duplicate.
+        """
+        key = _command_key(args)
+        if key in self._running:
+            self._running[key].append(args)
+            return False
+
+        result = self._results.get(key)
+        if result is not None:
+            self._results.move_to_end(key)
+            self._duplicates.append(_copy_result(result, args))
+            return False
+
+        self._running[key] = []
+        self._keys[args[2]] = key
+        return True
+
+    def filter(
+        self, packed_args: Iterable[Optional[Tuple[Any, ...]]]
+    ) -> Iterator[Optional[Tuple[Any, ...]]]:
+        """
+        Pass through each set of packed arguments which should run; see `admit()`.
+        """
+        for args in packed_args:
+            if args is None or self.admit(args):
+                yield args
+
+    def finished(self, output: Dict[str, Any]) -> None:
+        """
+        Record the result of a command which was admitted.
+        """
+        key = self._keys.pop(output["step"], None)
+        if key is None:
+            return
+
+        for args in self._running.pop(key):
+            self._duplicates.append(_copy_result(output, args))
+        self._remember(key, output)
+
+    def seed(self, args: Tuple[Any, ...], output: Dict[str, Any]) -> None:
+        """
+        Record the result of a command which ran before this run, such as one replayed
+        from a journal, so that its duplicates reuse it.
+        """
+        self._remember(_command_key(args), output)
+
+    def _remember(self, key: str, output: Dict[str, Any]) -> None:
+        if _reusable(output) and self.max_results > 0:
+            self._results[key] = output
+            if len(self._results) > self.max_results:
+                self._results.popitem(last=False)
+
+    def drain(self) -> List[Dict[str, Any]]:
+        """
+        Collect the results of duplicates whose originals have finished.
+        """
+        duplicates, self._duplicates = self._duplicates, []
+        return duplicates
+
+
+def _copy_result(output: Dict[str, Any], args: Tuple[Any, ...]) -> Dict[str, Any]:
+    """
+    Make a result for a duplicate trial from the result of the original.
+    """
+    result = {
+        field: value
+        for field, value in output.items()
+        if field not in ("slot", "cached", "duplicate_of")
+    }
+    result["step"] = args[2]
+    result["substitutions"] = args[1]
+    result["duplicate_of"] = output.get("duplicate_of", output["step"])
+    return result
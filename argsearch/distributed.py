@@ -0,0 +1,323 @@
+"""
+Runs trials on other machines: a coordinator serves trials over a socket, and any
+number of workers connect to it, pull trials one at a time, and send back results.
+
+Workers may join at any point during a run, and may leave at any point too; a trial
+that was running on a worker that left is handed to another worker.
+"""
+
+import multiprocessing
+import multiprocessing.connection
+import os
+import pickle
+import queue
+import signal
+import socket
+import sys
+import threading
+import time
+from typing import Any, Callable, Iterable, Iterator, List, Optional, Set, Tuple, Union
+
+from argsearch import commands
+from argsearch.slots import Slot
+
+# The environment variable holding the secret shared by a coordinator and its workers.
+# Trials are sent as pickles, so connections must be authenticated.
+AUTHKEY_VARIABLE = "ARGSEARCH_AUTHKEY"
+
+# How long a worker keeps retrying to reach a coordinator which isn't up yet, in
+# seconds.
+DEFAULT_CONNECT_TIMEOUT = 30.0
+CONNECT_RETRY_INTERVAL = 0.5
+
+Address = Union[str, Tuple[str, int]]
+
+
+def parse_address(text: str) -> Address:
+    """
+    Parse a "HOST:PORT" TCP address, or else the path of a Unix socket.
+    """
+    host, separator, port = text.rpartition(":")
+    if separator and port.isdigit():
+        return (host or "localhost", int(port))
+    return text
+
+
+def get_authkey() -> bytes:
+    """
+    Get the secret used to authenticate connections between a coordinator and workers.
+    """
+    authkey = os.environ.get(AUTHKEY_VARIABLE)
+    if not authkey:
+        raise ValueError(
+            f"Set {AUTHKEY_VARIABLE} to the same secret for the coordinator and its "
+            "workers."
+        )
+    return authkey.encode()
+
+
+class _Task:
+    """
+    One call to run on a worker, and its eventual outcome.
+    """
+
+    def __init__(
+        self,
+        func: Callable,
+        args: Tuple[Any, ...],
+        callback: Optional[Callable[[Any], None]] = None,
+        error_callback: Optional[Callable[[BaseException], None]] = None,
+    ):
+        self.func = func
+        self.args = args
+        self.callback = callback
+        self.error_callback = error_callback
+        self._done = threading.Event()
+        self._succeeded = False
+        self._result: Any = None
+
+    def finish(self, succeeded: bool, result: Any) -> None:
+        self._succeeded = succeeded
+        self._result = result
+        self._done.set()
+        if succeeded and self.callback:
+            self.callback(result)
+        elif not succeeded and self.error_callback:
+            self.error_callback(result)
+
+    def get(self) -> Any:
+        self._done.wait()
+        if not self._succeeded:
+            raise self._result
+        return self._result
+
+
+class RemotePool:
+    """
+    A worker pool whose workers are `argsearch worker` processes, possibly on other
+    machines, which connect to `address`.
+
+    It supports the parts of the `multiprocessing.pool.Pool` interface that argsearch
+    uses, so it can stand in for a pool from `commands.make_pool`. Tasks wait in a
+    queue until a connected worker is free to take them.
+    """
+
+    def __init__(self, address: Address, authkey: bytes):
+        self.address = address
+        self._listener = multiprocessing.connection.Listener(address, authkey=authkey)
+        self._tasks: "queue.Queue[Optional[_Task]]" = queue.Queue()
+        self._connections: Set[multiprocessing.connection.Connection] = set()
+        self._lock = threading.Lock()
+        self._closed = False
+        self._terminated = False
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def _accept(self) -> None:
+        while True:
+            try:
+                connection = self._listener.accept()
+            except multiprocessing.AuthenticationError:
+                sys.stderr.write("Rejected a worker with the wrong authkey.\n")
+                continue
+            except EOFError:
+                continue
+            except OSError:
+                return  # The listener was closed.
+
+            with self._lock:
+                if self._closed:
+                    connection.close()
+                    return
+                self._connections.add(connection)
+            thread = threading.Thread(
+                target=self._serve, args=(connection,), daemon=True
+            )
+            thread.start()
+
+    def _serve(self, connection: multiprocessing.connection.Connection) -> None:
+        """
+        Hand tasks to one connected worker, one at a time, until the pool closes.
+        """
+        try:
+            while True:
+                task = self._tasks.get()
+                if task is None:
+                    # Leave the sentinel for the other connections.
+                    self._tasks.put(None)
+                    connection.send(("close",))
+                    return
+
+                try:
+                    message = pickle.dumps(("task", task.func, task.args))
+                except Exception as error:
+                    task.finish(False, error)
+                    continue
+
+                try:
+                    connection.send_bytes(message)
+                    succeeded, result = connection.recv()
+                except (OSError, EOFError):
+                    # The worker left; give its task to someone else.
+                    if not self._terminated:
+                        self._tasks.put(task)
+                    return
+                task.finish(succeeded, result)
+        except (OSError, EOFError):
+            pass
+        finally:
+            with self._lock:
+                self._connections.discard(connection)
+            connection.close()
+
+    def apply_async(
+        self,
+        func: Callable,
+        args: Tuple[Any, ...] = (),
+        callback: Optional[Callable[[Any], None]] = None,
+        error_callback: Optional[Callable[[BaseException], None]] = None,
+    ) -> _Task:
+        task = _Task(func, args, callback, error_callback)
+        self._tasks.put(task)
+        return task
+
+    def imap(self, func: Callable, iterable: Iterable[Any]) -> Iterator[Any]:
+        tasks = [self.apply_async(func, (item,)) for item in iterable]
+        for task in tasks:
+            yield task.get()
+
+    def close(self) -> None:
+        """
+        Stop accepting workers, and dismiss each one once the queued tasks are done.
+        """
+        with self._lock:
+            self._closed = True
+        self._tasks.put(None)
+        self._listener.close()
+
+    def terminate(self) -> None:
+        """
+        Disconnect every worker immediately, which makes them kill running trials.
+        """
+        self._terminated = True
+        self.close()
+        with self._lock:
+            connections = list(self._connections)
+        for connection in connections:
+            # Shutting the socket down (unlike closing it) wakes the thread waiting on
+            # it, which then cleans up.
+            try:
+                with socket.socket(fileno=os.dup(connection.fileno())) as sock:
+                    sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+
+def _connect(
+    address: Address, authkey: bytes, connect_timeout: float
+) -> multiprocessing.connection.Connection:
+    deadline = time.monotonic() + connect_timeout
+    while True:
+        try:
+            return multiprocessing.connection.Client(address, authkey=authkey)
+        except (ConnectionRefusedError, FileNotFoundError):
+            if time.monotonic() >= deadline:
+                raise
+            time.sleep(CONNECT_RETRY_INTERVAL)
+
+
+def _run_task(
+    func: Callable,
+    args: Tuple[Any, ...],
+    results: multiprocessing.connection.Connection,
+) -> None:
+    try:
+        outcome: Tuple[bool, Any] = (True, func(*args))
+    except Exception as error:
+        outcome = (False, error)
+    try:
+        results.send(outcome)
+    except Exception as error:
+        # E.g. an exception that can't be pickled.
+        results.send((False, RuntimeError(repr(error))))
+
+
+def _work(
+    address: Address, authkey: bytes, slot: Optional[Slot], connect_timeout: float
+) -> None:
+    """
+    Run trials from a coordinator, one at a time, until it dismisses this worker.
+    """
+    # Interrupts are left to the parent process, which terminates this one; the
+    # running trial is then killed too, and the coordinator hands it to someone else.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, commands._terminate_worker)
+    connection = _connect(address, authkey, connect_timeout)
+
+    results, results_sender = multiprocessing.Pipe(duplex=False)
+    try:
+        while True:
+            try:
+                message = connection.recv()
+            except (OSError, EOFError):
+                return
+            if message[0] == "close":
+                return
+
+            _, func, args = message
+            if slot is not None:
+                args = (commands.with_task_kwargs(args[0], slot=slot),)
+
+            thread = threading.Thread(
+                target=_run_task, args=(func, args, results_sender), daemon=True
+            )
+            thread.start()
+            # The coordinator sends nothing while a trial runs, so if its connection
+            # becomes readable, it has gone away (or terminated the run).
+            ready = multiprocessing.connection.wait([results, connection])
+            if results not in ready:
+                commands.kill_running_processes()
+                return
+            connection.send(results.recv())
+    finally:
+        connection.close()
+
+
+def run_worker(
+    address: Address,
+    num_workers: int = 1,
+    slots: Optional[List[Slot]] = None,
+    connect_timeout: float = DEFAULT_CONNECT_TIMEOUT,
+) -> None:
+    """
+    Connect to a coordinator and run the trials it serves until the run is over.
+
+    Parameters
+    ----------
+    address
+        The coordinator's address, from `parse_address`.
+    num_workers
+        How many trials to run at once. Each opens its own connection.
+    slots
+        If provided, run each concurrent trial on the cores of its own slot.
+    connect_timeout
+        How long to keep retrying if the coordinator is not accepting connections yet,
+        in seconds.
+    """
+    authkey = get_authkey()
+    processes = [
+        multiprocessing.Process(
+            target=_work,
+            args=(address, authkey, slots[i] if slots else None, connect_timeout),
+        )
+        for i in range(num_workers)
+    ]
+    for process in processes:
+        process.start()
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.join()
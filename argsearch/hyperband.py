@@ -0,0 +1,365 @@
+"""
+Asynchronous Hyperband: many configurations run with a small budget (such as a few
+epochs), and only the best of them are promoted to run again with larger budgets.
+
+One template is the budget, and its range gives the smallest and largest budgets. The
+budgets in between grow by a factor of `eta`, forming "rungs". Each configuration is
+sampled from the other ranges and starts in one of several brackets, which differ in
+the rung they start at: the first bracket starts every configuration at the smallest
+budget, and so stops the most configurations early, while the last runs each one at
+the largest budget, like a plain random search. This hedges against small budgets
+being misleading.
+
+Promotions follow asynchronous successive halving (ASHA; Li et al., "A System for
+Massively Parallel Hyperparameter Tuning", 2020): whenever a worker is free, the next
+trial to start is a configuration in the top `1 / eta` of its rung which hasn't been
+promoted yet, from the highest rung which has one, or else a new configuration. So
+workers never wait for a rung to fill up before anything can be promoted.
+"""
+
+import functools
+import json
+import math
+import sys
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from tqdm import tqdm
+
+from argsearch import accounting, commands, ranges, strategies, tracing
+from argsearch.cache import ResultCache
+from argsearch.objectives import OUTPUT_OBJECTIVE, get_objective
+from argsearch.slots import Slot
+from argsearch.templates import CommandTemplate
+
+DEFAULT_ETA = 3
+
+BUDGET_RANGES = (
+    ranges.IntRange,
+    ranges.LogIntRange,
+    ranges.FloatRange,
+    ranges.LogFloatRange,
+)
+
+
+def rung_budgets(budget_range: ranges.Range, eta: int) -> List[str]:
+    """
+    Get the budget of each rung: the largest budget in a range, divided by `eta` as
+    many times as it can be without going below the smallest.
+
+    Parameters
+    ----------
+    budget_range
+        A numeric range whose values are all positive.
+    eta
+        The factor between the budgets of successive rungs, at least 2.
+
+    Returns
+    -------
+    List[str]
+        The budgets, in increasing order, to be substituted into the budget template.
+    """
+    if not isinstance(budget_range, BUDGET_RANGES) or budget_range.min_value <= 0:
+        raise ValueError("The budget's range must be numeric, and all positive.")
+
+    low, high = budget_range.min_value, budget_range.max_value
+    # Nudged, so that e.g. log(81) / log(3) isn't truncated to 3.
+    num_divisions = int(math.log(high / low) / math.log(eta) + 1e-9)
+    integral = isinstance(budget_range, (ranges.IntRange, ranges.LogIntRange))
+    budgets: List[str] = []
+    for divisions in reversed(range(num_divisions + 1)):
+        value = high / eta ** divisions
+        budget = str(max(round(value), low)) if integral else str(value)
+        # Small integral budgets can round to the same value.
+        if budget not in budgets:
+            budgets.append(budget)
+    return budgets
+
+
+class _Bracket:
+    """
+    The rungs of one bracket, holding the objective of each configuration which has
+    finished on each rung.
+    """
+
+    def __init__(self, first_rung: int, num_rungs: int):
+        self.first_rung = first_rung
+        self.results: List[Dict[int, float]] = [{} for _ in range(num_rungs)]
+        self.promoted: List[Set[int]] = [set() for _ in range(num_rungs)]
+
+    def promotion(self, eta: int) -> Optional[Tuple[int, int]]:
+        """
+        Find a configuration to promote, from the highest rung with one, returning it
+        and the rung (within this bracket) to promote it to.
+        """
+        for rung in reversed(range(len(self.results) - 1)):
+            results = self.results[rung]
+            top = sorted(results, key=results.__getitem__)[: len(results) // eta]
+            for config in top:
+                if config not in self.promoted[rung]:
+                    self.promoted[rung].add(config)
+                    return config, rung + 1
+        return None
+
+
+class HyperbandScheduler:
+    """
+    Decides which trial to start next, producing packed `commands.capture_command`
+    arguments.
+
+    Pass `tasks()` to `commands.imap_bounded`, and call `finished()` with each result
+    before consuming the next one.
+
+    Parameters
+    ----------
+    command_template
+        The command each trial runs.
+    configs
+        Substitutions for every template except the budget, one per configuration,
+        which are consumed lazily.
+    budget_name
+        The name of the budget template.
+    budgets
+        The budget of each rung; see `rung_budgets`.
+    eta
+        The fraction (`1 / eta`) of each rung to promote, at least 2.
+    num_brackets
+        How many brackets to use, starting from the one which stops the most
+        configurations early, up to one per rung.
+    """
+
+    def __init__(
+        self,
+        command_template: CommandTemplate,
+        configs: Iterable[Dict[str, str]],
+        budget_name: str,
+        budgets: List[str],
+        eta: int = DEFAULT_ETA,
+        num_brackets: Optional[int] = None,
+    ):
+        self.command_template = command_template
+        self.budget_name = budget_name
+        self.budgets = budgets
+        self.eta = eta
+        num_rungs = len(budgets)
+        num_brackets = min(num_brackets or num_rungs, num_rungs)
+        self.brackets = [
+            _Bracket(first, num_rungs - first) for first in range(num_brackets)
+        ]
+        # Hyperband's allocation: brackets which start at smaller budgets get
+        # proportionally more configurations.
+        self._shares = [
+            math.ceil(num_rungs / (num_rungs - first) * eta ** (num_rungs - 1 - first))
+            for first in range(num_brackets)
+        ]
+        self._assigned = [0] * num_brackets
+
+        self._configs = iter(configs)
+        self._exhausted = False
+        self._substitutions: List[Dict[str, str]] = []
+        # Maps the step of each running trial to its bracket, configuration and rung.
+        self._running: Dict[int, Tuple[int, int, int]] = {}
+        self._step = 0
+
+    def tasks(self) -> Iterator[Optional[Tuple[Any, ...]]]:
+        """
+        Generate packed arguments for each trial to run, or None when nothing can run
+        until a running trial finishes.
+        """
+        while True:
+            task = self._next_task()
+            if task is not None:
+                yield task
+            elif self._running:
+                yield None
+            else:
+                return
+
+    def _next_task(self) -> Optional[Tuple[Any, ...]]:
+        for index, bracket in enumerate(self.brackets):
+            promotion = bracket.promotion(self.eta)
+            if promotion is not None:
+                return self._start(index, *promotion)
+
+        if self._exhausted:
+            return None
+        try:
+            substitutions = next(self._configs)
+        except StopIteration:
+            self._exhausted = True
+            return None
+        self._substitutions.append(substitutions)
+        index = min(
+            range(len(self.brackets)),
+            key=lambda i: (self._assigned[i] + 1) / self._shares[i],
+        )
+        self._assigned[index] += 1
+        return self._start(index, len(self._substitutions) - 1, 0)
+
+    def _start(self, bracket: int, config: int, rung: int) -> Tuple[Any, ...]:
+        budget = self.budgets[self.brackets[bracket].first_rung + rung]
+        substitutions = dict(self._substitutions[config])
+        substitutions[self.budget_name] = budget
+        step = self._step
+        self._step += 1
+        self._running[step] = (bracket, config, rung)
+        return (self.command_template, substitutions, step, None)
+
+    def finished(self, output: Dict[str, Any], objective: Optional[float]) -> None:
+        """
+        Record a finished trial, with its objective to minimize (None if it has none,
+        in which case it is never promoted), and mark its result with its "config"
+        (counting from 0 in the order configurations were sampled) and "rung"
+        (counting from 0 at the smallest budget).
+        """
+        bracket, config, rung = self._running.pop(output["step"])
+        output["config"] = config
+        output["rung"] = self.brackets[bracket].first_rung + rung
+        if objective is not None:
+            self.brackets[bracket].results[rung][config] = objective
+
+
+def hyperband_command(
+    command_template: str,
+    range_map: Dict[str, ranges.Range],
+    budget_name: str,
+    trials: int,
+    maximize: bool = False,
+    eta: int = DEFAULT_ETA,
+    num_brackets: Optional[int] = None,
+    output_json: bool = False,
+    num_workers: int = 0,
+    disable_bar: bool = False,
+    cache: Optional[ResultCache] = None,
+    engine: str = "process",
+    output_jsonl: bool = False,
+    capture_options: Optional[Dict[str, Any]] = None,
+    timeout: Optional[float] = None,
+    slots: Optional[List[Slot]] = None,
+    serve: Optional[str] = None,
+    objective_field: str = OUTPUT_OBJECTIVE,
+    summary: bool = False,
+    tracer: Optional[tracing.Tracer] = None,
+    shell: bool = True,
+) -> None:
+    """
+    Search for the best setting of a command with asynchronous Hyperband.
+
+    A new trial starts as soon as any worker is free, so workers never wait on other
+    trials to finish a rung. The best setting reported at the end is the best one
+    among the trials at the largest budget reached.
+
+    As with `commands.run_commands`, the first Ctrl-C stops starting new trials but
+    lets running ones finish, and a second kills them.
+
+    Parameters
+    ----------
+    command_template
+        A string to be executed as a subprocess, with "{arg}" bracketed templates.
+    range_map
+        Maps from a template name to a range defining values for that template.
+    budget_name
+        The template whose range gives the smallest and largest budgets.
+    trials
+        How many configurations to try, sampled quasirandomly from the other ranges.
+    maximize
+        If True, look for the largest objective, rather than the smallest.
+    eta
+        The factor between successive budgets, and the inverse of the fraction of
+        each rung which is promoted. At least 2.
+    num_brackets
+        If provided, only use this many brackets, starting from the one which starts
+        configurations at the smallest budget.
+    objective_field
+        What to compare trials by; see `objectives.get_objective`.
+
+    Other parameters are as for `commands.run_commands`.
+    """
+    if eta < 2:
+        raise ValueError("eta must be at least 2.")
+
+    budgets = rung_budgets(range_map[budget_name], eta)
+    config_ranges = {
+        name: rng for name, rng in range_map.items() if name != budget_name
+    }
+    configs = strategies.quasirandom(config_ranges, trials, scramble=True)
+    num_workers = max(num_workers, 1)
+    process_pool = commands.make_pool(num_workers, engine, serve)
+    template = CommandTemplate(command_template, shell)
+    scheduler = HyperbandScheduler(
+        template, configs, budget_name, budgets, eta, num_brackets
+    )
+    capture = functools.partial(
+        commands._capture_command_packed,
+        cache=cache,
+        timeout=timeout,
+        **(capture_options or {}),
+    )
+    resource_summary = accounting.ResourceSummary() if summary else None
+    outputs = []
+    # The best objective (to minimize) and setting on each rung.
+    best: Dict[int, Tuple[float, Dict[str, str]]] = {}
+
+    try:
+        with commands.GracefulInterrupt() as interrupt, tqdm(
+            disable=disable_bar
+        ) as monitor:
+            dispatched = interrupt.until_draining(scheduler.tasks())
+            allocator = None
+            if slots:
+                allocator = commands.SlotAllocator(slots[:num_workers])
+                dispatched = allocator.assign(dispatched)
+            if tracer:
+                dispatched = tracer.track(dispatched)
+
+            for output in commands.imap_bounded(
+                process_pool, capture, dispatched, num_workers
+            ):
+                if allocator:
+                    allocator.release(output)
+                raw_objective = get_objective(output, objective_field)
+                objective = None
+                if raw_objective is not None:
+                    objective = -raw_objective if maximize else raw_objective
+                scheduler.finished(output, objective)
+
+                rung = output["rung"]
+                if objective is not None and (
+                    rung not in best or objective < best[rung][0]
+                ):
+                    best[rung] = (objective, output["substitutions"])
+                if resource_summary:
+                    resource_summary.record(output)
+                if tracer:
+                    tracer.completed(output)
+                if output_json:
+                    outputs.append(output)
+                else:
+                    commands.write_output(output, monitor, output_jsonl)
+                monitor.set_postfix({"budget": budgets[max(best, default=0)]})
+                monitor.update()
+    except KeyboardInterrupt:
+        commands.terminate_pool(process_pool)
+    except BaseException:
+        commands.terminate_pool(process_pool)
+        raise
+    else:
+        commands.close_pool(process_pool)
+
+    monitor.clear()
+    monitor.close()
+
+    if resource_summary:
+        sys.stderr.write(resource_summary.format() + "\n")
+        sys.stderr.flush()
+
+    if output_json:
+        monitor.write(json.dumps(outputs))
+    elif not output_jsonl:
+        best_objective = None
+        best_setting = None
+        if best:
+            best_objective, best_setting = best[max(best)]
+            if maximize:
+                best_objective *= -1
+        monitor.write(f"=== Best value found: {best_objective}")
+        monitor.write(f"=== Best setting: {best_setting}")
@@ -3,11 +3,31 @@ Contains the main interface, used to parse arguments and run the program.
 """
 
 import argparse
+import itertools
 import os
+import random
 import re
+import shutil
+import sys
 from typing import Dict, List, Set
 
-from argsearch import commands, optimization, ranges, strategies
+from argsearch import (
+    accounting,
+    cache,
+    commands,
+    distributed,
+    hyperband,
+    objectives,
+    pruning,
+    python_targets,
+    ranges,
+    refinement,
+    slots,
+    strategies,
+    streams,
+    tracing,
+)
+from argsearch.templates import CommandTemplate
 
 
 def positive_int(arg: str) -> int:
@@ -17,6 +37,45 @@ def positive_int(arg: str) -> int:
     return value
 
 
+def nonnegative_int(arg: str) -> int:
+    value = int(arg)
+    if value < 0:
+        raise argparse.ArgumentTypeError("Value must be a nonnegative integer.")
+    return value
+
+
+def positive_float(arg: str) -> float:
+    value = float(arg)
+    if value <= 0:
+        raise argparse.ArgumentTypeError("Value must be positive.")
+    return value
+
+
+def percentile(arg: str) -> float:
+    value = float(arg)
+    if not 0 <= value <= 100:
+        raise argparse.ArgumentTypeError("Value must be between 0 and 100.")
+    return value
+
+
+def byte_size(arg: str) -> int:
+    """
+    Parse a size in bytes, with an optional K, M, G or T (binary) suffix.
+    """
+    multipliers = {"K": 1 << 10, "M": 1 << 20, "G": 1 << 30, "T": 1 << 40}
+    suffix = arg[-1:].upper()
+    try:
+        if suffix in multipliers:
+            value = int(float(arg[:-1]) * multipliers[suffix])
+        else:
+            value = int(arg)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Invalid size: {arg}.")
+    if value < 0:
+        raise argparse.ArgumentTypeError("Size must not be negative.")
+    return value
+
+
 def parse_range_args(
     range_args: List[str], templates: Set[str]
 ) -> Dict[str, ranges.Range]:
@@ -86,6 +145,9 @@ def main():
     base_parser = argparse.ArgumentParser(
         description="Run the same command multiple times with different values for its "
         "arguments.",
+        # Otherwise, templates like "--c" could be taken for abbreviated options; the
+        # strategies' parsers are set up the same way below.
+        allow_abbrev=False,
     )
     base_parser.add_argument(
         "--num-workers",
@@ -95,14 +157,146 @@ def main():
         help="if provided, split work among N worker processes",
     )
     base_parser.add_argument(
+        "--engine",
+        choices=commands.ENGINES,
+        default="process",
+        help="how --num-workers runs commands: from separate worker processes "
+        "(default), or from threads of a single process, which is far cheaper at "
+        "high concurrency",
+    )
+    base_parser.add_argument(
+        "--serve",
+        metavar="ADDRESS",
+        help="instead of running trials here, serve them to `argsearch worker` "
+        "processes which connect to ADDRESS (HOST:PORT or a Unix socket path); "
+        "--num-workers then limits how many run at once across all workers",
+    )
+    base_parser.add_argument(
+        "--cores-per-trial",
+        type=positive_int,
+        metavar="N",
+        help="pin each trial to its own N CPU cores, and size common thread pools "
+        "to match; runs as many trials at once as there are free slots, unless "
+        "--num-workers is lower. The reserved {slot} template is replaced with the "
+        "trial's slot index",
+    )
+    base_parser.add_argument(
+        "--timeout",
+        type=positive_float,
+        metavar="SECONDS",
+        help="kill any trial (and every process it started) that runs for longer than "
+        "SECONDS",
+    )
+    base_parser.add_argument(
+        "--no-shell",
+        action="store_true",
+        help="run the command directly instead of with /bin/sh, which is faster for "
+        "short commands and keeps substituted values from being interpreted by the "
+        "shell, but rules out pipes, redirection and other shell syntax",
+    )
+    base_parser.add_argument(
+        "--no-dedup",
+        action="store_true",
+        help="run every trial, even if the same command has already run in this run "
+        "(by default, its result is reused); for programs which are intentionally "
+        "random",
+    )
+    base_parser.add_argument(
+        "--stage",
+        action="append",
+        dest="stages",
+        metavar="COMMAND",
+        help="run COMMAND before each trial's command, but only once for each set of "
+        "values of the templates it uses; trials only wait for the stages they "
+        "depend on. Repeat for a pipeline of several stages, in order",
+    )
+    base_parser.add_argument(
+        "--preload",
+        action="store_true",
+        help="for a py:module:function command, import the module before starting "
+        "worker processes, so that they start with it already imported (where "
+        "workers are forked)",
+    )
+    output_group = base_parser.add_mutually_exclusive_group()
+    output_group.add_argument(
         "--output-json",
         action="store_true",
         help="capture output and format it as JSON instead of streaming to terminal",
     )
+    output_group.add_argument(
+        "--output-jsonl",
+        action="store_true",
+        help="capture output and print each result as a line of JSON as soon as it "
+        "completes",
+    )
 
     base_parser.add_argument(
         "--disable-bar", action="store_true", help="disable the progress bar"
     )
+    base_parser.add_argument(
+        "--summary",
+        action="store_true",
+        help="at the end, print the total CPU time and peak memory used by trials, "
+        "and the slowest trials, to stderr",
+    )
+    base_parser.add_argument(
+        "--trace",
+        metavar="FILE",
+        help="write a timeline of trials on each worker slot, and of optimizer "
+        "phases, to FILE in Chrome trace format (view it at ui.perfetto.dev)",
+    )
+
+    spill_group = base_parser.add_argument_group("output files")
+    spill_group.add_argument(
+        "--output-dir",
+        metavar="DIR",
+        help="write each trial's stdout and stderr to files in DIR, keeping only the "
+        "end of each in memory and in results",
+    )
+    spill_group.add_argument(
+        "--compress",
+        choices=streams.COMPRESSIONS,
+        help="compress the files written to --output-dir",
+    )
+    spill_group.add_argument(
+        "--tail-bytes",
+        type=positive_int,
+        default=streams.DEFAULT_TAIL_BYTES,
+        metavar="N",
+        help="with --output-dir, how many bytes from the end of each stream to keep "
+        f"(default: {streams.DEFAULT_TAIL_BYTES})",
+    )
+
+    cache_group = base_parser.add_argument_group("result caching")
+    cache_group.add_argument(
+        "--cache-dir",
+        metavar="DIR",
+        help="reuse results of previously-run commands stored in DIR, and store new "
+        "ones there; safe to share between concurrent runs",
+    )
+    cache_group.add_argument(
+        "--cache-size",
+        type=byte_size,
+        metavar="SIZE",
+        help="evict least-recently-used cache entries beyond SIZE bytes "
+        "(e.g. 500M, 2G)",
+    )
+    cache_group.add_argument(
+        "--cache-fingerprint",
+        action="append",
+        default=[],
+        metavar="PATH",
+        help="invalidate cached results when the contents of PATH change "
+        "(may be repeated)",
+    )
+    cache_group.add_argument(
+        "--cache-env",
+        action="append",
+        default=[],
+        metavar="NAME",
+        help="invalidate cached results when environment variable NAME changes "
+        "(may be repeated)",
+    )
 
     strategy_parsers = base_parser.add_subparsers(
         title="strategy", description="the search strategy to use", dest="strategy",
@@ -120,6 +314,33 @@ def main():
     quasirandom_parser = strategy_parsers.add_parser(
         "quasirandom", help="low-discrepancy quasirandom search"
     )
+    quasirandom_parser.add_argument(
+        "--sequence",
+        choices=["sobol", "halton"],
+        default="sobol",
+        help="the low-discrepancy sequence to sample from: sobol (default) or halton, "
+        "which supports any number of templates",
+    )
+    quasirandom_parser.add_argument(
+        "--scramble",
+        action="store_true",
+        help="randomize the sequence (with Owen scrambling, for sobol), keeping its "
+        "low discrepancy",
+    )
+    quasirandom_parser.add_argument(
+        "--seed",
+        type=int,
+        help="scramble the sequence with this seed, so that it can be generated again; "
+        "implies --scramble",
+    )
+    quasirandom_parser.add_argument(
+        "--skip",
+        type=nonnegative_int,
+        default=0,
+        metavar="N",
+        help="start from point N of the sequence, e.g. to extend an earlier run of N "
+        "trials with only new points; steps are numbered from N",
+    )
     quasirandom_parser.add_argument(
         "trials", type=positive_int, help="number of quasirandom trials to run"
     )
@@ -133,6 +354,74 @@ def main():
     )
     grid_parser.set_defaults(strategy="grid")
 
+    refine_parser = strategy_parsers.add_parser(
+        "refine", help="grid search, then finer grids around the best results"
+    )
+    refine_parser.add_argument(
+        "--maximize",
+        action="store_true",
+        help="look for the largest output, rather than the smallest",
+    )
+    refine_parser.add_argument(
+        "--rounds",
+        type=nonnegative_int,
+        default=refinement.DEFAULT_ROUNDS,
+        metavar="N",
+        help="how many rounds of finer grids to run after the first grid "
+        f"(default: {refinement.DEFAULT_ROUNDS})",
+    )
+    refine_parser.add_argument(
+        "--top-k",
+        type=positive_int,
+        default=refinement.DEFAULT_TOP_K,
+        metavar="K",
+        help="how many of the best results to zoom in on in each round "
+        f"(default: {refinement.DEFAULT_TOP_K})",
+    )
+    refine_parser.add_argument(
+        "divisions",
+        type=int,
+        help="number of ways to divide each numeric interval, in the first grid and "
+        "in each zoomed-in cell (at least 2)",
+    )
+    refine_parser.set_defaults(strategy="refine")
+
+    hyperband_parser = strategy_parsers.add_parser(
+        "hyperband",
+        help="run many configurations with a small budget, and only the best with "
+        "larger ones",
+    )
+    hyperband_parser.add_argument(
+        "--budget",
+        required=True,
+        metavar="NAME",
+        help="the template which sets each trial's budget (e.g. its number of "
+        "epochs); its range gives the smallest and largest budgets",
+    )
+    hyperband_parser.add_argument(
+        "--maximize",
+        action="store_true",
+        help="look for the largest output, rather than the smallest",
+    )
+    hyperband_parser.add_argument(
+        "--eta",
+        type=int,
+        default=hyperband.DEFAULT_ETA,
+        help="the factor between successive budgets; the best 1/ETA of the trials "
+        f"at each budget are promoted to the next (default: {hyperband.DEFAULT_ETA})",
+    )
+    hyperband_parser.add_argument(
+        "--brackets",
+        type=positive_int,
+        metavar="N",
+        help="only start configurations at the N smallest budgets (default: all); "
+        "1 is the most aggressive",
+    )
+    hyperband_parser.add_argument(
+        "trials", type=positive_int, help="number of configurations to try"
+    )
+    hyperband_parser.set_defaults(strategy="hyperband")
+
     repeat_parser = strategy_parsers.add_parser("repeat", help="repeat a command")
     repeat_parser.add_argument(
         "repeats", type=positive_int, help="number of repeats to run"
@@ -140,6 +429,22 @@ def main():
     repeat_parser.set_defaults(strategy="repeat")
     repeat_parser.add_argument("command", help="the command to run")
 
+    worker_parser = strategy_parsers.add_parser(
+        "worker", help="run trials served by another argsearch process's --serve"
+    )
+    worker_parser.add_argument(
+        "address", help="the coordinator's --serve address (HOST:PORT or a path)"
+    )
+    worker_parser.add_argument(
+        "--connect-timeout",
+        type=positive_float,
+        default=distributed.DEFAULT_CONNECT_TIMEOUT,
+        metavar="SECONDS",
+        help="keep retrying for SECONDS if the coordinator isn't up yet "
+        f"(default: {distributed.DEFAULT_CONNECT_TIMEOUT:g})",
+    )
+    worker_parser.set_defaults(strategy="worker")
+
     minimize_parser = strategy_parsers.add_parser(
         "minimize", help="minimize with Bayesian optimization"
     )
@@ -156,10 +461,93 @@ def main():
     )
     maximize_parser.set_defaults(strategy="maximize")
 
+    for subparser in [minimize_parser, maximize_parser]:
+        subparser.add_argument(
+            "--journal",
+            metavar="PATH",
+            help="append every completed trial to PATH, so the run can be resumed",
+        )
+        subparser.add_argument(
+            "--async",
+            action="store_true",
+            dest="asynchronous",
+            help="propose a new point as soon as any trial finishes, instead of "
+            "waiting for the whole batch; keeps workers busy when runtimes vary",
+        )
+        subparser.add_argument(
+            "--speculate",
+            action="store_true",
+            help="fit the model and propose the next points in the background while "
+            "trials run, so workers never wait on the optimizer",
+        )
+        subparser.add_argument(
+            "--prune-percentile",
+            type=percentile,
+            metavar="P",
+            help="stop a trial early when an intermediate value it reports is worse "
+            "than the Pth percentile of earlier trials' values at the same step "
+            "(50 for the median rule)",
+        )
+        subparser.add_argument(
+            "--prune-min-trials",
+            type=positive_int,
+            default=pruning.DEFAULT_MIN_TRIALS,
+            metavar="N",
+            help="only stop trials at a step once N trials have reported that step "
+            f"(default: {pruning.DEFAULT_MIN_TRIALS})",
+        )
+        subparser.add_argument(
+            "--metric-prefix",
+            default=pruning.DEFAULT_METRIC_PREFIX,
+            metavar="PREFIX",
+            help="intermediate values are read from stdout lines like "
+            "'PREFIX step=10 value=0.3' "
+            f"(default: {pruning.DEFAULT_METRIC_PREFIX})",
+        )
+        subparser.add_argument(
+            "--surrogate",
+            # surrogates.SURROGATES, which imports skopt.
+            choices=("gp", "rf", "et", "gbrt", "tpe"),
+            default="gp",
+            help="model of the objective: a Gaussian process (default; best for short "
+            "runs), random forest, extra trees, gradient-boosted trees, or a TPE "
+            "density estimator (cheapest for very long runs)",
+        )
+        subparser.add_argument(
+            "--refit-interval",
+            type=positive_int,
+            default=1,
+            metavar="N",
+            help="only refit the model after every N results, proposing points from "
+            "the last fit in between; bounds optimizer overhead per trial (default: 1)",
+        )
+        subparser.add_argument(
+            "--resume",
+            action="store_true",
+            help="replay the trials in the journal instead of re-running them, then "
+            "continue the run",
+        )
+
+    for subparser in [
+        minimize_parser,
+        maximize_parser,
+        refine_parser,
+        hyperband_parser,
+    ]:
+        subparser.add_argument(
+            "--objective",
+            choices=objectives.OBJECTIVES,
+            default=objectives.OUTPUT_OBJECTIVE,
+            help="what to optimize: the number on the command's last line of output "
+            "(default), or a resource it used, e.g. wall_seconds to optimize runtime",
+        )
+
     for subparser in [
         random_parser,
         quasirandom_parser,
         grid_parser,
+        refine_parser,
+        hyperband_parser,
         minimize_parser,
         maximize_parser,
     ]:
@@ -173,8 +561,85 @@ def main():
             help="a numeric or categorical range for each template in the command",
         )
 
+    for strategy_parser in strategy_parsers.choices.values():
+        strategy_parser.allow_abbrev = False
+
     base_args = base_parser.parse_args()
-    templates = get_template_names(base_args.command)
+
+    trial_slots = None
+    if base_args.cores_per_trial:
+        if base_args.serve:
+            raise ValueError(
+                "--cores-per-trial applies to the machine running trials; pass it to "
+                "each `argsearch worker` instead of --serve."
+            )
+        trial_slots = slots.partition_cores(base_args.cores_per_trial)
+        if not base_args.num_workers:
+            base_args.num_workers = len(trial_slots)
+        elif base_args.num_workers > len(trial_slots):
+            raise ValueError(
+                f"--num-workers {base_args.num_workers} needs more cores than are "
+                f"available; at most {len(trial_slots)} trials can have "
+                f"{base_args.cores_per_trial} cores each."
+            )
+
+    if base_args.strategy == "worker":
+        distributed.run_worker(
+            distributed.parse_address(base_args.address),
+            base_args.num_workers or 1,
+            trial_slots,
+            base_args.connect_timeout,
+        )
+        return
+
+    if base_args.serve and not base_args.num_workers:
+        raise ValueError(
+            "--serve requires --num-workers, the most trials to run at once."
+        )
+
+    if base_args.stages and base_args.strategy in (
+        "minimize",
+        "maximize",
+        "refine",
+        "hyperband",
+    ):
+        raise ValueError(f"--stage can't be used with {base_args.strategy}.")
+    # Every command a trial runs: its upstream stages, then its own command.
+    all_commands = (base_args.stages or []) + [base_args.command]
+
+    templates = set().union(*map(get_template_names, all_commands))
+    if trial_slots:
+        # Filled in per trial, so it needs no range.
+        templates.discard(slots.SLOT_TEMPLATE)
+
+    if base_args.no_shell:
+        # Checked up front, rather than failing in the first trial.
+        for command in all_commands:
+            executable = CommandTemplate(command, shell=False).executable
+            if executable and not base_args.serve and not shutil.which(executable):
+                raise ValueError(
+                    f"--no-shell: {executable} is not an executable program."
+                )
+
+    python_commands = [
+        command for command in all_commands if python_targets.is_python_target(command)
+    ]
+    if python_commands:
+        # Standard streams are redirected for each call, so calls need a process each.
+        if base_args.engine == "thread":
+            raise ValueError("Python targets can't run with --engine thread.")
+        if base_args.timeout or getattr(base_args, "prune_percentile", None):
+            raise ValueError(
+                "Python targets can't be stopped partway, so --timeout and "
+                "--prune-percentile can't be used with them."
+            )
+        # Called from a long-lived worker process, rather than from this one.
+        base_args.num_workers = base_args.num_workers or 1
+        if base_args.preload:
+            for command in python_commands:
+                python_targets.load_function(python_targets.target_name(command))
+    elif base_args.preload:
+        raise ValueError("--preload only applies to py:module:function commands.")
 
     if base_args.strategy != "repeat":
         if not templates:
@@ -184,45 +649,186 @@ def main():
             )
         parsed_ranges = parse_range_args(base_args.ranges, templates)
 
-    if base_args.strategy == "minimize":
-        optimization.optimize_command(
-            command_template=base_args.command,
-            range_map=parsed_ranges,
-            trials=base_args.trials,
-            maximize=False,
-            output_json=base_args.output_json,
-            num_workers=base_args.num_workers,
-            disable_bar=base_args.disable_bar,
+    if getattr(base_args, "resume", False) and not base_args.journal:
+        raise ValueError("--resume requires --journal.")
+
+    result_cache = None
+    if base_args.cache_dir:
+        result_cache = cache.ResultCache(
+            base_args.cache_dir,
+            max_bytes=base_args.cache_size,
+            fingerprint=cache.fingerprint(
+                base_args.cache_fingerprint, base_args.cache_env
+            ),
         )
-        return
 
-    if base_args.strategy == "maximize":
-        optimization.optimize_command(
-            command_template=base_args.command,
-            range_map=parsed_ranges,
-            trials=base_args.trials,
-            maximize=True,
-            output_json=base_args.output_json,
-            num_workers=base_args.num_workers,
-            disable_bar=base_args.disable_bar,
+    capture_options = {}
+    if base_args.output_dir:
+        streams.check_compression(base_args.compress)
+        os.makedirs(base_args.output_dir, exist_ok=True)
+        capture_options.update(
+            output_dir=base_args.output_dir,
+            compression=base_args.compress,
+            tail_bytes=base_args.tail_bytes,
         )
-        return
+    elif base_args.compress:
+        raise ValueError("--compress requires --output-dir.")
 
-    if base_args.strategy == "random":
-        substitutions = strategies.random(parsed_ranges, base_args.trials)
-    elif base_args.strategy == "quasirandom":
-        substitutions = strategies.sobol(parsed_ranges, base_args.trials)
-    elif base_args.strategy == "grid":
-        substitutions = strategies.grid(parsed_ranges, base_args.divisions)
-    elif base_args.strategy == "repeat":
-        substitutions = [{}] * base_args.repeats
-    else:
-        raise ValueError(f"Unrecognized strategy: {base_args.strategy}.")
-
-    commands.run_commands(
-        base_args.command,
-        substitutions,
-        base_args.output_json,
-        base_args.num_workers,
-        base_args.disable_bar,
-    )
+    tracer = tracing.Tracer(base_args.trace) if base_args.trace else None
+    try:
+        if base_args.strategy in ("minimize", "maximize"):
+            # Deferred so that other strategies never pay for importing skopt.
+            from argsearch import optimization
+
+            pruner = None
+            if base_args.prune_percentile is not None:
+                pruner = pruning.PercentilePruner(
+                    percentile=base_args.prune_percentile,
+                    min_trials=base_args.prune_min_trials,
+                    prefix=base_args.metric_prefix,
+                    maximize=base_args.strategy == "maximize",
+                )
+
+            optimization.optimize_command(
+                command_template=base_args.command,
+                range_map=parsed_ranges,
+                trials=base_args.trials,
+                maximize=base_args.strategy == "maximize",
+                output_json=base_args.output_json,
+                num_workers=base_args.num_workers,
+                disable_bar=base_args.disable_bar,
+                cache=result_cache,
+                journal_path=base_args.journal,
+                resume=base_args.resume,
+                asynchronous=base_args.asynchronous,
+                speculate=base_args.speculate,
+                engine=base_args.engine,
+                output_jsonl=base_args.output_jsonl,
+                capture_options=capture_options,
+                pruner=pruner,
+                timeout=base_args.timeout,
+                slots=trial_slots,
+                serve=base_args.serve,
+                surrogate=base_args.surrogate,
+                refit_interval=base_args.refit_interval,
+                objective_field=base_args.objective,
+                summary=base_args.summary,
+                tracer=tracer,
+                shell=not base_args.no_shell,
+                dedup=not base_args.no_dedup,
+            )
+            return
+
+        if base_args.strategy == "hyperband":
+            if base_args.budget not in parsed_ranges:
+                raise ValueError(
+                    f"--budget {base_args.budget} isn't a template in the command."
+                )
+            if len(parsed_ranges) < 2:
+                raise ValueError(
+                    "hyperband needs at least one template besides the budget."
+                )
+            hyperband.hyperband_command(
+                command_template=base_args.command,
+                range_map=parsed_ranges,
+                budget_name=base_args.budget,
+                trials=base_args.trials,
+                maximize=base_args.maximize,
+                eta=base_args.eta,
+                num_brackets=base_args.brackets,
+                output_json=base_args.output_json,
+                num_workers=base_args.num_workers,
+                disable_bar=base_args.disable_bar,
+                cache=result_cache,
+                engine=base_args.engine,
+                output_jsonl=base_args.output_jsonl,
+                capture_options=capture_options,
+                timeout=base_args.timeout,
+                slots=trial_slots,
+                serve=base_args.serve,
+                objective_field=base_args.objective,
+                summary=base_args.summary,
+                tracer=tracer,
+                shell=not base_args.no_shell,
+            )
+            return
+
+        if base_args.strategy == "refine":
+            refinement.refine_command(
+                command_template=base_args.command,
+                range_map=parsed_ranges,
+                divisions=base_args.divisions,
+                maximize=base_args.maximize,
+                rounds=base_args.rounds,
+                top_k=base_args.top_k,
+                output_json=base_args.output_json,
+                num_workers=base_args.num_workers,
+                disable_bar=base_args.disable_bar,
+                cache=result_cache,
+                engine=base_args.engine,
+                output_jsonl=base_args.output_jsonl,
+                capture_options=capture_options,
+                timeout=base_args.timeout,
+                slots=trial_slots,
+                serve=base_args.serve,
+                objective_field=base_args.objective,
+                summary=base_args.summary,
+                tracer=tracer,
+                shell=not base_args.no_shell,
+            )
+            return
+
+        first_step = 0
+        if base_args.strategy == "random":
+            substitutions = strategies.random(parsed_ranges, base_args.trials)
+            total = base_args.trials
+        elif base_args.strategy == "quasirandom":
+            seed = base_args.seed
+            if base_args.scramble and seed is None:
+                # Reported, since extending the run with --skip needs the same seed.
+                seed = random.randrange(1 << 32)
+                sys.stderr.write(f"=== Scrambling with --seed {seed}\n")
+            substitutions = strategies.quasirandom(
+                parsed_ranges,
+                base_args.trials,
+                skip=base_args.skip,
+                sequence=base_args.sequence,
+                scramble=base_args.scramble or seed is not None,
+                seed=seed,
+            )
+            total = base_args.trials
+            first_step = base_args.skip
+        elif base_args.strategy == "grid":
+            substitutions = strategies.grid(parsed_ranges, base_args.divisions)
+            total = strategies.grid_size(parsed_ranges, base_args.divisions)
+        elif base_args.strategy == "repeat":
+            substitutions = itertools.repeat({}, base_args.repeats)
+            total = base_args.repeats
+        else:
+            raise ValueError(f"Unrecognized strategy: {base_args.strategy}.")
+
+        commands.run_commands(
+            base_args.command,
+            substitutions,
+            base_args.output_json,
+            base_args.num_workers,
+            base_args.disable_bar,
+            total,
+            result_cache,
+            base_args.engine,
+            base_args.output_jsonl,
+            capture_options,
+            base_args.timeout,
+            trial_slots,
+            base_args.serve,
+            base_args.summary,
+            tracer,
+            not base_args.no_shell,
+            base_args.stages,
+            # Repeating a command is the point of "repeat".
+            not base_args.no_dedup and base_args.strategy != "repeat",
+            first_step,
+        )
+    finally:
+        if tracer:
+            tracer.close()
@@ -0,0 +1,69 @@
+"""
+Objectives: the values which results-driven strategies compare trials by.
+
+Kept apart from `optimization`, so that strategies which don't need a model of the
+objective can read one without importing skopt.
+"""
+
+from typing import Any, Dict, Optional
+
+from argsearch import accounting
+
+# The default objective: the number a command prints on its last line of output.
+OUTPUT_OBJECTIVE = "output"
+OBJECTIVES = (OUTPUT_OBJECTIVE,) + accounting.RESOURCE_FIELDS
+
+
+def get_objective(
+    output: Dict[str, Any], objective_field: str = OUTPUT_OBJECTIVE
+) -> Optional[float]:
+    """
+    Get the objective value of a completed trial.
+
+    By default, this is the number on the last line of the command's stdout (or the
+    value returned by a Python target, unless it returned None), or for a trial stopped
+    early by a pruner or a timeout, the last intermediate value it reported, if any.
+
+    Parameters
+    ----------
+    output
+        The trial's result, as returned by `commands.capture_command`.
+    objective_field
+        "output" for the default, or else one of `accounting.RESOURCE_FIELDS` to
+        optimize the trial's resource usage instead, such as its runtime.
+
+    Returns
+    -------
+    Optional[float]
+        The objective value, or None for a trial which has none: one which timed out
+        before reporting a value, or one whose resource usage wasn't recorded or was
+        cut short by a pruner.
+    """
+    if objective_field != OUTPUT_OBJECTIVE:
+        if output.get("pruned"):
+            return None
+        return output.get(objective_field)
+
+    if output.get("pruned") or output.get("timed_out"):
+        metrics = output.get("metrics")
+        return metrics[-1][1] if metrics else None
+    if output.get("return_value") is not None:
+        return get_return_value(output["return_value"])
+    return get_command_output(output["stdout"])
+
+
+def get_return_value(value: Any) -> float:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"Python target must return a single number. Got: {value!r}.")
+
+
+def get_command_output(output: str) -> float:
+    lines = output.strip().split("\n")
+    try:
+        return float(lines[-1])
+    except ValueError:
+        raise ValueError(
+            f"Command's last line of output must be a single number. Got: {lines[-1]}."
+        )
@@ -2,31 +2,201 @@
 Code relating to sequential optimization.
 """
 
+import concurrent.futures
+import functools
 import json
-import multiprocessing
+import os
 import sys
-from typing import Dict
+from typing import IO, Any, Callable, Dict, List, Optional
 import warnings
 
-import skopt
+import numpy as np
 from tqdm import tqdm
 
-from argsearch import commands, ranges, strategies
+from argsearch import accounting, commands, pruning, ranges, surrogates, tracing
+from argsearch.cache import ResultCache
+from argsearch.dedup import Deduplicator
+from argsearch.objectives import OUTPUT_OBJECTIVE, get_objective
+from argsearch.slots import Slot
+from argsearch.templates import CommandTemplate
 
+# Repeated points are expected, since they are told from deduplicated results. Older
+# versions of skopt say "at this point before", newer ones "at point ... before".
 # See: https://github.com/scikit-optimize/scikit-optimize/issues/302
-warnings.filterwarnings(
-    "ignore", message="The objective has been evaluated at this point before."
-)
+warnings.filterwarnings("ignore", message="The objective has been evaluated at")
 
 
-def get_command_output(output: str) -> float:
-    lines = output.strip().split("\n")
-    try:
-        return float(lines[-1])
-    except ValueError:
-        raise ValueError(
-            f"Command's last line of output must be a single number. Got: {lines[-1]}."
-        )
+def _to_builtin(point: List[Any]) -> List[Any]:
+    """
+    Convert an optimizer point's NumPy scalars into plain Python values for JSON.
+    """
+    return [value.item() if isinstance(value, np.generic) else value for value in point]
+
+
+def read_journal(path: str) -> List[Dict[str, Any]]:
+    """
+    Read the trials recorded in an optimization journal.
+
+    Parameters
+    ----------
+    path
+        The journal file, in JSON Lines format. If it does not exist, it is treated as
+        empty.
+
+    Returns
+    -------
+    List[Dict[str, Any]]
+        One record per completed trial, in completion order, each containing the
+        "point" given to the optimizer, the raw "objective" value, and the command's
+        "output".
+    """
+    if not os.path.exists(path):
+        return []
+
+    records = []
+    with open(path, encoding="utf-8") as file:
+        lines = file.readlines()
+
+    for i, line in enumerate(lines):
+        try:
+            records.append(json.loads(line))
+        except ValueError:
+            # A crash mid-write can only truncate the final record; skip it.
+            if i == len(lines) - 1:
+                break
+            raise ValueError(f"Corrupt record on line {i + 1} of journal {path}.")
+
+    return records
+
+
+def open_journal(path: str) -> IO[str]:
+    """
+    Open an optimization journal for appending, first discarding the partial record a
+    crash mid-write may have left at its end, so that new records start on a line of
+    their own.
+    """
+    if os.path.exists(path):
+        with open(path, "rb+") as file:
+            contents = file.read()
+            if contents and not contents.endswith(b"\n"):
+                end = contents.rfind(b"\n") + 1
+                try:
+                    # Only the newline was lost, and `read_journal` kept the record.
+                    json.loads(contents[end:])
+                    file.write(b"\n")
+                except ValueError:
+                    file.truncate(end)
+    return open(path, "a", encoding="utf-8")
+
+
+def append_journal(journal: IO[str], record: Dict[str, Any]) -> None:
+    """
+    Durably append one completed trial to an optimization journal.
+    """
+    journal.write(json.dumps(record) + "\n")
+    journal.flush()
+    os.fsync(journal.fileno())
+
+
+def ask_constant_liar(
+    optimizer: Any, pending: List[List[Any]], n_points: Optional[int] = None
+) -> Any:
+    """
+    Ask the optimizer for new points while other points are still being evaluated.
+
+    Pending points are assumed to score as well as the best objective seen so far (the
+    "constant liar" heuristic), which steers new points away from them.
+
+    Parameters
+    ----------
+    optimizer
+        The optimizer, which has been told the completed results. TPE optimizers
+        are asked directly, since their proposals are already randomized.
+    pending
+        Points which have been proposed, but whose results are not yet known.
+    n_points
+        If provided, ask for a batch of this many points.
+
+    Returns
+    -------
+    Any
+        A new point to evaluate, or a list of `n_points` of them.
+    """
+    if isinstance(optimizer, surrogates.TPEOptimizer):
+        return optimizer.ask(n_points)
+    if not pending:
+        return optimizer.ask(n_points)
+
+    # Asked from a copy even without results to lie with, since skopt caches batches
+    # until it's told something, and would propose the pending points again.
+    speculative = optimizer.copy(random_state=optimizer.rng)
+    if optimizer.yi:
+        speculative.tell(pending, [min(optimizer.yi)] * len(pending))
+    return speculative.ask(n_points)
+
+
+class OptimizerThread:
+    """
+    Runs calls to an optimizer one at a time, in the order they were submitted, on a
+    background thread, so that refitting the model and proposing points overlap with
+    running trials.
+
+    If a call fails, later calls fail with the same exception, which is raised by the
+    first of their futures to be waited on, or else by `close()`.
+
+    Parameters
+    ----------
+    background
+        If False, run each call right away on the calling thread instead.
+    """
+
+    def __init__(self, background: bool = True):
+        self._executor: Optional[concurrent.futures.ThreadPoolExecutor] = None
+        if background:
+            self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self._error: Optional[BaseException] = None
+        # Calls which may not have finished yet, to cancel when stopping early.
+        self._futures: List[concurrent.futures.Future] = []
+
+    def submit(
+        self, func: Callable[..., Any], *args: Any
+    ) -> "concurrent.futures.Future":
+        """
+        Schedule `func(*args)`, returning a future for its result. Without a
+        background thread, exceptions are raised right away.
+        """
+        if self._executor is not None:
+            self._futures = [future for future in self._futures if not future.done()]
+            self._futures.append(self._executor.submit(self._call, func, *args))
+            return self._futures[-1]
+
+        future: "concurrent.futures.Future" = concurrent.futures.Future()
+        future.set_result(func(*args))
+        return future
+
+    def _call(self, func: Callable[..., Any], *args: Any) -> Any:
+        if self._error is not None:
+            raise self._error
+        try:
+            return func(*args)
+        except BaseException as error:
+            self._error = error
+            raise
+
+    def close(self, wait: bool = True) -> None:
+        """
+        Stop the thread, by default after finishing every call submitted so far, and
+        raise the exception of any call that failed. Otherwise, calls which haven't
+        started are cancelled, and only the running one (if any) finishes.
+        """
+        if self._executor is not None:
+            if not wait:
+                # `shutdown(cancel_futures=True)` needs Python 3.9.
+                for future in self._futures:
+                    future.cancel()
+            self._executor.shutdown(wait=wait)
+        if wait and self._error is not None:
+            raise self._error
 
 
 def optimize_command(
@@ -37,90 +207,360 @@ def optimize_command(
     output_json: bool = False,
     num_workers: int = 0,
     disable_bar: bool = False,
+    cache: Optional[ResultCache] = None,
+    journal_path: Optional[str] = None,
+    resume: bool = False,
+    asynchronous: bool = False,
+    speculate: bool = False,
+    engine: str = "process",
+    output_jsonl: bool = False,
+    capture_options: Optional[Dict[str, Any]] = None,
+    pruner: Optional[pruning.PercentilePruner] = None,
+    timeout: Optional[float] = None,
+    slots: Optional[List[Slot]] = None,
+    serve: Optional[str] = None,
+    surrogate: str = "gp",
+    refit_interval: int = 1,
+    objective_field: str = OUTPUT_OBJECTIVE,
+    summary: bool = False,
+    tracer: Optional[tracing.Tracer] = None,
+    shell: bool = True,
+    dedup: bool = True,
 ) -> None:
     """
     Optimize a command with closed-loop Bayesian optimization.
+
+    By default, points are proposed in batches of `num_workers`, and the next batch is
+    only proposed once every trial in the current one has finished. With
+    `asynchronous`, each result is told to the optimizer as soon as it arrives and a
+    new point is proposed for the freed worker right away, so slow trials never leave
+    other workers idle.
+
+    With `speculate`, the optimizer is told results and asked for points on a
+    background thread, and the next points are proposed while the trials before them
+    are still running, as if those trials score as well as the best so far. Workers
+    then never wait on the optimizer, but each proposal is made without the results
+    of the trials running alongside it.
+
+    `surrogate` chooses the model of the objective (one of `surrogates.SURROGATES`),
+    and with `refit_interval`, it is only refit after that many new results.
+
+    If `journal_path` is given, every completed trial is appended to it as soon as it
+    finishes. With `resume`, the trials already in that journal are replayed into the
+    optimizer instead of being run again, and only the remaining trials are run.
+
+    If `pruner` is given, trials report intermediate metrics as they run, and those
+    doing worse than earlier trials are stopped early. A stopped trial's last reported
+    value is told to the optimizer as its objective.
+
+    If `timeout` is given, trials running for longer than that many seconds are
+    killed. Trials that time out without reporting a value are not told to the
+    optimizer.
+
+    If `slots` are given, each trial runs on the cores of a slot that no other running
+    trial is using. There must be at least `num_workers` slots.
+
+    If `serve` is given, trials run on `argsearch worker` processes which connect to
+    that address, with at most `num_workers` running at once.
+
+    As with `commands.run_commands`, the first Ctrl-C stops proposing new trials but
+    lets running ones finish, and a second kills them.
+
+    `objective_field` chooses what to optimize; see `get_objective`. With `summary`,
+    a summary of the resources used by the run is printed to stderr at the end.
+
+    If `tracer` is given, each trial's lifecycle is recorded in it, along with the
+    time spent asking the optimizer for points and telling it results.
+
+    With `shell=False`, trials run the command directly rather than with the shell;
+    see `templates.CommandTemplate`.
+
+    With `dedup` (the default), a proposed point whose command has already run, or is
+    running, reuses that result instead of running again; see `dedup`.
+
+    `capture_options` are extra keyword arguments for `commands.capture_command`.
     """
 
     if num_workers == 0:
         num_workers = 1
 
-    process_pool = multiprocessing.Pool(
-        num_workers, initializer=tqdm.set_lock, initargs=(tqdm.get_lock(),)
-    )
+    if journal_path and not resume and os.path.exists(journal_path):
+        raise ValueError(
+            f"Journal {journal_path} already exists. Pass --resume to continue it, or "
+            "remove it to start over."
+        )
+
+    process_pool = commands.make_pool(num_workers, engine, serve)
 
     template_names = list(range_map.keys())
     skopt_spaces = [range_map[name].to_skopt() for name in template_names]
-    optimizer = skopt.Optimizer(skopt_spaces, n_jobs=-1)
-
-    def eval_commands(args_list, step):
-        packed_command_args = []
-        for i, args in enumerate(args_list):
-            substitutions = dict(zip(template_names, map(str, args)))
-            packed_command_args.append(
-                (command_template, substitutions, step + i, None)
+    optimizer = surrogates.make_optimizer(skopt_spaces, surrogate, refit_interval)
+
+    replayed = read_journal(journal_path) if journal_path and resume else []
+    for record in replayed:
+        if sorted(record["output"]["substitutions"]) != sorted(template_names):
+            raise ValueError(
+                f"Journal {journal_path} was recorded with templates "
+                f"{sorted(record['output']['substitutions'])}, but this command has "
+                f"templates {sorted(template_names)}."
+            )
+    # Recomputed rather than read from the journal, in case the objective changed.
+    told = []
+    for record in replayed:
+        value = get_objective(record["output"], objective_field)
+        if value is not None:
+            told.append((record, value))
+    if told:
+        sign = -1 if maximize else 1
+        with tracing.span(tracer, "replay", trials=len(told)):
+            optimizer.tell(
+                [record["point"] for record, _ in told],
+                [sign * value for _, value in told],
             )
+    if pruner:
+        for record in replayed:
+            pruner.record(record["output"].get("metrics", []))
 
-        return process_pool.imap(commands._capture_command_packed, packed_command_args)
+    template = CommandTemplate(command_template, shell)
+
+    def pack_command_args(point, step):
+        substitutions = dict(zip(template_names, map(str, point)))
+        if pruner:
+            task_kwargs = {"metric_watcher": pruner.watcher()}
+            return (template, substitutions, step, None, task_kwargs)
+        return (template, substitutions, step, None)
+
+    capture = functools.partial(
+        commands._capture_command_packed,
+        cache=cache,
+        timeout=timeout,
+        **(capture_options or {}),
+    )
 
     best_objective = None
     best_setting = None
     steps_since_improvement = 0
 
+    def update_best(objective, output):
+        nonlocal best_objective, best_setting, steps_since_improvement
+        if best_objective is None or best_objective > objective:
+            best_objective = objective
+            best_setting = output["substitutions"]
+            steps_since_improvement = 0
+        else:
+            steps_since_improvement += 1
+
+    for record, value in told:
+        update_best(-value if maximize else value, record["output"])
+
+    resource_summary = accounting.ResourceSummary() if summary else None
+    deduplicator = Deduplicator() if dedup else None
+    if deduplicator:
+        # Points which already ran before resuming aren't run again either.
+        for record in replayed:
+            output = record["output"]
+            deduplicator.seed(
+                (template, output["substitutions"], output["step"], None), output
+            )
+
+    journal = open_journal(journal_path) if journal_path else None
+    optimizer_thread = OptimizerThread(background=speculate)
+
+    def ask(step, pending_points, n_points=None):
+        with tracing.span(tracer, "ask", step=step):
+            return ask_constant_liar(optimizer, pending_points, n_points)
+
+    def tell_optimizer(step, points, objectives):
+        with tracing.span(tracer, "tell", step=step):
+            optimizer.tell(points, objectives)
+
+    if output_json:
+        outputs = [record["output"] for record in replayed]
+
+    def process_output(point, output, monitor) -> Optional[float]:
+        """
+        Report and record a completed trial, returning the objective to minimize.
+        """
+        raw_objective = get_objective(output, objective_field)
+        objective = None
+        if raw_objective is not None:
+            objective = -raw_objective if maximize else raw_objective
+
+        if pruner:
+            pruner.record(output.get("metrics", []))
+        if resource_summary:
+            resource_summary.record(output)
+        if tracer and output.get("duplicate_of") is None:
+            # Duplicates were never dispatched, so they have no lifecycle to trace.
+            tracer.completed(output)
+
+        if journal:
+            append_journal(
+                journal,
+                {
+                    "point": _to_builtin(point),
+                    "objective": raw_objective,
+                    "output": output,
+                },
+            )
+
+        if output_json:
+            outputs.append(output)
+        else:
+            commands.write_output(output, monitor, output_jsonl)
+
+        if objective is not None:
+            update_best(objective, output)
+        monitor.set_postfix({"steps since improvement": steps_since_improvement})
+        monitor.update()
+        return objective
+
     try:
-        with tqdm(total=trials, disable=disable_bar) as monitor:
-            if output_json:
-                outputs = []
+        with commands.GracefulInterrupt() as interrupt, tqdm(
+            total=trials, initial=len(replayed), disable=disable_bar
+        ) as monitor:
+            if asynchronous:
+                # Points which have been dispatched, but whose results haven't arrived.
+                pending: Dict[int, List[Any]] = {}
+
+                def tell(output):
+                    point = pending.pop(output["step"])
+                    objective = process_output(point, output, monitor)
+                    if objective is not None:
+                        optimizer_thread.submit(
+                            tell_optimizer, output["step"], point, objective
+                        )
+
+                def proposals():
+                    proposal = None
+                    for step in range(len(replayed), trials):
+                        if proposal is None:
+                            proposal = optimizer_thread.submit(
+                                ask, step, list(pending.values())
+                            )
+                        point = proposal.result()
+                        proposal = None
+                        pending[step] = point
+                        if speculate and step + 1 < trials:
+                            # Ready for the next worker to free up.
+                            proposal = optimizer_thread.submit(
+                                ask, step + 1, list(pending.values())
+                            )
+                        args = pack_command_args(point, step)
+                        if deduplicator and not deduplicator.admit(args):
+                            # A repeat of a finished trial is told right away, so the
+                            # next proposal accounts for it.
+                            for output in deduplicator.drain():
+                                tell(output)
+                            continue
+                        yield args
 
-            for step in range(0, trials, num_workers):
-                args_list = optimizer.ask(num_workers)
-                objective_values = []
+                dispatched = interrupt.until_draining(proposals())
+                allocator = None
+                if slots:
+                    allocator = commands.SlotAllocator(slots[:num_workers])
+                    dispatched = allocator.assign(dispatched)
+                if tracer:
+                    dispatched = tracer.track(dispatched)
 
-                for output in eval_commands(args_list, step):
-                    objective = get_command_output(output["stdout"])
+                # Unless speculating, a new point is only proposed once a worker frees
+                # up, after the result it just produced has been told to the optimizer.
+                for output in commands.imap_bounded(
+                    process_pool, capture, dispatched, num_workers
+                ):
+                    if allocator:
+                        allocator.release(output)
+                    if deduplicator:
+                        deduplicator.finished(output)
+                    tell(output)
+                    # Repeats of this trial which were proposed while it ran.
+                    for duplicate in deduplicator.drain() if deduplicator else []:
+                        tell(duplicate)
+            else:
+                proposal = None
+                for step in range(len(replayed), trials, num_workers):
+                    if interrupt.draining:
+                        break
 
-                    if maximize:
-                        objective *= -1
+                    if proposal is None:
+                        proposal = optimizer_thread.submit(
+                            ask, step, [], min(num_workers, trials - step)
+                        )
+                    points = proposal.result()
+                    proposal = None
+                    next_step = step + num_workers
+                    if speculate and next_step < trials:
+                        # The next batch is proposed while this one runs.
+                        proposal = optimizer_thread.submit(
+                            ask, next_step, points, min(num_workers, trials - next_step)
+                        )
+                    packed_command_args = [
+                        pack_command_args(point, step + i)
+                        for i, point in enumerate(points)
+                    ]
+                    batch_points = dict(zip(range(step, step + len(points)), points))
+                    results = []
 
-                    objective_values.append(objective)
+                    def record_result(output):
+                        point = batch_points[output["step"]]
+                        results.append((point, process_output(point, output, monitor)))
 
-                    if output_json:
-                        outputs.append(output)
-                    else:
-                        header = commands.format_header(
-                            output["step"], output["command"], output["substitutions"]
+                    if deduplicator:
+                        # Repeated points only run once, and repeats of points from
+                        # earlier batches don't run at all.
+                        packed_command_args = [
+                            args
+                            for args in packed_command_args
+                            if deduplicator.admit(args)
+                        ]
+                        for duplicate in deduplicator.drain():
+                            record_result(duplicate)
+                    if slots:
+                        # Every trial in a batch runs at once, on its own slot.
+                        packed_command_args = [
+                            commands.with_task_kwargs(args, slot=slot)
+                            for args, slot in zip(packed_command_args, slots)
+                        ]
+                    if tracer:
+                        packed_command_args = list(tracer.track(packed_command_args))
+                    for output in process_pool.imap(capture, packed_command_args):
+                        record_result(output)
+                        if deduplicator:
+                            deduplicator.finished(output)
+                            for duplicate in deduplicator.drain():
+                                record_result(duplicate)
+                    results = [result for result in results if result[1] is not None]
+                    if results:
+                        optimizer_thread.submit(
+                            tell_optimizer, step, *map(list, zip(*results))
                         )
-                        output_with_header = f'{header}\n{output["stdout"]}'
-                        monitor.write(output_with_header, end="")
-                        if output["stderr"]:
-                            sys.stderr.write(output["stderr"])
-                            sys.stderr.flush()
-
-                    if best_objective is None or best_objective > objective:
-                        best_objective = objective
-                        best_setting = output["substitutions"]
-                        steps_since_improvement = 0
-                    else:
-                        steps_since_improvement += 1
-
-                    monitor.set_postfix(
-                        {"steps since improvement": steps_since_improvement}
-                    )
-                    monitor.update()
-
-                optimizer.tell(args_list, objective_values)
+        optimizer_thread.close()
 
     except KeyboardInterrupt:
-        pass
+        commands.terminate_pool(process_pool)
+    except BaseException:
+        commands.terminate_pool(process_pool)
+        raise
+    else:
+        commands.close_pool(process_pool)
+    finally:
+        # Doesn't wait for proposals or refits that are no longer needed.
+        optimizer_thread.close(wait=False)
+        if journal:
+            journal.close()
 
     monitor.clear()
     monitor.close()
 
+    if resource_summary:
+        sys.stderr.write(resource_summary.format() + "\n")
+        sys.stderr.flush()
+
     if output_json:
         formatted = json.dumps(outputs)
         monitor.write(formatted)
-    else:
-        if maximize:
-            best_objective *= -1  # type: ignore
+    elif not output_jsonl:
+        if maximize and best_objective is not None:
+            best_objective *= -1
         monitor.write(f"=== Best value found: {best_objective}",)
         monitor.write(f"=== Best setting: {best_setting}",)
@@ -0,0 +1,160 @@
+"""
+Multi-stage pipelines, in which each trial runs one or more upstream stages before its
+command, and each distinct upstream command runs only once.
+
+A stage depends only on the templates it mentions, so in a sweep like
+
+    prepare --tokenizer {tokenizer} --vocab {vocab}  ->  train --lr {lr} ...
+
+every trial with the same tokenizer and vocabulary shares one run of the preparation
+stage, and trials wait only for the stages they depend on.
+"""
+
+import collections
+from typing import Any, Deque, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from argsearch.templates import CommandTemplate
+
+# The most trials held back waiting for upstream stages at once. Waiting trials are
+# kept in memory, so this bounds how far ahead of the running trials the search is
+# read, while leaving plenty of independent trials to keep workers busy.
+DEFAULT_LOOKAHEAD = 10_000
+
+
+class _Trial:
+    """
+    A trial making its way through the stages of a pipeline.
+    """
+
+    __slots__ = ("step", "substitutions", "stage")
+
+    def __init__(self, step: int, substitutions: Dict[str, str]):
+        self.step = step
+        self.substitutions = substitutions
+        # The index of the next stage this trial needs.
+        self.stage = 0
+
+
+class Pipeline:
+    """
+    Schedules the stages of a pipeline, producing packed `commands.capture_command`
+    arguments for upstream stages and final commands alike.
+
+    Pass `tasks()` to `commands.imap_bounded`, and call `finished()` with each result
+    before consuming the next one. Upstream results are marked with the index of their
+    "stage", and have a step like "stage0-3", so they don't collide with trials'.
+    If an upstream command fails, the trials depending on it are skipped, and can be
+    collected from `skipped`.
+
+    Parameters
+    ----------
+    stages
+        The upstream stages, in the order each trial runs them.
+    command_template
+        The final command of each trial.
+    substitutions
+        Substitution sets, one per trial, which are consumed lazily.
+    first_step
+        The step of the first trial.
+    lookahead
+        The most trials to hold back waiting for upstream stages at once.
+    """
+
+    def __init__(
+        self,
+        stages: List[CommandTemplate],
+        command_template: CommandTemplate,
+        substitutions: Iterable[Dict[str, str]],
+        first_step: int = 0,
+        lookahead: int = DEFAULT_LOOKAHEAD,
+    ):
+        self.stages = stages
+        self.command_template = command_template
+        self.lookahead = lookahead
+        # Trials which were skipped because an upstream command failed.
+        self.skipped: List[Tuple[int, Dict[str, str]]] = []
+
+        self._trials = enumerate(substitutions, first_step)
+        self._exhausted = False
+        self._ready: Deque[_Trial] = collections.deque()
+        # Maps each upstream command that's running to the trials waiting on it.
+        self._running: Dict[str, List[_Trial]] = {}
+        # Maps each finished upstream command to its return code.
+        self._finished: Dict[str, int] = {}
+        # Maps the steps of running upstream commands to their stage and command.
+        self._stage_steps: Dict[str, Tuple[int, str]] = {}
+        self._num_waiting = 0
+        self._stage_counts = [0] * len(stages)
+        self._stage_names = [stage.names for stage in stages]
+
+    def tasks(self) -> Iterator[Optional[Tuple[Any, ...]]]:
+        """
+        Generate packed arguments for each command to run, or None when nothing can
+        run until a running command finishes.
+        """
+        while True:
+            if self._ready:
+                task = self._advance(self._ready.popleft())
+                if task is not None:
+                    yield task
+            elif not self._exhausted and self._num_waiting < self.lookahead:
+                try:
+                    step, substitutions = next(self._trials)
+                except StopIteration:
+                    self._exhausted = True
+                else:
+                    self._ready.append(_Trial(step, substitutions))
+            elif self._running:
+                yield None
+            else:
+                return
+
+    def _advance(self, trial: _Trial) -> Optional[Tuple[Any, ...]]:
+        """
+        Get the next command a trial can run, or None if it must wait (or was skipped).
+        """
+        while trial.stage < len(self.stages):
+            template = self.stages[trial.stage]
+            command, _ = template.render(trial.substitutions)
+            if command in self._running:
+                self._running[command].append(trial)
+                self._num_waiting += 1
+                return None
+
+            returncode = self._finished.get(command)
+            if returncode is None:
+                # Not run yet; this trial starts it, and waits for it.
+                self._running[command] = [trial]
+                self._num_waiting += 1
+                step = f"stage{trial.stage}-{self._stage_counts[trial.stage]}"
+                self._stage_counts[trial.stage] += 1
+                self._stage_steps[step] = (trial.stage, command)
+                substitutions = {
+                    name: value
+                    for name, value in trial.substitutions.items()
+                    if name in self._stage_names[trial.stage]
+                }
+                return (template, substitutions, step, None)
+            if returncode != 0:
+                self.skipped.append((trial.step, trial.substitutions))
+                return None
+            trial.stage += 1
+
+        return (self.command_template, trial.substitutions, trial.step, None)
+
+    def finished(self, output: Dict[str, Any]) -> bool:
+        """
+        Record a finished command, returning whether it was an upstream stage (which
+        is then marked with its "stage") rather than a trial's final command.
+        """
+        stage_command = self._stage_steps.pop(output["step"], None)
+        if stage_command is None:
+            return False
+
+        stage, command = stage_command
+        output["stage"] = stage
+        self._finished[command] = output["returncode"]
+        waiting = self._running.pop(command)
+        self._num_waiting -= len(waiting)
+        self._ready.extend(waiting)
+        return True
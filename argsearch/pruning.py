@@ -0,0 +1,140 @@
+"""
+Early stopping of unpromising trials, based on intermediate metrics they report.
+
+A command reports an intermediate metric by printing a line like
+
+    ARGSEARCH step=10 value=0.3
+
+to stdout. While it runs, each reported value is compared to the values that earlier
+trials reported at the same step, and the trial is stopped if it is doing worse than
+most of them.
+"""
+
+import re
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+DEFAULT_METRIC_PREFIX = "ARGSEARCH"
+DEFAULT_MIN_TRIALS = 5
+
+METRIC_PATTERN = re.compile(r"\s+step=(-?\d+)\s+value=(\S+)\s*$")
+
+
+def parse_metric_line(line: str, prefix: str) -> Optional[Tuple[int, float]]:
+    """
+    Parse an intermediate metric line printed by a command.
+
+    Parameters
+    ----------
+    line
+        A line of the command's stdout.
+    prefix
+        The marker that metric lines start with.
+
+    Returns
+    -------
+    Optional[Tuple[int, float]]
+        The reported step and value, or None if this is not a valid metric line.
+    """
+    if not line.startswith(prefix):
+        return None
+    match = METRIC_PATTERN.match(line, len(prefix))
+    if not match:
+        return None
+    try:
+        return int(match.group(1)), float(match.group(2))
+    except ValueError:
+        return None
+
+
+class MetricWatcher:
+    """
+    Watches the output of one running trial, deciding whether to stop it.
+
+    A watcher is created by `PercentilePruner.watcher()` when a trial is dispatched,
+    and sent to the worker running it. All values are compared after multiplying by
+    `sign`, so that lower is always better.
+    """
+
+    def __init__(self, prefix: str, sign: float, thresholds: Dict[int, float]):
+        self.prefix = prefix
+        self.sign = sign
+        self.thresholds = thresholds
+        self.metrics: List[Tuple[int, float]] = []
+        self.stopped_at: Optional[int] = None
+
+    def observe(self, line: str) -> bool:
+        """
+        Process one line of the trial's stdout.
+
+        Returns
+        -------
+        bool
+            True if the trial should be stopped.
+        """
+        metric = parse_metric_line(line, self.prefix)
+        if metric is None:
+            return False
+
+        step, value = metric
+        self.metrics.append((step, value))
+        threshold = self.thresholds.get(step)
+        if threshold is not None and self.sign * value > threshold:
+            self.stopped_at = step
+            return True
+        return False
+
+
+class PercentilePruner:
+    """
+    Stops trials whose intermediate values are worse than a percentile of the values
+    that earlier trials reported at the same step.
+
+    With `percentile=50` this is the median stopping rule. Higher percentiles are more
+    lenient; e.g. 75 only stops trials doing worse than three quarters of earlier ones.
+    """
+
+    def __init__(
+        self,
+        percentile: float = 50.0,
+        min_trials: int = DEFAULT_MIN_TRIALS,
+        prefix: str = DEFAULT_METRIC_PREFIX,
+        maximize: bool = False,
+    ):
+        """
+        Parameters
+        ----------
+        percentile
+            The percentile, in [0, 100], that a trial must do at least as well as.
+        min_trials
+            Don't stop trials at a step until this many trials have reported a value
+            for that step.
+        prefix
+            The marker that metric lines start with.
+        maximize
+            If True, higher values are better.
+        """
+        self.percentile = percentile
+        self.min_trials = min_trials
+        self.prefix = prefix
+        self.sign = -1.0 if maximize else 1.0
+        self.history: Dict[int, List[float]] = {}
+
+    def record(self, metrics: List[Tuple[int, float]]) -> None:
+        """
+        Add the intermediate metrics of a finished (or stopped) trial to the history.
+        """
+        for step, value in metrics:
+            self.history.setdefault(step, []).append(self.sign * value)
+
+    def watcher(self) -> MetricWatcher:
+        """
+        Create a watcher for a new trial, judged against the current history.
+        """
+        thresholds = {
+            step: float(np.percentile(values, self.percentile))
+            for step, values in self.history.items()
+            if len(values) >= self.min_trials
+        }
+        return MetricWatcher(self.prefix, self.sign, thresholds)
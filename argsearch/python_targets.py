@@ -0,0 +1,235 @@
+"""
+Runs trials by calling a Python function in a long-lived worker process, rather than
+starting a new program for each one.
+
+A command like `py:mypkg.train:main lr={lr} {epochs}` imports `mypkg.train` once per
+worker, then for each trial calls `main("10", lr="0.01")`: arguments of the form
+`name=value` are passed by keyword, and the rest by position, all as strings. Whatever
+the function prints is captured like a command's output, and its return value is
+recorded in the trial's result.
+"""
+
+import importlib
+import json
+import os
+import re
+import shlex
+import sys
+import threading
+import traceback
+import types
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+try:
+    import resource
+except ImportError:  # Not available on Windows; resource usage is then not recorded.
+    resource = None  # type: ignore
+
+from argsearch.slots import Slot
+from argsearch.streams import OutputCollector
+
+PREFIX = "py:"
+
+# Arguments passed by keyword, as "name=value".
+KEYWORD_PATTERN = re.compile(r"([A-Za-z_]\w*)=(.*)", re.DOTALL)
+
+# Functions which have already been imported by this process.
+_FUNCTIONS: Dict[str, Callable[..., Any]] = {}
+
+# Standard streams are process-wide, so only one call may capture them at a time.
+_CALL_LOCK = threading.Lock()
+
+
+def is_python_target(command: str) -> bool:
+    """
+    Whether a command string names a Python function, rather than a program.
+    """
+    return command.startswith(PREFIX)
+
+
+def target_name(command: str) -> str:
+    """
+    Get the "module:function" that a Python target command calls.
+    """
+    return shlex.split(command[len(PREFIX) :])[0]
+
+
+def load_function(target: str) -> Callable[..., Any]:
+    """
+    Import a function, given as "module:function", once per process.
+    """
+    if target in _FUNCTIONS:
+        return _FUNCTIONS[target]
+
+    module_name, separator, function_name = target.partition(":")
+    if not separator or not module_name or not function_name:
+        raise ValueError(
+            f"Python targets look like {PREFIX}module:function, got {PREFIX}{target}."
+        )
+    # As with `python -m`, modules in the working directory can be imported.
+    if os.getcwd() not in sys.path:
+        sys.path.insert(0, os.getcwd())
+    function: Any = importlib.import_module(module_name)
+    for attribute in function_name.split("."):
+        function = getattr(function, attribute)
+    _FUNCTIONS[target] = function
+    return function
+
+
+def split_arguments(arguments: List[str]) -> Tuple[List[str], Dict[str, str]]:
+    """
+    Split a target's arguments into positional and keyword arguments.
+    """
+    args: List[str] = []
+    kwargs: Dict[str, str] = {}
+    for argument in arguments:
+        match = KEYWORD_PATTERN.fullmatch(argument)
+        if match:
+            kwargs[match.group(1)] = match.group(2)
+        else:
+            args.append(argument)
+    return args, kwargs
+
+
+def _to_json(value: Any) -> Any:
+    """
+    Keep a return value as it is if it can be written to JSON, or else its repr.
+    """
+    try:
+        json.dumps(value)
+    except (TypeError, ValueError):
+        return repr(value)
+    return value
+
+
+class _RedirectedStream:
+    """
+    Points one of this process's standard file descriptors at an output collector
+    for the duration of a call, so that output from C extensions and subprocesses is
+    captured along with Python's.
+    """
+
+    def __init__(self, file_descriptor: int, collector: OutputCollector):
+        self.file_descriptor = file_descriptor
+        self.collector = collector
+        self._saved: Optional[int] = None
+
+    def __enter__(self) -> None:
+        target = self.collector.popen_target()
+        if hasattr(target, "fileno"):
+            # Installed first, since starting the collector closes its own handle.
+            self._install(target.fileno())
+            self.collector.start(None)
+        else:
+            read_end, write_end = os.pipe()
+            self.collector.start(os.fdopen(read_end, "rb"))
+            self._install(write_end)
+            os.close(write_end)
+
+    def _install(self, write_end: int) -> None:
+        self._saved = os.dup(self.file_descriptor)
+        os.dup2(write_end, self.file_descriptor)
+
+    def __exit__(self, *exc_info) -> None:
+        assert self._saved is not None
+        # Closing the last handle to a pipe lets the collector see the end of it.
+        os.dup2(self._saved, self.file_descriptor)
+        os.close(self._saved)
+
+
+def call(
+    arguments: List[str],
+    collectors: Dict[str, OutputCollector],
+    slot: Optional[Slot] = None,
+) -> Tuple[int, Any, Any]:
+    """
+    Call a Python target, capturing what it prints.
+
+    Parameters
+    ----------
+    arguments
+        The target's "module:function", followed by its arguments.
+    collectors
+        Collectors for "stdout" and "stderr", which must not have been started.
+    slot
+        If provided, run the call on this slot's cores, with its environment.
+
+    Returns
+    -------
+    Tuple[int, Any, Any]
+        A return code (0, 1 if the function raised an exception, or the code it
+        passed to `sys.exit`), its return value (converted to something that can be
+        written to JSON), and its resource usage like `os.wait4`'s, or None where
+        that is unavailable.
+    """
+    function = load_function(arguments[0])
+    args, kwargs = split_arguments(arguments[1:])
+
+    with _CALL_LOCK:
+        before = resource.getrusage(resource.RUSAGE_SELF) if resource else None
+        restore = _enter_slot(slot)
+        sys.stdout.flush()
+        sys.stderr.flush()
+        returncode, value = 0, None
+        try:
+            with _RedirectedStream(1, collectors["stdout"]), _RedirectedStream(
+                2, collectors["stderr"]
+            ):
+                try:
+                    value = _to_json(function(*args, **kwargs))
+                except SystemExit as error:
+                    if isinstance(error.code, int) or error.code is None:
+                        returncode = error.code or 0
+                    else:
+                        print(error.code, file=sys.stderr)
+                        returncode = 1
+                except Exception as error:
+                    # Leave this function's own frame out of the traceback.
+                    traceback.print_exception(
+                        type(error), error, error.__traceback__.tb_next  # type: ignore
+                    )
+                    returncode = 1
+                finally:
+                    sys.stdout.flush()
+                    sys.stderr.flush()
+        finally:
+            restore()
+        after = resource.getrusage(resource.RUSAGE_SELF) if resource else None
+
+    if before is None or after is None:
+        return returncode, value, None
+    usage = types.SimpleNamespace(
+        ru_utime=after.ru_utime - before.ru_utime,
+        ru_stime=after.ru_stime - before.ru_stime,
+        # Peak memory can't be attributed to a single call; this is the worker's.
+        ru_maxrss=after.ru_maxrss,
+    )
+    return returncode, value, usage
+
+
+def _enter_slot(slot: Optional[Slot]) -> Callable[[], None]:
+    """
+    Apply a slot's cores and environment to this process, returning a function which
+    undoes it.
+    """
+    if slot is None:
+        return lambda: None
+
+    environment = slot.environment()
+    saved_environment = {name: os.environ.get(name) for name in environment}
+    os.environ.update(environment)
+    saved_affinity = None
+    if hasattr(os, "sched_setaffinity"):
+        saved_affinity = os.sched_getaffinity(0)
+        os.sched_setaffinity(0, slot.cores)
+
+    def restore() -> None:
+        for name, value in saved_environment.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+        if saved_affinity is not None:
+            os.sched_setaffinity(0, saved_affinity)
+
+    return restore
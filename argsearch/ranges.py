@@ -4,13 +4,17 @@ Defines Ranges, which specify how to sample arguments of various types.
 
 import abc
 import argparse
-from typing import List, Union
+import math
+from typing import TYPE_CHECKING, List, Optional, Union, cast
 import numbers
 import random
 
 import numpy as np
-from scipy import stats
-import skopt
+
+# skopt (and the scipy/scikit-learn stack behind it) takes a long time to import, and
+# is only needed for Bayesian optimization, so it is imported lazily in to_skopt().
+if TYPE_CHECKING:
+    import skopt
 
 
 def cast_range_argument(arg: str) -> Union[int, float, str]:
@@ -96,10 +100,89 @@ class Range(abc.ABC):
         """
         raise NotImplementedError
 
+    def random_samples(self, count: int) -> np.ndarray:
+        """
+        Get many independent random samples from this range at once.
+
+        Subclasses override this with a vectorized implementation; the default simply
+        calls random_sample() repeatedly.
+
+        Parameters
+        ----------
+        count
+            How many samples to draw.
+
+        Returns
+        -------
+        np.ndarray
+            A 1D array of `count` strings, each a value to be substituted into the
+            command in place of a bracketed template.
+        """
+        return np.array([self.random_sample() for _ in range(count)], dtype=str)
+
+    def transform_uniform_samples(self, uniform_samples: np.ndarray) -> np.ndarray:
+        """
+        Transform an array of samples from a unit uniform distribution into samples
+        from this distribution, elementwise.
+
+        Subclasses override this with a vectorized implementation; the default simply
+        calls transform_uniform_sample() on each element.
+
+        Parameters
+        ----------
+        uniform_samples
+            A 1D array of samples from the uniform distribution, in range [0, 1].
+
+        Returns
+        -------
+        np.ndarray
+            A 1D array of strings, each a value to be substituted into the command in
+            place of a bracketed template.
+        """
+        return np.array(
+            [self.transform_uniform_sample(sample) for sample in uniform_samples],
+            dtype=str,
+        )
+
     @abc.abstractmethod
-    def to_skopt(self) -> skopt.space.Space:
+    def to_skopt(self) -> "skopt.space.Space":
         raise NotImplementedError
 
+    def zoom(
+        self, value: str, divisions: int, bounds: Optional["Range"] = None
+    ) -> "Range":
+        """
+        Get the region around one of this range's grid values, to grid more finely.
+
+        Numeric ranges override this to return the cell of the grid around `value`,
+        reaching halfway to the neighbouring grid values on either side. By default,
+        the range is narrowed to `value` alone, as for categories.
+
+        Parameters
+        ----------
+        value
+            One of the values of `grid(divisions)`.
+        divisions
+            How many axis divisions the grid containing `value` used.
+        bounds
+            A range of the same kind which the cell is clamped to, such as the whole
+            search space, so that a cell around a value on this range's edge can reach
+            past it. Defaults to this range.
+
+        Returns
+        -------
+        Range
+            A range of the same kind, within `bounds`.
+        """
+        return CategoricalRange([value])
+
+
+def _half_step(low: float, high: float, divisions: int) -> float:
+    """
+    Half the distance between adjacent values of a grid from `low` to `high`.
+    """
+    return (high - low) / max(divisions - 1, 1) / 2
+
 
 class IntRange(Range):
     """
@@ -119,13 +202,34 @@ class IntRange(Range):
         return list(map(str, space))
 
     def transform_uniform_sample(self, uniform_sample: float) -> str:
+        return self.transform_uniform_samples(np.array([uniform_sample])).item()
+
+    def random_samples(self, count: int) -> np.ndarray:
+        samples = np.random.randint(self.min_value, self.max_value + 1, size=count)
+        return samples.astype(str)
+
+    def transform_uniform_samples(self, uniform_samples: np.ndarray) -> np.ndarray:
         dynamic_range = self.max_value + 1 - self.min_value
-        float_value = uniform_sample * dynamic_range + self.min_value
-        return str(int(float_value))
+        float_values = uniform_samples * dynamic_range + self.min_value
+        int_values = np.minimum(np.floor(float_values), self.max_value).astype(int)
+        return int_values.astype(str)
+
+    def to_skopt(self) -> "skopt.space.Space":
+        import skopt
 
-    def to_skopt(self) -> skopt.space.Space:
         return skopt.space.Integer(self.min_value, self.max_value, prior="uniform")
 
+    def zoom(
+        self, value: str, divisions: int, bounds: Optional[Range] = None
+    ) -> Range:
+        bounds = cast(IntRange, bounds or self)
+        half_step = _half_step(self.min_value, self.max_value, divisions)
+        center = int(value)
+        return IntRange(
+            max(bounds.min_value, math.ceil(center - half_step)),
+            min(bounds.max_value, math.floor(center + half_step)),
+        )
+
 
 class LogIntRange(Range):
     """
@@ -135,29 +239,50 @@ class LogIntRange(Range):
     def __init__(self, a: int, b: int):
         self.min_value = min(a, b)
         self.max_value = max(a, b)
-        self.distribution = stats.loguniform(self.min_value, self.max_value)
 
     def random_sample(self) -> str:
-        sample = int(self.distribution.rvs(1).item())
-        return str(sample)
+        return self.random_samples(1).item()
 
     def grid(self, divisions: int) -> List[str]:
         divisions = min(divisions, self.max_value - self.min_value + 1)
-        space = np.geomspace(self.min_value, self.max_value, num=divisions, dtype=int)
-        return list(map(str, space))
+        space = np.geomspace(self.min_value, self.max_value, num=divisions)
+        # Small values are closer together than 1 apart, so some points round to the
+        # same integer; each is only kept once.
+        return list(map(str, np.unique(np.round(space).astype(int))))
 
     def transform_uniform_sample(self, uniform_sample: float) -> str:
+        return self.transform_uniform_samples(np.array([uniform_sample])).item()
+
+    def random_samples(self, count: int) -> np.ndarray:
+        return self.transform_uniform_samples(np.random.random_sample(count))
+
+    def transform_uniform_samples(self, uniform_samples: np.ndarray) -> np.ndarray:
         log_min = np.log(self.min_value)
         log_max = np.log(self.max_value)
         log_range = log_max - log_min
-        float_value = np.exp(log_range * uniform_sample + log_min)
-        return str(int(float_value))
+        float_values = np.exp(log_range * uniform_samples + log_min)
+        return float_values.astype(int).astype(str)
+
+    def to_skopt(self) -> "skopt.space.Space":
+        import skopt
 
-    def to_skopt(self) -> skopt.space.Space:
         return skopt.space.Integer(
             self.min_value, self.max_value, prior="log-uniform", base=2
         )
 
+    def zoom(
+        self, value: str, divisions: int, bounds: Optional[Range] = None
+    ) -> Range:
+        bounds = cast(LogIntRange, bounds or self)
+        half_step = _half_step(
+            math.log(self.min_value), math.log(self.max_value), divisions
+        )
+        center = int(value)
+        return LogIntRange(
+            max(bounds.min_value, math.ceil(center / math.exp(half_step))),
+            min(bounds.max_value, math.floor(center * math.exp(half_step))),
+        )
+
 
 class FloatRange(Range):
     """
@@ -176,13 +301,33 @@ class FloatRange(Range):
         return list(map(str, space))
 
     def transform_uniform_sample(self, uniform_sample: float) -> str:
+        return self.transform_uniform_samples(np.array([uniform_sample])).item()
+
+    def random_samples(self, count: int) -> np.ndarray:
+        samples = np.random.uniform(self.min_value, self.max_value, size=count)
+        return samples.astype(str)
+
+    def transform_uniform_samples(self, uniform_samples: np.ndarray) -> np.ndarray:
         dynamic_range = self.max_value - self.min_value
-        value = uniform_sample * dynamic_range + self.min_value
-        return str(value)
+        values = uniform_samples * dynamic_range + self.min_value
+        return values.astype(str)
+
+    def to_skopt(self) -> "skopt.space.Space":
+        import skopt
 
-    def to_skopt(self) -> skopt.space.Space:
         return skopt.space.Real(self.min_value, self.max_value, prior="uniform")
 
+    def zoom(
+        self, value: str, divisions: int, bounds: Optional[Range] = None
+    ) -> Range:
+        bounds = cast(FloatRange, bounds or self)
+        half_step = _half_step(self.min_value, self.max_value, divisions)
+        center = float(value)
+        return FloatRange(
+            max(bounds.min_value, center - half_step),
+            min(bounds.max_value, center + half_step),
+        )
+
 
 class LogFloatRange(Range):
     """
@@ -192,25 +337,45 @@ class LogFloatRange(Range):
     def __init__(self, a: float, b: float):
         self.min_value = min(a, b)
         self.max_value = max(a, b)
-        self.distribution = stats.loguniform(self.min_value, self.max_value)
 
     def random_sample(self) -> str:
-        return str(self.distribution.rvs(1).item())
+        return self.random_samples(1).item()
 
     def grid(self, divisions: int) -> List[str]:
         space = np.geomspace(self.min_value, self.max_value, num=divisions, dtype=float)
         return list(map(str, space))
 
     def transform_uniform_sample(self, uniform_sample: float) -> str:
+        return self.transform_uniform_samples(np.array([uniform_sample])).item()
+
+    def random_samples(self, count: int) -> np.ndarray:
+        return self.transform_uniform_samples(np.random.random_sample(count))
+
+    def transform_uniform_samples(self, uniform_samples: np.ndarray) -> np.ndarray:
         log_min = np.log(self.min_value)
         log_max = np.log(self.max_value)
         log_range = log_max - log_min
-        value = np.exp(log_range * uniform_sample + log_min)
-        return str(value)
+        values = np.exp(log_range * uniform_samples + log_min)
+        return values.astype(str)
+
+    def to_skopt(self) -> "skopt.space.Space":
+        import skopt
 
-    def to_skopt(self) -> skopt.space.Space:
         return skopt.space.Real(self.min_value, self.max_value, prior="log-uniform")
 
+    def zoom(
+        self, value: str, divisions: int, bounds: Optional[Range] = None
+    ) -> Range:
+        bounds = cast(LogFloatRange, bounds or self)
+        half_step = _half_step(
+            math.log(self.min_value), math.log(self.max_value), divisions
+        )
+        center = float(value)
+        return LogFloatRange(
+            max(bounds.min_value, center / math.exp(half_step)),
+            min(bounds.max_value, center * math.exp(half_step)),
+        )
+
 
 class CategoricalRange(Range):
     """
@@ -230,14 +395,21 @@ class CategoricalRange(Range):
         return self.categories
 
     def transform_uniform_sample(self, uniform_sample: float) -> str:
-        chunk_size = 1 / len(self.categories)
-        for i, category in enumerate(self.categories):
-            if i * chunk_size <= uniform_sample < (i + 1) * chunk_size:
-                return category
+        return self.transform_uniform_samples(np.array([uniform_sample])).item()
+
+    def random_samples(self, count: int) -> np.ndarray:
+        indices = np.random.randint(len(self.categories), size=count)
+        return np.array(self.categories, dtype=str)[indices]
+
+    def transform_uniform_samples(self, uniform_samples: np.ndarray) -> np.ndarray:
+        num_categories = len(self.categories)
+        indices = (uniform_samples * num_categories).astype(int)
+        indices = np.minimum(indices, num_categories - 1)
+        return np.array(self.categories, dtype=str)[indices]
 
-        assert False
+    def to_skopt(self) -> "skopt.space.Space":
+        import skopt
 
-    def to_skopt(self) -> skopt.space.Space:
         return skopt.space.Categorical(self.categories)
 
 
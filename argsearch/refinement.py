@@ -0,0 +1,255 @@
+"""
+Adaptive grid refinement: a coarse grid search, followed by rounds of finer grids
+around the best results so far.
+
+Each round takes the `top_k` best points, and zooms every numeric range in on the cell
+of the grid around each one (see `ranges.Range.zoom`), then grids those cells with the
+same number of divisions. Categorical values stay fixed within a cell. Every round
+divides the cells around the best points `divisions - 1` times more finely, so a few
+rounds reach a resolution that a single grid could only reach with vastly more trials.
+Points which have already run are never run again.
+"""
+
+import functools
+import json
+import sys
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple
+
+from tqdm import tqdm
+
+from argsearch import accounting, commands, ranges, strategies, tracing
+from argsearch.cache import ResultCache
+from argsearch.objectives import OUTPUT_OBJECTIVE, get_objective
+from argsearch.slots import Slot
+from argsearch.templates import CommandTemplate
+
+DEFAULT_ROUNDS = 3
+DEFAULT_TOP_K = 3
+
+# A region of the search space: a range for each template.
+Box = Dict[str, ranges.Range]
+# A box, with how many times it has been zoomed in from the whole search space.
+Cell = Tuple[int, Box]
+# A hashable form of a set of substitutions.
+PointKey = Tuple[Tuple[str, str], ...]
+
+
+def _point_key(substitutions: Dict[str, str]) -> PointKey:
+    return tuple(sorted(substitutions.items()))
+
+
+def _box_key(box: Box, divisions: int) -> Tuple[Any, ...]:
+    """
+    Identify a box by its grid, since boxes with the same grid need only run once.
+    """
+    return tuple((name, tuple(box[name].grid(divisions))) for name in sorted(box))
+
+
+def refine_command(
+    command_template: str,
+    range_map: Dict[str, ranges.Range],
+    divisions: int,
+    maximize: bool = False,
+    rounds: int = DEFAULT_ROUNDS,
+    top_k: int = DEFAULT_TOP_K,
+    output_json: bool = False,
+    num_workers: int = 0,
+    disable_bar: bool = False,
+    cache: Optional[ResultCache] = None,
+    engine: str = "process",
+    output_jsonl: bool = False,
+    capture_options: Optional[Dict[str, Any]] = None,
+    timeout: Optional[float] = None,
+    slots: Optional[List[Slot]] = None,
+    serve: Optional[str] = None,
+    objective_field: str = OUTPUT_OBJECTIVE,
+    summary: bool = False,
+    tracer: Optional[tracing.Tracer] = None,
+    shell: bool = True,
+) -> None:
+    """
+    Search for the best setting of a command by adaptive grid refinement.
+
+    Each round's trials run in parallel on `num_workers` workers, and the next round
+    starts once they have all finished. Trials whose objective can't be read (such as
+    ones that timed out) are reported, but never zoomed in on. Rounds stop early once
+    the best points have all been zoomed in on at the finest resolution they reached.
+
+    As with `commands.run_commands`, the first Ctrl-C stops starting new trials but
+    lets running ones finish, and a second kills them.
+
+    Parameters
+    ----------
+    command_template
+        A string to be executed as a subprocess, with "{arg}" bracketed templates.
+    range_map
+        Maps from a template name to a range defining values for that template.
+    divisions
+        How many ways to divide each numeric range, in the coarse grid and in every
+        zoomed cell. Must be at least 2.
+    maximize
+        If True, look for the largest objective, rather than the smallest.
+    rounds
+        How many rounds of refinement to run after the coarse grid.
+    top_k
+        How many of the best points to zoom in on in each round.
+    objective_field
+        What to compare trials by; see `objectives.get_objective`.
+
+    Other parameters are as for `commands.run_commands`.
+    """
+    if divisions < 2:
+        raise ValueError("Refinement needs at least 2 divisions per range.")
+
+    num_workers = max(num_workers, 1)
+    process_pool = commands.make_pool(num_workers, engine, serve)
+    template = CommandTemplate(command_template, shell)
+    capture = functools.partial(
+        commands._capture_command_packed,
+        cache=cache,
+        timeout=timeout,
+        **(capture_options or {}),
+    )
+    resource_summary = accounting.ResourceSummary() if summary else None
+    outputs = []
+
+    # Maps each point which has run to its objective (to minimize), and the finest
+    # cell whose grid it is on.
+    evaluated: Dict[PointKey, Tuple[Optional[float], Cell]] = {}
+    zoomed: Set[Tuple[Any, ...]] = set()
+    best: Optional[Tuple[float, Dict[str, str]]] = None
+    step = 0
+
+    def new_points(cells: List[Cell]) -> Dict[PointKey, Tuple[Dict[str, str], Cell]]:
+        """
+        Get the points on the grids of some cells which haven't run yet.
+        """
+        points: Dict[PointKey, Tuple[Dict[str, str], Cell]] = {}
+        for cell in cells:
+            for substitutions in strategies.grid(cell[1], divisions):
+                key = _point_key(substitutions)
+                if key in evaluated:
+                    # Zoomed in on from a finer cell, a point's next cell is finer too.
+                    objective, previous = evaluated[key]
+                    if cell[0] > previous[0]:
+                        evaluated[key] = (objective, cell)
+                elif key not in points or cell[0] > points[key][1][0]:
+                    points[key] = (substitutions, cell)
+        return points
+
+    def next_cells() -> List[Cell]:
+        """
+        Zoom in on the best points which haven't been zoomed in on at this resolution.
+        """
+        ranked = sorted(
+            (objective, key)
+            for key, (objective, _) in evaluated.items()
+            if objective is not None
+        )
+        cells = []
+        for _, key in ranked[:top_k]:
+            level, box = evaluated[key][1]
+            substitutions = dict(key)
+            # A cell's size comes from its parent's grid, but it's only clamped to the
+            # whole search space, so the search can move past the parent cell.
+            zoomed_box = {
+                name: box[name].zoom(substitutions[name], divisions, range_map[name])
+                for name in box
+            }
+            box_key = _box_key(zoomed_box, divisions)
+            if box_key not in zoomed:
+                zoomed.add(box_key)
+                cells.append((level + 1, zoomed_box))
+        return cells
+
+    def run_round(
+        points: Dict[PointKey, Tuple[Dict[str, str], Cell]],
+        interrupt: commands.GracefulInterrupt,
+        monitor: tqdm,
+    ) -> None:
+        nonlocal step, best
+        monitor.total += len(points)
+        monitor.refresh()
+        cells_by_step: Dict[int, Tuple[PointKey, Cell]] = {}
+
+        def tasks() -> Iterator[Tuple[Any, ...]]:
+            nonlocal step
+            for key, (substitutions, cell) in points.items():
+                cells_by_step[step] = (key, cell)
+                yield (template, substitutions, step, None)
+                step += 1
+
+        dispatched: Iterator[Optional[Tuple[Any, ...]]]
+        dispatched = interrupt.until_draining(tasks())
+        allocator = None
+        if slots:
+            allocator = commands.SlotAllocator(slots[:num_workers])
+            dispatched = allocator.assign(dispatched)
+        if tracer:
+            dispatched = tracer.track(dispatched)
+
+        for output in commands.imap_bounded(
+            process_pool, capture, dispatched, num_workers
+        ):
+            if allocator:
+                allocator.release(output)
+            key, cell = cells_by_step.pop(output["step"])
+            raw_objective = get_objective(output, objective_field)
+            objective = None
+            if raw_objective is not None:
+                objective = -raw_objective if maximize else raw_objective
+                if best is None or objective < best[0]:
+                    best = (objective, output["substitutions"])
+            evaluated[key] = (objective, cell)
+
+            if resource_summary:
+                resource_summary.record(output)
+            if tracer:
+                tracer.completed(output)
+            if output_json:
+                outputs.append(output)
+            else:
+                commands.write_output(output, monitor, output_jsonl)
+            monitor.update()
+
+    try:
+        with commands.GracefulInterrupt() as interrupt, tqdm(
+            total=0, disable=disable_bar
+        ) as monitor:
+            cells = [(0, range_map)]
+            for round_index in range(rounds + 1):
+                if interrupt.draining:
+                    break
+                points = new_points(cells)
+                if points:
+                    monitor.set_postfix({"round": round_index})
+                    run_round(points, interrupt, monitor)
+                cells = next_cells()
+                if not cells:
+                    break
+    except KeyboardInterrupt:
+        commands.terminate_pool(process_pool)
+    except BaseException:
+        commands.terminate_pool(process_pool)
+        raise
+    else:
+        commands.close_pool(process_pool)
+
+    monitor.clear()
+    monitor.close()
+
+    if resource_summary:
+        sys.stderr.write(resource_summary.format() + "\n")
+        sys.stderr.flush()
+
+    if output_json:
+        monitor.write(json.dumps(outputs))
+    elif not output_jsonl:
+        best_objective = None
+        best_setting = None
+        if best is not None:
+            best_objective, best_setting = best
+            if maximize:
+                best_objective *= -1
+        monitor.write(f"=== Best value found: {best_objective}")
+        monitor.write(f"=== Best setting: {best_setting}")
@@ -0,0 +1,325 @@
+"""
+Low-discrepancy sequences, which quasirandom search samples from.
+
+Points are computed directly from their index in the sequence, rather than one after
+another, so any stretch of a sequence can be generated in a single vectorized pass.
+This lets a study be extended later by generating only the points after the ones which
+already ran.
+"""
+
+import abc
+from typing import List, Optional
+
+import numpy as np
+
+# How many bits of each Sobol coordinate are computed, which also bounds the number of
+# points in the sequence.
+SOBOL_BITS = 32
+
+# The primitive polynomial and initial direction numbers of each Sobol dimension, from
+# S. Joe and F. Y. Kuo, "Constructing Sobol sequences with better two-dimensional
+# projections" (2008). Each polynomial is written as the integer whose binary digits are
+# its coefficients, and the first dimension is the van der Corput sequence.
+SOBOL_DIRECTIONS = [
+    (1, (1,)),
+    (3, (1,)),
+    (7, (1, 3)),
+    (11, (1, 3, 1)),
+    (13, (1, 1, 1)),
+    (19, (1, 1, 3, 3)),
+    (25, (1, 3, 5, 13)),
+    (37, (1, 1, 5, 5, 17)),
+    (41, (1, 1, 5, 5, 5)),
+    (47, (1, 1, 7, 11, 19)),
+    (55, (1, 1, 5, 1, 1)),
+    (59, (1, 1, 1, 3, 11)),
+    (61, (1, 3, 5, 5, 31)),
+    (67, (1, 3, 3, 9, 7, 49)),
+    (91, (1, 1, 1, 15, 21, 21)),
+    (97, (1, 3, 1, 13, 27, 49)),
+    (103, (1, 1, 1, 15, 7, 5)),
+    (109, (1, 3, 1, 15, 13, 25)),
+    (115, (1, 1, 5, 5, 19, 61)),
+    (131, (1, 3, 7, 11, 23, 15, 103)),
+    (137, (1, 3, 7, 13, 13, 15, 69)),
+    (143, (1, 1, 3, 13, 7, 35, 63)),
+    (145, (1, 3, 5, 9, 1, 25, 53)),
+    (157, (1, 3, 1, 13, 9, 35, 107)),
+    (167, (1, 3, 1, 5, 27, 61, 31)),
+    (171, (1, 1, 5, 11, 19, 41, 61)),
+    (185, (1, 3, 5, 3, 3, 13, 69)),
+    (191, (1, 1, 7, 13, 1, 19, 1)),
+    (193, (1, 3, 7, 5, 13, 19, 59)),
+    (203, (1, 1, 3, 9, 25, 29, 41)),
+    (211, (1, 3, 5, 13, 23, 1, 55)),
+    (213, (1, 3, 7, 3, 13, 59, 17)),
+    (229, (1, 3, 1, 3, 5, 53, 69)),
+    (239, (1, 1, 5, 5, 23, 33, 13)),
+    (241, (1, 1, 7, 7, 1, 61, 123)),
+    (247, (1, 1, 7, 9, 13, 61, 49)),
+    (253, (1, 3, 3, 5, 3, 55, 33)),
+    (285, (1, 3, 1, 15, 31, 13, 49, 245)),
+    (299, (1, 3, 5, 15, 31, 59, 63, 97)),
+    (301, (1, 3, 1, 11, 11, 11, 77, 249)),
+    (333, (1, 3, 1, 11, 27, 43, 71, 9)),
+    (351, (1, 1, 7, 15, 21, 11, 81, 45)),
+    (355, (1, 3, 7, 3, 25, 31, 65, 79)),
+    (357, (1, 3, 1, 1, 19, 11, 3, 205)),
+    (361, (1, 1, 5, 9, 19, 21, 29, 157)),
+    (369, (1, 3, 7, 11, 1, 33, 89, 185)),
+    (391, (1, 3, 3, 3, 15, 9, 79, 71)),
+    (397, (1, 3, 7, 11, 15, 39, 119, 27)),
+    (425, (1, 1, 3, 1, 11, 31, 97, 225)),
+    (451, (1, 1, 1, 3, 23, 43, 57, 177)),
+    (463, (1, 3, 7, 7, 17, 17, 37, 71)),
+    (487, (1, 3, 1, 5, 27, 63, 123, 213)),
+    (501, (1, 1, 3, 5, 11, 43, 53, 133)),
+    (529, (1, 3, 5, 5, 29, 17, 47, 173, 479)),
+    (539, (1, 3, 3, 11, 3, 1, 109, 9, 69)),
+    (545, (1, 1, 1, 5, 17, 39, 23, 5, 343)),
+    (557, (1, 3, 1, 5, 25, 15, 31, 103, 499)),
+    (563, (1, 1, 1, 11, 11, 17, 63, 105, 183)),
+    (601, (1, 1, 5, 11, 9, 29, 97, 231, 363)),
+    (607, (1, 1, 5, 15, 19, 45, 41, 7, 383)),
+    (617, (1, 3, 7, 7, 31, 19, 83, 137, 221)),
+    (623, (1, 1, 1, 3, 23, 15, 111, 223, 83)),
+    (631, (1, 1, 5, 13, 31, 15, 55, 25, 161)),
+    (637, (1, 1, 3, 13, 25, 47, 39, 87, 257)),
+]
+
+
+class Sequence(abc.ABC):
+    """
+    A low-discrepancy sequence of points in the unit hypercube.
+
+    Parameters
+    ----------
+    dimensions
+        How many coordinates each point has.
+    scramble
+        If True, randomize the sequence, keeping its low discrepancy; see subclasses.
+    seed
+        Seeds the randomization, so that the same sequence can be generated again
+        (e.g. to continue it later). If None, a random seed is used.
+    """
+
+    def __init__(
+        self, dimensions: int, scramble: bool = False, seed: Optional[int] = None
+    ):
+        self.dimensions = dimensions
+        self.scramble = scramble
+        self.seed = seed
+        # The first point of an unscrambled sequence is the origin, a corner of the
+        # space which tells little about the rest of it, so it is skipped.
+        self._first_index = 0 if scramble else 1
+
+    def points(self, start: int, count: int) -> np.ndarray:
+        """
+        Generate a stretch of the sequence.
+
+        Parameters
+        ----------
+        start
+            The index of the first point to generate, counting from 0.
+        count
+            How many points to generate.
+
+        Returns
+        -------
+        np.ndarray
+            A `count` by `dimensions` array of points, each coordinate in [0, 1).
+        """
+        first = start + self._first_index
+        return self._points(np.arange(first, first + count, dtype=np.uint64))
+
+    @abc.abstractmethod
+    def _points(self, indices: np.ndarray) -> np.ndarray:
+        """
+        Generate the points at the given indices in the sequence.
+        """
+        raise NotImplementedError
+
+
+class SobolSequence(Sequence):
+    """
+    A Sobol sequence, with Joe and Kuo's direction numbers.
+
+    Scrambling applies an Owen (nested uniform) scramble to each coordinate, using the
+    hash-based permutation of B. Burley, "Practical Hash-based Owen Scrambling" (2020),
+    which needs no tables, so it works on any stretch of the sequence independently.
+    """
+
+    def __init__(
+        self, dimensions: int, scramble: bool = False, seed: Optional[int] = None
+    ):
+        super().__init__(dimensions, scramble, seed)
+        if dimensions > len(SOBOL_DIRECTIONS):
+            raise ValueError(
+                f"Sobol sequences support at most {len(SOBOL_DIRECTIONS)} templates; "
+                f"got {dimensions}. Use a Halton sequence instead."
+            )
+        # Each column holds one dimension's direction numbers, one per bit of index.
+        self._directions = (
+            np.array(
+                [
+                    _direction_numbers(polynomial, initial)
+                    for polynomial, initial in SOBOL_DIRECTIONS[:dimensions]
+                ],
+                dtype=np.uint64,
+            )
+            .T.reshape(SOBOL_BITS, dimensions)
+        )
+        self._seeds = None
+        if scramble:
+            rng = np.random.default_rng(seed)
+            self._seeds = rng.integers(
+                0, 1 << SOBOL_BITS, size=dimensions, dtype=np.uint64
+            )
+
+    def _points(self, indices: np.ndarray) -> np.ndarray:
+        if len(indices) and int(indices[-1]) >= 1 << SOBOL_BITS:
+            raise ValueError(f"Sobol sequences have at most 2^{SOBOL_BITS} points.")
+        values = np.zeros((len(indices), self.dimensions), dtype=np.uint64)
+        highest = int(indices[-1]).bit_length() if len(indices) else 0
+        for bit in range(highest):
+            mask = (indices >> np.uint64(bit)) & np.uint64(1)
+            values ^= mask[:, np.newaxis] * self._directions[bit]
+        if self._seeds is not None:
+            values = _owen_scramble(values, self._seeds)
+        return values / float(1 << SOBOL_BITS)
+
+
+class HaltonSequence(Sequence):
+    """
+    A Halton sequence, whose dimensions are radical inverses in successive prime bases.
+
+    Unlike Sobol sequences, Halton sequences support any number of dimensions, but
+    their higher dimensions are more strongly correlated. Scrambling applies a random
+    permutation to each digit of each coordinate, which breaks up that correlation.
+    """
+
+    def __init__(
+        self, dimensions: int, scramble: bool = False, seed: Optional[int] = None
+    ):
+        super().__init__(dimensions, scramble, seed)
+        self._bases = _primes(dimensions)
+        self._permutations: Optional[List[np.ndarray]] = None
+        if scramble:
+            rng = np.random.default_rng(seed)
+            # One permutation of the digits per digit position, for each base.
+            self._permutations = [
+                np.stack([rng.permutation(base) for _ in range(_digits(base))])
+                for base in self._bases
+            ]
+
+    def _points(self, indices: np.ndarray) -> np.ndarray:
+        indices = indices.astype(np.int64)
+        points = np.empty((len(indices), self.dimensions))
+        for dimension, base in enumerate(self._bases):
+            permutations = (
+                self._permutations[dimension] if self._permutations else None
+            )
+            points[:, dimension] = _radical_inverse(indices, base, permutations)
+        return points
+
+
+def _direction_numbers(polynomial: int, initial: tuple) -> np.ndarray:
+    """
+    Extend a dimension's initial direction numbers to one for every bit of index.
+    """
+    degree = polynomial.bit_length() - 1
+    if degree == 0:
+        numbers = [1] * SOBOL_BITS
+    else:
+        numbers = list(initial)
+        for k in range(degree, SOBOL_BITS):
+            number = numbers[k - degree] ^ (numbers[k - degree] << degree)
+            for i in range(1, degree):
+                if (polynomial >> (degree - i)) & 1:
+                    number ^= numbers[k - i] << i
+            numbers.append(number)
+    return np.array(
+        [number << (SOBOL_BITS - 1 - k) for k, number in enumerate(numbers)],
+        dtype=np.uint64,
+    )
+
+
+def _reverse_bits(values: np.ndarray) -> np.ndarray:
+    """
+    Reverse the order of the lowest 32 bits of each value.
+    """
+    values = values.copy()
+    for shift, mask in [
+        (1, 0x55555555),
+        (2, 0x33333333),
+        (4, 0x0F0F0F0F),
+        (8, 0x00FF00FF),
+        (16, 0x0000FFFF),
+    ]:
+        shift_64, mask_64 = np.uint64(shift), np.uint64(mask)
+        values = ((values >> shift_64) & mask_64) | ((values & mask_64) << shift_64)
+    return values
+
+
+def _owen_scramble(values: np.ndarray, seeds: np.ndarray) -> np.ndarray:
+    """
+    Owen-scramble 32-bit coordinates, with one seed per column.
+
+    Flipping each bit based on a hash of the bits above it is a nested uniform scramble.
+    With the bits reversed, those are the bits below, which a multiplication by an even
+    constant mixes upwards.
+    """
+    low_bits = np.uint64(0xFFFFFFFF)
+    values = _reverse_bits(values)
+    values = (values + seeds) & low_bits
+    for multiplier in [0x6C50B47C, 0xB82F1E52, 0xC7AFE638, 0x8D22F6E6]:
+        values ^= (values * np.uint64(multiplier)) & low_bits
+    return _reverse_bits(values)
+
+
+def _digits(base: int) -> int:
+    """
+    How many digits in a base are needed to resolve a double-precision float.
+    """
+    return int(np.ceil(53 / np.log2(base)))
+
+
+def _radical_inverse(
+    indices: np.ndarray, base: int, permutations: Optional[np.ndarray]
+) -> np.ndarray:
+    """
+    Mirror the digits of each index about the radix point, permuting the digits at
+    each position if permutations are given.
+    """
+    if permutations is None:
+        # Digits past the largest index's are all zero; it has no more in any base
+        # than it has bits.
+        positions = int(indices.max(initial=0)).bit_length()
+    else:
+        positions = len(permutations)
+
+    result = np.zeros(len(indices))
+    remaining = indices.copy()
+    scale = 1.0 / base
+    for position in range(positions):
+        digits = remaining % base
+        if permutations is not None:
+            digits = permutations[position][digits]
+        result += digits * scale
+        remaining //= base
+        scale /= base
+    # Rounding could otherwise carry a scrambled point up to 1.
+    return np.minimum(result, np.nextafter(1.0, 0.0))
+
+
+def _primes(count: int) -> List[int]:
+    """
+    Get the first `count` prime numbers.
+    """
+    primes: List[int] = []
+    candidate = 2
+    while len(primes) < count:
+        if all(candidate % prime for prime in primes if prime * prime <= candidate):
+            primes.append(candidate)
+        candidate += 1
+    return primes
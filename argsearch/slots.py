@@ -0,0 +1,74 @@
+"""
+Splits the machine's CPU cores into slots, so that concurrent trials don't compete for
+the same cores.
+"""
+
+import os
+from typing import Dict, List, NamedTuple, Tuple
+
+# The reserved template which is replaced by the index of a trial's slot.
+SLOT_TEMPLATE = "slot"
+
+# Environment variables which common numerical libraries read to size thread pools.
+THREAD_COUNT_VARIABLES = (
+    "OMP_NUM_THREADS",
+    "MKL_NUM_THREADS",
+    "OPENBLAS_NUM_THREADS",
+    "NUMEXPR_NUM_THREADS",
+    "VECLIB_MAXIMUM_THREADS",
+)
+
+
+class Slot(NamedTuple):
+    """
+    A set of CPU cores reserved for one trial at a time.
+    """
+
+    number: int
+    cores: Tuple[int, ...]
+
+    def environment(self) -> Dict[str, str]:
+        """
+        Get the environment variables to set for a trial running in this slot.
+        """
+        env = {name: str(len(self.cores)) for name in THREAD_COUNT_VARIABLES}
+        env["ARGSEARCH_SLOT"] = str(self.number)
+        env["ARGSEARCH_CORES"] = ",".join(map(str, self.cores))
+        return env
+
+
+def available_cores() -> List[int]:
+    """
+    Get the CPU cores this process may run on.
+    """
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def partition_cores(cores_per_trial: int) -> List[Slot]:
+    """
+    Split the available cores into as many disjoint slots as possible.
+
+    Parameters
+    ----------
+    cores_per_trial
+        How many cores each slot gets.
+
+    Returns
+    -------
+    List[Slot]
+        The slots, each with `cores_per_trial` consecutive cores.
+    """
+    cores = available_cores()
+    num_slots = len(cores) // cores_per_trial
+    if num_slots == 0:
+        raise ValueError(
+            f"Cannot reserve {cores_per_trial} cores per trial; only {len(cores)} "
+            "are available."
+        )
+    return [
+        Slot(i, tuple(cores[i * cores_per_trial : (i + 1) * cores_per_trial]))
+        for i in range(num_slots)
+    ]
+
@@ -3,42 +3,95 @@ Defines strategies, which sample arguments from Ranges to get command strings to
 """
 
 
-import collections
 import itertools
-from typing import Dict, List
+from typing import Dict, Iterator, Optional
 
 import numpy as np
-import sobol_seq
 
-from argsearch import ranges
+from argsearch import ranges, sequences
 
 
-def random(range_map: Dict[str, ranges.Range], trials: int) -> List[Dict[str, str]]:
+# How many trials to generate per vectorized pass. Bounds memory use for huge searches
+# while amortizing the per-call overhead of NumPy.
+BATCH_SIZE = 4096
+
+
+def _columns_to_substitutions(
+    columns: Dict[str, np.ndarray]
+) -> Iterator[Dict[str, str]]:
+    """
+    Convert per-template columns of values into one substitution dict per row.
+    """
+    template_names = list(columns.keys())
+    value_lists = [columns[name].tolist() for name in template_names]
+    for row in zip(*value_lists):
+        yield dict(zip(template_names, row))
+
+
+def random_columns(
+    range_map: Dict[str, ranges.Range], trials: int
+) -> Dict[str, np.ndarray]:
     """
-    Get a list of substitutions by random sampling.
+    Sample a whole matrix of random trials in one vectorized pass.
 
     Parameters
     ----------
     range_map
         Maps from a template name to a range defining values for that template.
     trials
-        How many random trials to run.
+        How many random trials to sample.
 
     Returns
     -------
-    List[Dict[str, str]]
-        A list of argument substitutions, of length `trials`.
+    Dict[str, np.ndarray]
+        Maps from each template name to an array of `trials` values for it. Row `i`
+        across all arrays is the substitution for trial `i`.
     """
+    return {name: rng.random_samples(trials) for name, rng in range_map.items()}
 
-    def random_sample():
-        return {name: rng.random_sample() for name, rng in range_map.items()}
 
-    return [random_sample() for _ in range(trials)]
+def quasirandom_columns(
+    range_map: Dict[str, ranges.Range],
+    sequence: sequences.Sequence,
+    trials: int,
+    skip: int = 0,
+) -> Dict[str, np.ndarray]:
+    """
+    Sample a whole matrix of quasirandom trials in one vectorized pass.
 
+    Parameters
+    ----------
+    range_map
+        Maps from a template name to a range defining values for that template.
+    sequence
+        A low-discrepancy sequence with one dimension per template.
+    trials
+        How many quasirandom trials to sample.
+    skip
+        How many points at the start of the sequence to skip.
 
-def sobol(range_map: Dict[str, ranges.Range], trials: int) -> List[Dict[str, str]]:
+    Returns
+    -------
+    Dict[str, np.ndarray]
+        Maps from each template name to an array of `trials` values for it. Row `i`
+        across all arrays is the substitution for trial `skip + i`.
+    """
+    points = sequence.points(skip, trials)
+    # Dimensions go to templates in order of name, so that a search gets the same
+    # points every time it runs, and can be continued.
+    return {
+        name: range_map[name].transform_uniform_samples(points[:, i])
+        for i, name in enumerate(sorted(range_map))
+    }
+
+
+def random(
+    range_map: Dict[str, ranges.Range], trials: int
+) -> Iterator[Dict[str, str]]:
     """
-    Get a list of substitutions by quasirandom sampling from a Sobol sequence.
+    Lazily generate substitutions by random sampling.
+
+    Samples are drawn in vectorized batches of up to `BATCH_SIZE` trials.
 
     Parameters
     ----------
@@ -47,28 +100,92 @@ def sobol(range_map: Dict[str, ranges.Range], trials: int) -> List[Dict[str, str
     trials
         How many random trials to run.
 
-    Returns
-    -------
-    List[Dict[str, str]]
-        A list of argument substitutions, of length `trials`.
+    Yields
+    ------
+    Dict[str, str]
+        An argument substitution, `trials` times in total.
     """
-    ordered_range_map = collections.OrderedDict(range_map)
-    sobol_values = sobol_seq.i4_sobol_generate(len(range_map), trials)
+    for start in range(0, trials, BATCH_SIZE):
+        count = min(BATCH_SIZE, trials - start)
+        yield from _columns_to_substitutions(random_columns(range_map, count))
+
+
+def quasirandom(
+    range_map: Dict[str, ranges.Range],
+    trials: int,
+    skip: int = 0,
+    sequence: str = "sobol",
+    scramble: bool = False,
+    seed: Optional[int] = None,
+) -> Iterator[Dict[str, str]]:
+    """
+    Lazily generate substitutions by sampling from a low-discrepancy sequence.
 
-    def transform_vector(uniform_vector):
-        substitution = {}
-        for uniform_sample, (name, rng) in zip(
-            uniform_vector, ordered_range_map.items()
-        ):
-            substitution[name] = rng.transform_uniform_sample(uniform_sample)
-        return substitution
+    Points are generated and transformed in vectorized batches of up to `BATCH_SIZE`
+    trials. Any stretch of the sequence can be generated directly, so a search can be
+    extended by skipping the points that have already run.
 
-    return [transform_vector(vector) for vector in sobol_values]
+    Parameters
+    ----------
+    range_map
+        Maps from a template name to a range defining values for that template.
+    trials
+        How many quasirandom trials to run.
+    skip
+        How many points at the start of the sequence to skip.
+    sequence
+        "sobol" or "halton"; see `sequences`.
+    scramble
+        If True, randomize the sequence, keeping its low discrepancy.
+    seed
+        Seeds the scrambling. Continuing a scrambled search requires the same seed.
+
+    Yields
+    ------
+    Dict[str, str]
+        An argument substitution, `trials` times in total.
+    """
+    sequence_types = {
+        "sobol": sequences.SobolSequence,
+        "halton": sequences.HaltonSequence,
+    }
+    engine = sequence_types[sequence](len(range_map), scramble, seed)
+    for start in range(skip, skip + trials, BATCH_SIZE):
+        count = min(BATCH_SIZE, skip + trials - start)
+        columns = quasirandom_columns(range_map, engine, count, skip=start)
+        yield from _columns_to_substitutions(columns)
+
+
+def grid(
+    range_map: Dict[str, ranges.Range], divisions: int
+) -> Iterator[Dict[str, str]]:
+    """
+    Lazily generate all substitutions to run in a grid search.
+
+    The Cartesian product is never materialized, so memory use does not depend on the
+    number of grid points.
+
+    Parameters
+    ----------
+    range_map
+        Maps from a template name to a range defining values for that template.
+    divisions
+        How many slices to divide each numeric range into.
+
+    Yields
+    ------
+    Dict[str, str]
+        A substitution for one point on the sampled grid.
+    """
+    template_names, template_ranges = zip(*range_map.items())
+    grids = [rng.grid(divisions) for rng in template_ranges]
+    for combination in itertools.product(*grids):
+        yield dict(zip(template_names, combination))
 
 
-def grid(range_map: Dict[str, ranges.Range], divisions: int) -> List[Dict[str, str]]:
+def grid_size(range_map: Dict[str, ranges.Range], divisions: int) -> int:
     """
-    Get a list of all substitutions to run in a grid search.
+    Count the substitutions generated by a grid search, without generating them.
 
     Parameters
     ----------
@@ -79,10 +196,10 @@ def grid(range_map: Dict[str, ranges.Range], divisions: int) -> List[Dict[str, s
 
     Returns
     -------
-    List[Dict[str, str]]
-        A list of substitutions, for each point on the sampled grid.
+    int
+        The number of points on the sampled grid.
     """
-    template_names, template_ranges = zip(*range_map.items())
-    grids = [rng.grid(divisions) for rng in template_ranges]
-    combinations = list(itertools.product(*grids))
-    return [dict(zip(template_names, combination)) for combination in combinations]
+    size = 1
+    for rng in range_map.values():
+        size *= len(rng.grid(divisions))
+    return size
@@ -0,0 +1,216 @@
+"""
+Collects the output streams of running commands, in memory or spilled to disk.
+"""
+
+import gzip
+import os
+import subprocess
+import threading
+from typing import IO, Any, Callable, List, Optional
+
+# Supported compression formats for spilled output, and their file extensions.
+COMPRESSIONS = {"gzip": ".gz", "zstd": ".zst"}
+
+# How much of the end of each spilled stream to keep in memory, in bytes.
+DEFAULT_TAIL_BYTES = 64 * 1024
+
+READ_CHUNK_BYTES = 64 * 1024
+
+# The longest line passed to an `OutputCollector`'s `on_line`, in bytes. Longer lines
+# (such as progress bars redrawn with carriage returns) are skipped, rather than
+# buffered without bound.
+MAX_LINE_BYTES = 64 * 1024
+
+
+def decode_output(data: bytes) -> str:
+    """
+    Decode a command's raw output the way `subprocess` does in text mode, with
+    universal newlines, but without failing on invalid UTF-8.
+    """
+    text = data.decode("utf-8", errors="replace")
+    return text.replace("\r\n", "\n").replace("\r", "\n")
+
+
+def check_compression(compression: Optional[str]) -> None:
+    """
+    Raise an error if `compression` is not a supported and available format.
+    """
+    if compression is None or compression == "gzip":
+        return
+    if compression == "zstd":
+        try:
+            import zstandard  # noqa: F401
+        except ImportError:
+            raise ImportError(
+                "zstd compression requires the zstandard package: "
+                "pip install argsearch[zstd]"
+            )
+        return
+    raise ValueError(f"Unrecognized compression: {compression}.")
+
+
+def open_spill_file(path: str, compression: Optional[str]) -> IO[bytes]:
+    """
+    Open a file to write a spilled output stream to.
+
+    Parameters
+    ----------
+    path
+        Where to write the stream.
+    compression
+        None for an uncompressed file, or one of `COMPRESSIONS`. zstd compression
+        requires the optional `zstandard` package.
+
+    Returns
+    -------
+    IO[bytes]
+        A writable binary file object.
+    """
+    check_compression(compression)
+    if compression is None:
+        return open(path, "wb")
+    if compression == "gzip":
+        return gzip.open(path, "wb", compresslevel=6)  # type: ignore
+
+    import zstandard
+
+    return zstandard.ZstdCompressor().stream_writer(open(path, "wb"))
+
+
+class OutputCollector:
+    """
+    Collects one output stream (stdout or stderr) of a running command.
+
+    By default, the whole stream is kept in memory. If `path` is given, the stream is
+    written to that file instead, and only its last `tail_bytes` bytes are kept in
+    memory. Uncompressed streams are written by the child process directly, so they
+    never pass through this process at all, unless `on_line` is given.
+
+    If `on_line` is given, it is called from a background thread with each complete
+    line of output (decoded, including the newline) as soon as it arrives. Lines longer
+    than `MAX_LINE_BYTES` are skipped.
+
+    Usage: pass `popen_target()` to `subprocess.Popen`, then call `start()` with the
+    process's corresponding stream, then `finish()` once the process has exited.
+    """
+
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        compression: Optional[str] = None,
+        tail_bytes: int = DEFAULT_TAIL_BYTES,
+        on_line: Optional[Callable[[str], None]] = None,
+    ):
+        self.path = path
+        self.compression = compression
+        self.tail_bytes = tail_bytes
+        self.on_line = on_line
+        # Whether the child writes straight to the output file.
+        self._direct = path is not None and compression is None and on_line is None
+        self._partial_line = b""
+        # Whether the rest of an overlong line is being skipped.
+        self._skipping_line = False
+        self._chunks: List[bytes] = []
+        self._tail = bytearray()
+        self._sink: Optional[IO[bytes]] = None
+        self._thread: Optional[threading.Thread] = None
+
+    def popen_target(self) -> Any:
+        """
+        Get the value to pass as this stream's argument to `subprocess.Popen`.
+        """
+        if self.path is None:
+            return subprocess.PIPE
+        self._sink = open_spill_file(self.path, self.compression)
+        if self._direct:
+            return self._sink
+        return subprocess.PIPE
+
+    def start(self, stream: Optional[IO[bytes]]) -> None:
+        """
+        Start collecting from the process's stream, if it was piped to this process.
+        """
+        if self._direct:
+            # The child has its own handle to the file; ours is no longer needed.
+            assert self._sink
+            self._sink.close()
+            return
+
+        assert stream
+        self._thread = threading.Thread(target=self._read, args=(stream,), daemon=True)
+        self._thread.start()
+
+    def _read(self, stream: IO[bytes]) -> None:
+        file_descriptor = stream.fileno()
+        while True:
+            chunk = os.read(file_descriptor, READ_CHUNK_BYTES)
+            if not chunk:
+                break
+
+            if self.on_line is not None:
+                self._split_lines(chunk)
+
+            if self._sink is None:
+                self._chunks.append(chunk)
+                continue
+
+            self._sink.write(chunk)
+            self._tail += chunk
+            # Trim lazily, so the tail is copied O(1) times per byte on average.
+            if len(self._tail) > 2 * self.tail_bytes:
+                del self._tail[: len(self._tail) - self.tail_bytes]
+        stream.close()
+
+        if self.on_line is not None and self._partial_line:
+            self.on_line(decode_output(self._partial_line))
+
+    def _split_lines(self, chunk: bytes) -> None:
+        assert self.on_line
+        lines = (self._partial_line + chunk).split(b"\n")
+        self._partial_line = lines.pop()
+        if self._skipping_line:
+            if not lines:
+                self._partial_line = b""
+                return
+            lines.pop(0)
+            self._skipping_line = False
+        for line in lines:
+            self.on_line(decode_output(line + b"\n"))
+        if len(self._partial_line) > MAX_LINE_BYTES:
+            self._partial_line = b""
+            self._skipping_line = True
+
+    def fail(self, message: str) -> str:
+        """
+        Collect `message` as the whole stream of a command which couldn't be started,
+        instead of calling `start()` and `finish()`, and get its collected text.
+        """
+        if self._sink is not None:
+            self._sink.write(message.encode("utf-8"))
+            self._sink.close()
+        return message
+
+    def finish(self) -> str:
+        """
+        Wait for the stream to close, and get its collected text.
+
+        Returns
+        -------
+        str
+            The whole stream if it was kept in memory, or else its last `tail_bytes`
+            bytes.
+        """
+        if self._thread is not None:
+            self._thread.join()
+
+        if self.path is None:
+            return decode_output(b"".join(self._chunks))
+
+        if not self._direct:
+            assert self._sink
+            self._sink.close()
+            return decode_output(bytes(self._tail[len(self._tail) - self.tail_bytes :]))
+
+        with open(self.path, "rb") as file:
+            file.seek(max(0, os.path.getsize(self.path) - self.tail_bytes))
+            return decode_output(file.read())
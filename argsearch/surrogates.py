@@ -0,0 +1,309 @@
+"""
+Surrogate models for Bayesian optimization, trading model quality for speed.
+
+The default Gaussian process costs O(n^3) to fit after n trials, which dominates long
+optimization runs. Tree ensembles fit in roughly O(n log n), and the TPE density
+estimator needs no fitting at all. Any skopt-based surrogate can also be refit only
+every few results, which bounds the time spent per trial.
+"""
+
+import copy
+from typing import Any, List, Optional
+
+import numpy as np
+import skopt
+from skopt.acquisition import _gaussian_acquisition
+from skopt.learning import GradientBoostingQuantileRegressor
+from sklearn.ensemble import GradientBoostingRegressor
+from sklearn.utils import check_random_state
+
+# Maps --surrogate choices to skopt's names for their base estimators. TPE is not an
+# skopt estimator; see `TPEOptimizer`.
+SURROGATES = {"gp": "GP", "rf": "RF", "et": "ET", "gbrt": "GBRT", "tpe": None}
+
+DEFAULT_INITIAL_POINTS = 10
+
+
+class _GradientBoostingQuantileRegressor(GradientBoostingQuantileRegressor):
+    """
+    skopt's gradient boosting regressor, patched to work with scikit-learn >= 1.6 and
+    NumPy >= 2.
+    """
+
+    def __sklearn_tags__(self):
+        tags = super().__sklearn_tags__()
+        tags.estimator_type = "regressor"
+        return tags
+
+    def predict(self, X, return_std=False, return_quantiles=False):
+        if return_quantiles or not return_std:
+            return super().predict(X, return_quantiles=return_quantiles)
+        low, mean, high = (
+            self.regressors_[self.quantiles.index(quantile)].predict(X)
+            for quantile in (0.16, 0.5, 0.84)
+        )
+        return mean, (high - low) / 2.0
+
+
+class ScheduledOptimizer(skopt.Optimizer):
+    """
+    An skopt optimizer which only refits its surrogate model every `refit_interval`
+    results, and otherwise proposes points from the ranking of the last fit.
+
+    Each fit ranks a fresh sample of candidate points by their acquisition value.
+    Between fits, `ask` returns the best-ranked candidate that hasn't been told yet,
+    so points told as constant-liar placeholders are skipped, and copies made for
+    batch or asynchronous proposals are cheap.
+    """
+
+    def __init__(self, *args: Any, refit_interval: int = 1, **kwargs: Any):
+        self.refit_interval = refit_interval
+        self._fitted_count = 0
+        self._speculative = False
+        self._ranked: List[np.ndarray] = []
+        super().__init__(*args, **kwargs)
+
+    def _tell(self, x, y, fit=True):
+        if self.refit_interval == 1:
+            return super()._tell(x, y, fit=fit)
+
+        count = len(y) if np.ndim(y) > 0 else 1
+        due = not self.models or (
+            len(self.yi) + count - self._fitted_count >= self.refit_interval
+        )
+        fit = fit and due and not self._speculative
+        result = super()._tell(x, y, fit=fit)
+        if fit and self.models:
+            self._fitted_count = len(self.yi)
+            self._rank_candidates()
+        return result
+
+    def _rank_candidates(self) -> None:
+        candidates = self.space.transform(
+            self.space.rvs(n_samples=self.n_points, random_state=self.rng)
+        )
+        acq_func = "EI" if self.acq_func == "gp_hedge" else self.acq_func
+        values = _gaussian_acquisition(
+            X=candidates,
+            model=self.models[-1],
+            y_opt=np.min(self.yi),
+            acq_func=acq_func,
+            acq_func_kwargs=self.acq_func_kwargs,
+        )
+        ranked = candidates[np.argsort(values)]
+        # Popped from the end, best first.
+        self._ranked = [ranked[i] for i in range(len(ranked) - 1, -1, -1)]
+        self._ranked.append(self.space.transform([self._next_x])[0])
+
+    def _ask(self):
+        if self.refit_interval == 1 or self._n_initial_points > 0:
+            return super()._ask()
+
+        while self._ranked:
+            point = self.space.inverse_transform(self._ranked.pop().reshape(1, -1))[0]
+            if point not in self.Xi:
+                return point
+        # Before the first fit (e.g. in a copy whose placeholders used up the initial
+        # points), or once every ranked candidate has been used.
+        return self.space.rvs(random_state=self.rng)[0]
+
+    def copy(self, random_state=None):
+        if self.refit_interval == 1:
+            return super().copy(random_state)
+
+        # A shallow copy which shares the fitted models, and never refits them.
+        optimizer = copy.copy(self)
+        optimizer.Xi = list(self.Xi)
+        optimizer.yi = list(self.yi)
+        optimizer.models = list(self.models)
+        optimizer._ranked = list(self._ranked)
+        optimizer.cache_ = {}
+        optimizer.rng = check_random_state(random_state)
+        optimizer._speculative = True
+        return optimizer
+
+
+class TPEOptimizer:
+    """
+    A Tree-structured Parzen Estimator, with the parts of the `skopt.Optimizer`
+    interface that argsearch uses.
+
+    Observations are split into the best `gamma` fraction and the rest, and each is
+    modeled by an independent kernel density per dimension. Each proposal is the
+    candidate, sampled from the good density, which maximizes the ratio of the good
+    density to the bad one. Proposals cost O(n) and need no fitting, so this scales to
+    many thousands of trials.
+    """
+
+    def __init__(
+        self,
+        dimensions: List[Any],
+        n_initial_points: int = DEFAULT_INITIAL_POINTS,
+        gamma: float = 0.1,
+        n_candidates: int = 24,
+        random_state: Any = None,
+    ):
+        self.space = skopt.space.Space(dimensions)
+        self.n_initial_points = n_initial_points
+        self.gamma = gamma
+        self.n_candidates = n_candidates
+        self.rng = check_random_state(random_state)
+        self.Xi: List[List[Any]] = []
+        self.yi: List[float] = []
+
+    def copy(self, random_state: Any = None) -> "TPEOptimizer":
+        optimizer = copy.copy(self)
+        optimizer.Xi = list(self.Xi)
+        optimizer.yi = list(self.yi)
+        optimizer.rng = check_random_state(random_state)
+        return optimizer
+
+    def tell(self, x: List[Any], y: Any, fit: bool = True) -> None:
+        if np.ndim(y) > 0:
+            self.Xi.extend(x)
+            self.yi.extend(y)
+        else:
+            self.Xi.append(x)
+            self.yi.append(y)
+
+    def ask(self, n_points: Optional[int] = None) -> Any:
+        if n_points is None:
+            return self._ask()
+        # Proposals are randomized, so a batch is just independent proposals.
+        return [self._ask() for _ in range(n_points)]
+
+    def _ask(self) -> List[Any]:
+        if len(self.yi) < self.n_initial_points:
+            return self.space.rvs(random_state=self.rng)[0]
+
+        order = np.argsort(self.yi)
+        num_good = max(1, min(int(np.ceil(self.gamma * len(order))), 25))
+        good, bad = order[:num_good], order[num_good:]
+
+        scores = np.zeros(self.n_candidates)
+        columns = []
+        for i, dimension in enumerate(self.space.dimensions):
+            values = [point[i] for point in self.Xi]
+            if isinstance(dimension, skopt.space.Categorical):
+                column, score = self._propose_categorical(dimension, values, good, bad)
+            else:
+                column, score = self._propose_numeric(dimension, values, good, bad)
+            columns.append(column)
+            scores += score
+
+        best = int(np.argmax(scores))
+        return [column[best] for column in columns]
+
+    def _propose_categorical(self, dimension, values, good, bad):
+        categories = list(dimension.categories)
+        index = {category: i for i, category in enumerate(categories)}
+        indices = np.array([index[value] for value in values])
+        good_probs = np.bincount(indices[good], minlength=len(categories)) + 1.0
+        good_probs /= good_probs.sum()
+        bad_probs = np.bincount(indices[bad], minlength=len(categories)) + 1.0
+        bad_probs /= bad_probs.sum()
+
+        samples = self.rng.choice(len(categories), self.n_candidates, p=good_probs)
+        score = np.log(good_probs[samples]) - np.log(bad_probs[samples])
+        return [categories[i] for i in samples], score
+
+    def _propose_numeric(self, dimension, values, good, bad):
+        log_scale = dimension.prior == "log-uniform"
+        low, high = float(dimension.low), float(dimension.high)
+        if log_scale:
+            low, high = np.log(low), np.log(high)
+        width = (high - low) or 1.0
+
+        def to_unit(x):
+            x = np.asarray(x, dtype=float)
+            return ((np.log(x) if log_scale else x) - low) / width
+
+        unit = to_unit(values)
+        good_centers, bad_centers = unit[good], unit[bad]
+
+        # Sample from the good density: a uniform prior plus a kernel per point.
+        components = self.rng.randint(0, len(good_centers) + 1, self.n_candidates)
+        bandwidth = _bandwidth(good_centers)
+        samples = self.rng.uniform(0, 1, self.n_candidates)
+        from_kernel = components < len(good_centers)
+        samples[from_kernel] = good_centers[
+            components[from_kernel]
+        ] + bandwidth * self.rng.normal(size=from_kernel.sum())
+        samples = np.clip(samples, 0, 1)
+
+        if isinstance(dimension, skopt.space.Integer):
+            raw = low + samples * width
+            raw = np.exp(raw) if log_scale else raw
+            raw = np.clip(np.round(raw), dimension.low, dimension.high)
+            samples = to_unit(raw)
+            column = [int(value) for value in raw]
+        else:
+            raw = low + samples * width
+            raw = np.exp(raw) if log_scale else raw
+            column = list(np.clip(raw, dimension.low, dimension.high))
+
+        score = _log_density(samples, good_centers) - _log_density(
+            samples, bad_centers
+        )
+        return column, score
+
+
+def _bandwidth(centers: np.ndarray) -> float:
+    """
+    Choose a kernel bandwidth (in unit coordinates) with Scott's rule.
+    """
+    if len(centers) < 2:
+        return 0.25
+    return float(max(0.02, np.std(centers) * len(centers) ** (-1 / 5)))
+
+
+def _log_density(x: np.ndarray, centers: np.ndarray) -> np.ndarray:
+    """
+    Evaluate a mixture of a uniform prior on [0, 1] and a Gaussian kernel per center.
+    """
+    density = np.ones_like(x)
+    if len(centers):
+        bandwidth = _bandwidth(centers)
+        offsets = (x[:, None] - centers[None, :]) / bandwidth
+        kernels = np.exp(-0.5 * offsets ** 2) / (bandwidth * np.sqrt(2 * np.pi))
+        density += kernels.sum(axis=1)
+    return np.log(density / (len(centers) + 1))
+
+
+def make_optimizer(
+    dimensions: List[Any], surrogate: str = "gp", refit_interval: int = 1
+) -> Any:
+    """
+    Create an optimizer over a search space.
+
+    Parameters
+    ----------
+    dimensions
+        The skopt dimensions of the search space.
+    surrogate
+        The surrogate model, one of `SURROGATES`.
+    refit_interval
+        Refit the surrogate model only after this many new results. Ignored for TPE,
+        which has no model to fit.
+
+    Returns
+    -------
+    Any
+        An `skopt.Optimizer` or a `TPEOptimizer`, which share an interface.
+    """
+    if surrogate not in SURROGATES:
+        raise ValueError(f"Unrecognized surrogate: {surrogate}.")
+    if surrogate == "tpe":
+        return TPEOptimizer(dimensions)
+
+    base_estimator: Any = SURROGATES[surrogate]
+    if surrogate == "gbrt":
+        base_estimator = _GradientBoostingQuantileRegressor(
+            base_estimator=GradientBoostingRegressor(loss="quantile", n_estimators=30)
+        )
+    return ScheduledOptimizer(
+        dimensions,
+        base_estimator=base_estimator,
+        n_jobs=-1,
+        refit_interval=refit_interval,
+    )
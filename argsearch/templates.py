@@ -0,0 +1,124 @@
+"""
+Command templates, parsed once so that each trial only has to fill in values.
+"""
+
+import re
+import shlex
+from typing import Dict, List, Optional, Set, Tuple, Union
+
+from argsearch import python_targets
+
+# Splits a string into literal text and "{name}" templates, keeping both.
+TEMPLATE_PATTERN = re.compile(r"(\{[^{}]*\})")
+
+# One part of a token: literal text, or a template (its bracketed text and its name).
+Piece = Tuple[str, Optional[str]]
+
+
+def _parse_pieces(text: str) -> List[Piece]:
+    pieces: List[Piece] = []
+    for part in TEMPLATE_PATTERN.split(text):
+        if not part:
+            continue
+        if TEMPLATE_PATTERN.fullmatch(part):
+            pieces.append((part, part[1:-1]))
+        else:
+            pieces.append((part, None))
+    return pieces
+
+
+class CommandTemplate:
+    """
+    A command with "{name}" bracketed templates, prepared for running many times.
+
+    By default, the command is a string for the shell, as with
+    `commands.apply_substitutions`. With `shell=False`, it is split into arguments once,
+    like a shell would split it, and each trial runs the program directly, with each
+    substituted value kept inside the argument it appears in. This skips starting a
+    shell for every trial, and keeps values from being interpreted by one, but also
+    rules out shell features like pipes, redirection and variable expansion.
+
+    A command starting with "py:" names a Python function to call instead, and is
+    always split into arguments; see `python_targets`.
+
+    Templates without a substitution, such as the braces in `awk '{print $1}'`, are
+    left as they are.
+    """
+
+    def __init__(self, template: str, shell: bool = True):
+        self.template = template
+        self.python = python_targets.is_python_target(template)
+        self.shell = shell and not self.python
+        if self.python:
+            tokens = shlex.split(template[len(python_targets.PREFIX) :])
+        else:
+            tokens = [template] if shell else shlex.split(template)
+        if not tokens:
+            raise ValueError("The command is empty.")
+        # Each token is either a fixed string, or the pieces to fill in.
+        self._tokens: List[Union[str, List[Piece]]] = []
+        for token in tokens:
+            pieces = _parse_pieces(token)
+            if any(name is not None for _, name in pieces):
+                self._tokens.append(pieces)
+            else:
+                self._tokens.append(token)
+
+    @property
+    def names(self) -> Set[str]:
+        """
+        The names of the templates in the command.
+        """
+        return {
+            name
+            for token in self._tokens
+            if not isinstance(token, str)
+            for _, name in token
+            if name is not None
+        }
+
+    @property
+    def executable(self) -> Optional[str]:
+        """
+        The program a `shell=False` template runs, or None if it is itself templated.
+        """
+        if self.shell or self.python or not isinstance(self._tokens[0], str):
+            return None
+        return self._tokens[0]
+
+    def _fill(self, substitutions: Dict[str, str]) -> List[str]:
+        return [
+            token
+            if isinstance(token, str)
+            else "".join(
+                literal if name is None else substitutions.get(name, literal)
+                for literal, name in token
+            )
+            for token in self._tokens
+        ]
+
+    def render(
+        self, substitutions: Dict[str, str]
+    ) -> Tuple[str, Union[str, List[str]]]:
+        """
+        Fill in a set of substitutions.
+
+        Parameters
+        ----------
+        substitutions
+            Maps from a bracketed template name to a value to substitute.
+
+        Returns
+        -------
+        Tuple[str, Union[str, List[str]]]
+            The command as a string, for display and caching, and what to run: the
+            same string for the shell, or else a list of arguments (for a Python
+            target, starting with its "module:function").
+        """
+        arguments = self._fill(substitutions)
+        if self.shell:
+            return arguments[0], arguments[0]
+        command = " ".join(shlex.quote(argument) for argument in arguments)
+        if self.python:
+            command = python_targets.PREFIX + command
+        return command, arguments
@@ -0,0 +1,186 @@
+"""
+Records a timeline of a run in the Chrome trace event format, which can be loaded into
+https://ui.perfetto.dev or chrome://tracing.
+
+Each trial is drawn on the row of the worker slot it occupied, split into the time it
+spent queued for a worker, starting up, running, and having its result collected and
+returned. Optimizer phases (replaying a journal, asking for points and telling
+results) get a row of their own, so gaps in worker utilization can be traced back to
+their cause.
+"""
+
+import contextlib
+import json
+import threading
+import time
+from typing import IO, Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+# Trace "processes" (groups of rows) in the viewer.
+SCHEDULER_PID = 0
+TRIALS_PID = 1
+
+# The row for optimizer phases, within the scheduler group.
+OPTIMIZER_TID = 0
+
+
+def _microseconds(seconds: float) -> float:
+    return seconds * 1e6
+
+
+class Tracer:
+    """
+    Writes trace events to a file as a run progresses.
+
+    Events are written in the JSON array format, which trace viewers accept even
+    without its closing bracket, so a trace survives the run being killed.
+
+    All timestamps are wall-clock times, so that the start times reported by worker
+    processes (or by workers on other machines, if their clocks are synchronized) line
+    up with the scheduler's.
+
+    Spans may be recorded from any thread, such as the optimizer's background thread.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file: IO[str] = open(path, "w", encoding="utf-8")
+        self._write_lock = threading.Lock()
+        self._first_event = True
+        # Maps the step of each dispatched trial to when it was dispatched.
+        self._submitted: Dict[Any, float] = {}
+        # Maps steps to the worker slot (trace row) they occupy, and lists free slots.
+        self._lanes: Dict[Any, int] = {}
+        self._free_lanes: List[int] = []
+        self._num_lanes = 0
+
+        self._write(self._metadata("process_name", SCHEDULER_PID, name="argsearch"))
+        self._write(
+            self._metadata(
+                "thread_name", SCHEDULER_PID, OPTIMIZER_TID, name="optimizer"
+            )
+        )
+        self._write(self._metadata("process_name", TRIALS_PID, name="worker slots"))
+
+    @staticmethod
+    def _metadata(kind: str, pid: int, tid: int = 0, **args: Any) -> Dict[str, Any]:
+        return {"name": kind, "ph": "M", "pid": pid, "tid": tid, "args": args}
+
+    def _write(self, event: Dict[str, Any]) -> None:
+        with self._write_lock:
+            self._file.write("[\n" if self._first_event else ",\n")
+            self._first_event = False
+            self._file.write(json.dumps(event))
+
+    def complete(
+        self,
+        name: str,
+        start: float,
+        end: float,
+        pid: int = SCHEDULER_PID,
+        tid: int = OPTIMIZER_TID,
+        **args: Any,
+    ) -> None:
+        """
+        Record a span of time on one row of the trace.
+
+        Parameters
+        ----------
+        name
+            What happened during the span.
+        start, end
+            Wall-clock times, in seconds since the epoch.
+        pid, tid
+            The group and row to draw the span on.
+        args
+            Extra details, shown when the span is selected.
+        """
+        event = {
+            "name": name,
+            "ph": "X",
+            "ts": _microseconds(start),
+            "dur": _microseconds(max(0.0, end - start)),
+            "pid": pid,
+            "tid": tid,
+        }
+        if args:
+            event["args"] = args
+        self._write(event)
+
+    def submitted(self, step: Any) -> None:
+        """
+        Record that a trial has been dispatched to a worker, and assign it a row.
+        """
+        self._submitted[step] = time.time()
+        if self._free_lanes:
+            lane = self._free_lanes.pop()
+        else:
+            lane = self._num_lanes
+            self._num_lanes += 1
+            self._write(
+                self._metadata("thread_name", TRIALS_PID, lane, name=f"slot {lane}")
+            )
+        self._lanes[step] = lane
+
+    def track(
+        self, packed_args: Iterable[Optional[Tuple[Any, ...]]]
+    ) -> Iterator[Optional[Tuple[Any, ...]]]:
+        """
+        Record each set of packed `commands.capture_command` arguments as dispatched
+        as it is pulled from `packed_args`.
+        """
+        for args in packed_args:
+            if args is not None:
+                self.submitted(args[2])
+            yield args
+
+    def completed(self, output: Dict[str, Any]) -> None:
+        """
+        Record the lifecycle of a finished trial, given its result.
+        """
+        received = time.time()
+        step = output["step"]
+        submitted = self._submitted.pop(step, received)
+        lane = self._lanes.pop(step, 0)
+        self._free_lanes.append(lane)
+        details = {"step": step, "command": output["command"]}
+
+        start_time = output.get("started_at")
+        if output.get("cached") or start_time is None:
+            self.complete("cached", submitted, received, TRIALS_PID, lane, **details)
+            return
+
+        spawned = start_time + output["spawn_seconds"]
+        exited = start_time + output["wall_seconds"]
+        self.complete("queued", submitted, start_time, TRIALS_PID, lane, **details)
+        self.complete("spawn", start_time, spawned, TRIALS_PID, lane, **details)
+        self.complete(
+            "run",
+            spawned,
+            exited,
+            TRIALS_PID,
+            lane,
+            returncode=output.get("returncode"),
+            **details,
+        )
+        self.complete("collect", exited, received, TRIALS_PID, lane, **details)
+
+    def close(self) -> None:
+        if not self._first_event:
+            self._file.write("\n]\n")
+        self._file.close()
+
+
+@contextlib.contextmanager
+def span(tracer: Optional[Tracer], name: str, **args: Any) -> Iterator[None]:
+    """
+    Record the time spent in a block on the optimizer's row, if `tracer` is given.
+    """
+    if tracer is None:
+        yield
+        return
+
+    start = time.time()
+    try:
+        yield
+    finally:
+        tracer.complete(name, start, time.time(), **args)
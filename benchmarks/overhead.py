@@ -0,0 +1,278 @@
+"""
+Overhead benchmark suite.
+
+Measures the time argsearch itself spends around the user's command:
+ - dispatch: trials per second with a no-op command, sequentially and with pools;
+ - capture: the cost of capturing output, against output size;
+ - strategies: time and peak memory to generate substitutions at large sizes;
+ - optimizer: ask/tell latency against the number of results already told.
+
+Run from the repository root:
+
+    python -m benchmarks.overhead [--quick] [--sections NAME ...] [--output PATH]
+
+Results are printed (or written to PATH) as JSON, so that runs from different versions
+can be compared.
+"""
+
+import argparse
+import contextlib
+import itertools
+import json
+import os
+import platform
+import statistics
+import tempfile
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from argsearch import commands, ranges, strategies
+
+# Sizes for a full run, and for a --quick run which finishes in seconds.
+FULL_SIZES = {
+    "dispatch_trials": 500,
+    "dispatch_workers": 8,
+    "capture_bytes": [1 << 10, 1 << 20, 16 << 20],
+    "capture_runs": 5,
+    "strategy_trials": 1_000_000,
+    "optimizer_histories": [10, 50, 100, 200],
+    "optimizer_runs": 3,
+}
+QUICK_SIZES = {
+    "dispatch_trials": 50,
+    "dispatch_workers": 4,
+    "capture_bytes": [1 << 10, 1 << 20],
+    "capture_runs": 2,
+    "strategy_trials": 20_000,
+    "optimizer_histories": [10, 30],
+    "optimizer_runs": 1,
+}
+
+NOOP_COMMAND = "true"
+
+# A search space mixing every kind of range.
+BENCHMARK_RANGES = {
+    "a": ranges.IntRange(0, 1000),
+    "b": ranges.LogIntRange(1, 1 << 20),
+    "c": ranges.FloatRange(-1.0, 1.0),
+    "d": ranges.LogFloatRange(1e-6, 1.0),
+    "e": ranges.CategoricalRange(["x", "y", "z"]),
+}
+
+
+@contextlib.contextmanager
+def _quiet():
+    """
+    Discard everything argsearch writes to stdout and stderr.
+    """
+    with open(os.devnull, "w") as devnull:
+        with contextlib.redirect_stdout(devnull), contextlib.redirect_stderr(devnull):
+            yield
+
+
+def _timed(func: Callable[[], Any]) -> float:
+    start = time.perf_counter()
+    func()
+    return time.perf_counter() - start
+
+
+def _consume(iterable: Iterable[Any]) -> int:
+    count = 0
+    for _ in iterable:
+        count += 1
+    return count
+
+
+def bench_dispatch(sizes: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Measure how many no-op trials per second each execution mode sustains.
+    """
+    trials = sizes["dispatch_trials"]
+    workers = sizes["dispatch_workers"]
+    modes = {
+        "sequential_stream": dict(),
+        "sequential_capture": dict(output_jsonl=True),
+        "sequential_capture_no_shell": dict(output_jsonl=True, shell=False),
+        "process_pool": dict(num_workers=workers, engine="process", output_jsonl=True),
+        "thread_pool": dict(num_workers=workers, engine="thread", output_jsonl=True),
+    }
+
+    results = {}
+    for name, options in modes.items():
+        substitutions: Iterator[Dict[str, str]] = itertools.repeat({}, trials)
+        with _quiet():
+            seconds = _timed(
+                lambda: commands.run_commands(
+                    NOOP_COMMAND, substitutions, disable_bar=True, **options
+                )
+            )
+        results[name] = {
+            "trials": trials,
+            "seconds": seconds,
+            "trials_per_second": trials / seconds,
+        }
+    return results
+
+
+def bench_capture(sizes: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Measure the cost of capturing a command's output, in memory and spilled to disk.
+    """
+    results: Dict[str, Any] = {"in_memory": {}, "spilled": {}}
+    with tempfile.TemporaryDirectory() as output_dir:
+        for size in sizes["capture_bytes"]:
+            command = f"head -c {size} /dev/zero | tr '\\0' x"
+            spill_dirs: List[Tuple[str, Optional[str]]] = [
+                ("in_memory", None),
+                ("spilled", output_dir),
+            ]
+            for mode, spill_dir in spill_dirs:
+                times = [
+                    _timed(
+                        lambda: commands.capture_command(
+                            command, {}, 0, None, output_dir=spill_dir
+                        )
+                    )
+                    for _ in range(sizes["capture_runs"])
+                ]
+                seconds = statistics.median(times)
+                results[mode][str(size)] = {
+                    "median_seconds": seconds,
+                    "megabytes_per_second": size / seconds / (1 << 20),
+                }
+    return results
+
+
+def bench_strategies(sizes: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Measure the time and peak memory to generate (and discard) many substitutions.
+    """
+    trials = sizes["strategy_trials"]
+    # Enough divisions that the grid has at least `trials` points.
+    divisions = int(np.ceil((trials / 3) ** (1 / 4)))
+    generators = {
+        "random": lambda: strategies.random(BENCHMARK_RANGES, trials),
+        "sobol": lambda: strategies.quasirandom(BENCHMARK_RANGES, trials),
+        "sobol_scrambled": lambda: strategies.quasirandom(
+            BENCHMARK_RANGES, trials, scramble=True, seed=0
+        ),
+        "halton": lambda: strategies.quasirandom(
+            BENCHMARK_RANGES, trials, sequence="halton"
+        ),
+        "grid": lambda: itertools.islice(
+            strategies.grid(BENCHMARK_RANGES, divisions), trials
+        ),
+    }
+
+    results = {}
+    for name, make_substitutions in generators.items():
+        seconds = _timed(lambda: _consume(make_substitutions()))
+
+        # Measured separately, since tracing slows allocation down.
+        tracemalloc.start()
+        _consume(make_substitutions())
+        _, peak_bytes = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        results[name] = {
+            "trials": trials,
+            "seconds": seconds,
+            "trials_per_second": trials / seconds,
+            "peak_bytes": peak_bytes,
+        }
+    return results
+
+
+def bench_optimizer(sizes: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Measure the latency of one ask/tell round against the history length, for each
+    surrogate model.
+    """
+    import warnings
+
+    from argsearch import surrogates
+
+    warnings.filterwarnings("ignore")
+    dimensions = [rng.to_skopt() for rng in BENCHMARK_RANGES.values()]
+
+    def objective(point: List[Any]) -> float:
+        return float(np.sin(point[0]) + point[2] ** 2 + np.log(point[3]))
+
+    results: Dict[str, Any] = {}
+    for surrogate in surrogates.SURROGATES:
+        results[surrogate] = {}
+        for history in sizes["optimizer_histories"]:
+            optimizer = surrogates.make_optimizer(dimensions, surrogate)
+            points = optimizer.space.rvs(n_samples=history, random_state=0)
+            optimizer.tell(points, [objective(point) for point in points])
+
+            times = []
+            for _ in range(sizes["optimizer_runs"]):
+                start = time.perf_counter()
+                point = optimizer.ask()
+                optimizer.tell(point, objective(point))
+                times.append(time.perf_counter() - start)
+            results[surrogate][str(history)] = {
+                "median_seconds": statistics.median(times)
+            }
+    return results
+
+
+SECTIONS = {
+    "dispatch": bench_dispatch,
+    "capture": bench_capture,
+    "strategies": bench_strategies,
+    "optimizer": bench_optimizer,
+}
+
+
+def run(sections: List[str], quick: bool = False) -> Dict[str, Any]:
+    """
+    Run the chosen benchmark sections, returning the results as a JSON-serializable
+    dict.
+    """
+    sizes = QUICK_SIZES if quick else FULL_SIZES
+    results: Dict[str, Any] = {
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "quick": quick,
+            "timestamp": time.time(),
+        }
+    }
+    for name in sections:
+        results[name] = SECTIONS[name](sizes)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument(
+        "--quick", action="store_true", help="use small sizes, for a smoke test"
+    )
+    parser.add_argument(
+        "--sections",
+        nargs="+",
+        choices=SECTIONS,
+        default=list(SECTIONS),
+        metavar="NAME",
+        help=f"which sections to run (default: all of {', '.join(SECTIONS)})",
+    )
+    parser.add_argument("--output", metavar="PATH", help="write results to PATH")
+    args = parser.parse_args()
+
+    results = run(args.sections, args.quick)
+    formatted = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(formatted + "\n")
+    else:
+        print(formatted)
+
+
+if __name__ == "__main__":
+    main()
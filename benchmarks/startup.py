@@ -0,0 +1,140 @@
+"""
+Startup-time regression benchmark.
+
+Checks that strategies other than `maximize` and `minimize` never import the heavy
+optimization stack (skopt, scikit-learn, scipy), and measures how long a trivial
+`argsearch` invocation takes compared to a bare Python interpreter.
+
+Run from the repository root:
+
+    python -m benchmarks.startup [--runs N] [--max-overhead SECONDS]
+
+Exits with a nonzero status if a forbidden module is imported or the startup overhead
+exceeds the limit.
+"""
+
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+import time
+from typing import Dict, List
+
+FORBIDDEN_MODULES = ["skopt", "sklearn", "scipy"]
+
+# Each entry is the argument list for one lightweight argsearch invocation.
+LIGHT_INVOCATIONS = {
+    "repeat": ["--disable-bar", "repeat", "1", "true"],
+    "grid": ["--disable-bar", "grid", "2", "true {a}", "--a", "1", "2"],
+    "random": ["--disable-bar", "random", "2", "true {a}", "--a", "0.0", "1.0"],
+    "quasirandom": [
+        "--disable-bar", "quasirandom", "2", "true {a}", "--a", "0.0", "1.0"
+    ],
+    "refine": [
+        "--disable-bar", "--output-json", "refine", "2", "echo {a}", "--a", "1", "2"
+    ],
+    "hyperband": [
+        "--disable-bar", "--output-json", "hyperband", "--budget", "steps", "2",
+        "true {steps}; echo {a}", "--a", "0.0", "1.0", "--steps", "1", "3",
+    ],
+}
+
+# Runs argsearch in-process, then reports which forbidden modules ended up loaded.
+IMPORT_CHECK_SCRIPT = """
+import json, sys
+from argsearch import interface
+forbidden = json.loads(sys.argv[2])
+sys.argv = ["argsearch"] + json.loads(sys.argv[1])
+interface.main()
+loaded = [name for name in forbidden if name in sys.modules]
+sys.stderr.write(json.dumps(loaded))
+"""
+
+
+def forbidden_imports(invocation: List[str]) -> List[str]:
+    """
+    Run an invocation in a fresh interpreter and list the forbidden modules it loads.
+    """
+    result = subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            IMPORT_CHECK_SCRIPT,
+            json.dumps(invocation),
+            json.dumps(FORBIDDEN_MODULES),
+        ],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        encoding="utf-8",
+        check=True,
+    )
+    return json.loads(result.stderr.strip().splitlines()[-1])
+
+
+def median_runtime(argv: List[str], runs: int) -> float:
+    """
+    Get the median wall-clock time of running `argv` as a subprocess, in seconds.
+    """
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(argv, stdout=subprocess.DEVNULL, check=True)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def run(runs: int) -> Dict[str, object]:
+    """
+    Run the startup benchmark, returning the results as a JSON-serializable dict.
+    """
+    baseline = median_runtime([sys.executable, "-c", "pass"], runs)
+    results: Dict[str, object] = {"python_baseline_seconds": baseline}
+
+    for name, invocation in LIGHT_INVOCATIONS.items():
+        argv = [sys.executable, "-c", "from argsearch import main; main()"]
+        runtime = median_runtime(argv + invocation, runs)
+        results[name] = {
+            "median_seconds": runtime,
+            "overhead_seconds": runtime - baseline,
+            "forbidden_imports": forbidden_imports(invocation),
+        }
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument(
+        "--runs", type=int, default=10, help="timed runs per invocation"
+    )
+    parser.add_argument(
+        "--max-overhead",
+        type=float,
+        default=0.5,
+        metavar="SECONDS",
+        help="fail if any invocation is this much slower than bare Python",
+    )
+    args = parser.parse_args()
+
+    results = run(args.runs)
+    print(json.dumps(results, indent=2))
+
+    failures = []
+    for name in LIGHT_INVOCATIONS:
+        result = results[name]
+        if result["forbidden_imports"]:
+            failures.append(f"{name} imported {result['forbidden_imports']}")
+        if result["overhead_seconds"] > args.max_overhead:
+            failures.append(
+                f"{name} startup overhead {result['overhead_seconds']:.3f}s exceeds "
+                f"{args.max_overhead:.3f}s"
+            )
+
+    for failure in failures:
+        sys.stderr.write(f"FAIL: {failure}\n")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,42 @@
+import multiprocessing
+import multiprocessing.connection
+import socket
+import threading
+
+import pytest
+
+from argsearch import commands, distributed
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def test_remote_pool_on_localhost(monkeypatch):
+    monkeypatch.setenv(distributed.AUTHKEY_VARIABLE, "secret")
+    address = ("127.0.0.1", free_port())
+    pool = distributed.RemotePool(address, distributed.get_authkey())
+    worker = threading.Thread(
+        target=distributed.run_worker, args=(address, 2), kwargs={"connect_timeout": 10}
+    )
+    worker.start()
+
+    tasks = [("echo {x}", {"x": str(x)}, x, None) for x in range(5)]
+    outputs = list(pool.imap(commands._capture_command_packed, tasks))
+    assert [output["stdout"] for output in outputs] == [f"{x}\n" for x in range(5)]
+    assert all(output["returncode"] == 0 for output in outputs)
+
+    # Once the queued tasks are done, closing the pool dismisses the workers.
+    pool.close()
+    worker.join(timeout=10)
+    assert not worker.is_alive()
+
+
+def test_remote_pool_rejects_wrong_authkey():
+    address = ("127.0.0.1", free_port())
+    pool = distributed.RemotePool(address, b"secret")
+    with pytest.raises(multiprocessing.AuthenticationError):
+        multiprocessing.connection.Client(address, authkey=b"wrong")
+    pool.close()
@@ -0,0 +1,39 @@
+import json
+
+from argsearch import optimization, ranges
+
+
+def optimize(journal_path, trials, resume):
+    optimization.optimize_command(
+        "echo {x}",
+        {"x": ranges.IntRange(0, 1000)},
+        trials,
+        maximize=False,
+        output_json=True,
+        num_workers=1,
+        disable_bar=True,
+        journal_path=journal_path,
+        resume=resume,
+        engine="thread",
+    )
+
+
+def test_resume_after_crash_twice(tmp_path, capsys):
+    journal_path = str(tmp_path / "journal.jsonl")
+    optimize(journal_path, 4, resume=False)
+    # A crash while writing the last record leaves only part of it.
+    with open(journal_path, "r+", encoding="utf-8") as journal:
+        contents = journal.read()
+        journal.seek(0)
+        journal.truncate()
+        journal.write(contents[: contents.rindex("\n", 0, -1) + 20])
+
+    optimize(journal_path, 6, resume=True)
+    optimize(journal_path, 8, resume=True)
+    capsys.readouterr()
+
+    records = optimization.read_journal(journal_path)
+    assert len(records) == 8
+    with open(journal_path, encoding="utf-8") as journal:
+        for line in journal:
+            json.loads(line)
@@ -0,0 +1,51 @@
+import numpy as np
+import pytest
+from scipy.stats import qmc
+
+from argsearch import sequences
+
+
+def sorted_rows(points: np.ndarray) -> np.ndarray:
+    return points[np.lexsort(points.T[::-1])]
+
+
+@pytest.mark.parametrize("dimensions", [1, 2, 7, len(sequences.SOBOL_DIRECTIONS)])
+def test_sobol_matches_scipy(dimensions):
+    # The points come in a different order, but the first 2^m points of both sequences
+    # are the same set. Unscrambled sequences skip the origin, so it's added back.
+    log_count = 10
+    ours = sequences.SobolSequence(dimensions).points(0, 2 ** log_count - 1)
+    ours = np.vstack([np.zeros((1, dimensions)), ours])
+    reference = qmc.Sobol(dimensions, scramble=False).random_base2(log_count)
+    np.testing.assert_array_equal(sorted_rows(ours), sorted_rows(reference))
+
+
+def test_halton_matches_scipy():
+    ours = sequences.HaltonSequence(10).points(0, 1000)
+    reference = qmc.Halton(10, scramble=False).random(1001)[1:]
+    np.testing.assert_allclose(ours, reference)
+
+
+def test_scrambled_sobol_is_a_net():
+    # Scrambling keeps the net property: each of the 16 by 16 boxes of the unit square
+    # holds exactly one of the first 256 points.
+    for seed in range(5):
+        points = sequences.SobolSequence(2, scramble=True, seed=seed).points(0, 256)
+        boxes = np.floor(points * 16).astype(int)
+        counts = np.zeros((16, 16), dtype=int)
+        np.add.at(counts, (boxes[:, 0], boxes[:, 1]), 1)
+        assert (counts == 1).all()
+
+
+@pytest.mark.parametrize(
+    "sequence",
+    [
+        sequences.SobolSequence(len(sequences.SOBOL_DIRECTIONS), scramble=True, seed=0),
+        sequences.HaltonSequence(100, scramble=True, seed=0),
+    ],
+)
+def test_scrambled_points_in_unit_cube(sequence):
+    points = sequence.points(0, 4096)
+    assert ((points >= 0) & (points < 1)).all()
+    # Continuing a sequence generates the same points as generating them all at once.
+    np.testing.assert_array_equal(sequence.points(1000, 50), points[1000:1050])
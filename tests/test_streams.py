@@ -0,0 +1,33 @@
+import os
+
+import pytest
+
+from argsearch import streams
+
+
+def collect(data, **kwargs):
+    lines = []
+    collector = streams.OutputCollector(on_line=lines.append, **kwargs)
+    collector.popen_target()
+    read_end, write_end = os.pipe()
+    collector.start(os.fdopen(read_end, "rb"))
+    with os.fdopen(write_end, "wb") as stream:
+        stream.write(data)
+    return collector.finish(), lines
+
+
+@pytest.mark.parametrize("tail_bytes", [0, 1, 1000])
+def test_spilled_tail(tmp_path, tail_bytes):
+    data = b"".join(b"line %d\n" % i for i in range(50_000))
+    path = str(tmp_path / "stdout")
+    tail, lines = collect(data, path=path, tail_bytes=tail_bytes)
+    assert tail == data[len(data) - tail_bytes :].decode()
+    assert len(lines) == 50_000
+    with open(path, "rb") as file:
+        assert file.read() == data
+
+
+def test_overlong_lines_skipped():
+    overlong = b"x" * (3 * streams.MAX_LINE_BYTES)
+    _, lines = collect(b"first\n" + overlong + b"\nlast")
+    assert lines == ["first\n", "last"]